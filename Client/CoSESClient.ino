@@ -86,6 +86,8 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.*/
 // ----------------------------------------------------------------------------
 // --------- General Definitions ----------------------------------------------
 // Define the sample interval of the system (e.g. 5000 ms will make the Controllino output data from all sensors once every 5 senconds)
+// Faster sampling (e.g. 1000 ms) is downsampled by the RevPi (every sample carries its sampling time). It requires a lower
+// ADC resolution for the CMP3 pyranometers (18 bit = 3.75 samples per second, see ADC_18BIT)
 #define SENSOR_SAMPLE_RATE_MSEC   5000
 String SensorDataPackage;
 byte sampling_rounds = 0;
@@ -99,6 +101,49 @@ bool isRestarting = false;
 // Define the IP address and Port of the RevPi (eth0)
 IPAddress RevPi_IP(192, 168, 21, 100);
 #define REVPI_PORT_SOCKET   7785
+// Station ID announced to the RevPi (must be unique if multiple stations are connected to the same RevPi)
+// Allowed characters: A-Z, a-z, 0-9, '_' and '-' (max. 16 characters)
+#define STATION_ID    "main"
+
+// ----------------------------------------------------------------------------
+// --------- Binary protocol --------------------------------------------------
+// Comment this #define out to always send sensor data as text packages!
+// The binary protocol is requested after connecting and only used after the RevPi has confirmed it (command 'B')
+#define USE_BINARY_PROTOCOL
+#define BINARY_SYNC_1     0xA5
+#define BINARY_SYNC_2     0x5A
+#define BINARY_VERSION    1
+bool isBinaryProtocol = false;
+// Binary sensor frame (little-endian) - layout must match CoSESFraming.py on the RevPi
+struct __attribute__((packed)) SensorDataFrame 
+{
+  uint8_t sync[2];
+  uint8_t version;
+  uint8_t length; // payload length (seq to values)
+  uint16_t seq; // sequence number
+  uint32_t t_millis; // time of sampling (millis())
+  uint16_t status; // bit i set = sensor value i invalid
+  float values[8]; // wind, temp, spn1_radTot, spn1_radDiff, spn1_sun, rad_cmp1, rad_cmp2, rad_cmp3
+  uint16_t checksum; // Fletcher-16 of version to values
+};
+
+// ----------------------------------------------------------------------------
+// --------- Sample buffer ----------------------------------------------------
+// Every sample carries a sequence number and its sampling time (millis()), also in text packages. Samples are buffered
+// until they have been sent: while the connection to the RevPi is lost, the CONTROLLINO keeps sampling and tries to
+// reconnect. The buffered samples are then sent at once, the RevPi assigns their original sampling time and drops
+// duplicates by their sequence number
+#define SAMPLE_BUFFER_SIZE        48 // 48 samples = 4 minutes at 5 s (46 bytes each)
+#define SAMPLE_RESEND_COUNT       3 // the last samples sent before the connection was lost are sent again
+#define RECONNECT_INTERVAL_MSEC   5000
+#define RECONNECT_ATTEMPTS_MAX    12 // restart the CONTROLLINO if the RevPi cannot be reached for a minute
+SensorDataFrame sample_buffer[SAMPLE_BUFFER_SIZE];
+uint16_t frame_sequence = 0;
+byte sample_buffer_first = 0; // oldest buffered sample
+byte sample_buffer_count = 0; // number of buffered samples
+byte sample_buffer_sent = 0; // number of buffered samples that have already been sent (kept for a resend)
+unsigned long timestamp_last_connect;
+byte reconnect_attempts = 0;
 
 // Assign MAC and IP address to the Controllino
 byte Controllino_MAC[] = {0xDE, 0xAD, 0xBE, 0xEF, 0xFE, 0xED};
@@ -184,6 +229,7 @@ void setup()
   // Initialize some VARs  
   wdt_enable(WDTO_8S); // enable watchdog (8 sec)
   isRestarting = false;
+  isBinaryProtocol = false;
   isCommand_processing_ongoing = false;
   isConnectionError = false;
   sampling_rounds = 0;
@@ -256,16 +302,13 @@ void setup()
   if(!isConnectionError) // If Hardware has been detected and initialized successfully
   {
     // Connect to RevPi
-    if(client_eth.connect(RevPi_IP, REVPI_PORT_SOCKET)) 
+    if(connectToRevPi()) 
     {
-      DEBUG_PRINT("Established connection to RevPi at ");
-      DEBUG_PRINT_LN(client_eth.remoteIP());
-      isConnected = true;
       wdt_enable(WDTO_4S); // enable watchdog (reduce to 4 sec)
     } 
     else 
     {
-      DEBUG_PRINT_LN("Could not connect to the RevPi! Retrying in 5 seconds ...");
+      DEBUG_PRINT_LN("Retrying in 5 seconds ...");
       delay(5000);
       initiateRestart();
     }
@@ -275,205 +318,308 @@ void setup()
 
 void loop() 
 { 
-  if(isConnected) // if there is an active and valid connection
-  {   
-    // if the server has disconnected, stop the client:
-    if(!client_eth.connected()) 
+  // if the server has disconnected, keep sampling (samples are buffered) and try to reconnect
+  if(isConnected && !client_eth.connected()) 
+  {
+    isConnected = false; 
+    DEBUG_PRINT_LN("-------------- Lost connection to Server -----------------");
+    client_eth.stop();
+    sample_buffer_sent = 0; // the last samples sent might not have reached the RevPi: send them again
+    timestamp_last_connect = millis();
+  }
+  if(!isConnected && (millis()-timestamp_last_connect) > RECONNECT_INTERVAL_MSEC) 
+  {
+    timestamp_last_connect = millis();
+    if(!connectToRevPi() && ++reconnect_attempts >= RECONNECT_ATTEMPTS_MAX)
     {
-      isConnected = false; 
-      DEBUG_PRINT_LN("-------------- Lost connection to Server -----------------");
-      initiateRestart();
+      DEBUG_PRINT_LN("Could not reconnect to the RevPi!");
+      initiateRestart(); // buffered samples are lost
     }
-   
-    // if connected, send data to RevPi
-    if(client_eth.connected())
-    { 
-      // Check for incoming commands from RevPi
-      CB_OnCommandReceived();
-
-      // send sensor data according to defined sampling intervals
-      if((millis()-timestamp_last_sampling) > SENSOR_SAMPLE_RATE_MSEC) 
+  }
+
+  // Check for incoming commands from RevPi
+  if(isConnected)CB_OnCommandReceived();
+
+  // acquire sensor data according to defined sampling intervals
+  if((millis()-timestamp_last_sampling) > SENSOR_SAMPLE_RATE_MSEC) 
+  {
+    sampling_rounds++;
+    DEBUG_PRINT_LN("Current sampling time: " + String(millis() - timestamp_last_sampling) + " [ms]");
+    DEBUG_PRINT_LN("------------ Sensor Data ------------");  
+    timestamp_last_sampling = millis(); // update the timestamp
+            
+    // ----------------------------------------------------------------------------
+    // --------- SPN1 Pyranometer (request data) ----------------------------------
+    SPN1_SERIAL.print(SPN1_COMMAND); // Send command to SPN1 (request measurements)
+    // Data sent back from the SPN1 will be read later so the device has enough time to reply
+    
+    // Manage SPI-Bus: Deactivate Ethernet-Board (ensure that only one SPI slave is activa at a time)
+    digitalWrite(CONTROLLINO_ETHERNET_CHIP_SELECT, HIGH); // Deactivate SPI Slave (Ethernet)
+    digitalWrite(RTD_PT100_BOARD_CHIP_SELECT_PIN, LOW); // Activate SPI Slave (RTD PT100 Amp-Board)
+
+    // ----------------------------------------------------------------------------
+    // --------- Anemometer -------------------------------------------------------
+    noInterrupts(); // disable interrupts before reading volatile variables
+    if(anemometer_pulses == 0 || timestamp_duration == 0)windspeed = 0.0;
+    else windspeed = ((anemometer_pulses/((micros()-timestamp_duration)/1000000)) * 0.07881) + 0.32; // calculate windspeed according to formula given in datasheet
+    anemometer_pulses = 0;  
+    interrupts(); // re-enable interrupts after finished reading
+    timestamp_duration = micros();      
+    DEBUG_PRINT_LN("Anemometer: " + String(windspeed));
+    
+    // ----------------------------------------------------------------------------
+    // --------- RTD PT100 Sensor Amplifier Board---------------------------------- 
+    // This code is taken from the example code-files that show how temperature/resistance can be read out from the MAX31865:
+    // Link to code sources: https://github.com/adafruit/Adafruit_MAX31865/blob/master/examples/max31865/max31865.ino (Adafruit Industries)
+    //                       https://github.com/drhaney/pt100rtd/blob/master/examples/pt100_temperature/pt100_temperature.ino (drhaney)
+    uint16_t rtd, ohmsx100;
+    uint32_t rtd_dummy;        
+    //PT100_temp = max.temperature(RNOMINAL, RREF); // read temperature without lookup-table
+    rtd = max.readRTD(); // read resistance
+    // Use uint16_t (ohms * 100) since it matches data type in lookup table.
+    rtd_dummy = ((uint32_t)(rtd << 1)) * 100 * ((uint32_t) floor(RREF));
+    rtd_dummy >>= 16;
+    ohmsx100 = (uint16_t) (rtd_dummy & 0xFFFF);
+    PT100_temp = PT100.celsius(ohmsx100); // lookup temperature for determined resistance in lookup-table (empirical data)
+    uint8_t fault = max.readFault();
+    
+    #ifdef DEBUG   
+      Serial.print("PT100: "); Serial.println(PT100_temp); 
+      // Check and print any faults
+      if (fault) 
       {
-        sampling_rounds++;
-        DEBUG_PRINT_LN("Current sampling time: " + String(millis() - timestamp_last_sampling) + " [ms]");
-        DEBUG_PRINT_LN("------------ Sensor Data ------------");  
-        timestamp_last_sampling = millis(); // update the timestamp
-                
-        // ----------------------------------------------------------------------------
-        // --------- SPN1 Pyranometer (request data) ----------------------------------
-        SPN1_SERIAL.print(SPN1_COMMAND); // Send command to SPN1 (request measurements)
-        // Data sent back from the SPN1 will be read later so the device has enough time to reply
-        
-        // Manage SPI-Bus: Deactivate Ethernet-Board (ensure that only one SPI slave is activa at a time)
-        digitalWrite(CONTROLLINO_ETHERNET_CHIP_SELECT, HIGH); // Deactivate SPI Slave (Ethernet)
-        digitalWrite(RTD_PT100_BOARD_CHIP_SELECT_PIN, LOW); // Activate SPI Slave (RTD PT100 Amp-Board)
-
-        // ----------------------------------------------------------------------------
-        // --------- Anemometer -------------------------------------------------------
-        noInterrupts(); // disable interrupts before reading volatile variables
-        if(anemometer_pulses == 0 || timestamp_duration == 0)windspeed = 0.0;
-        else windspeed = ((anemometer_pulses/((micros()-timestamp_duration)/1000000)) * 0.07881) + 0.32; // calculate windspeed according to formula given in datasheet
-        anemometer_pulses = 0;  
-        interrupts(); // re-enable interrupts after finished reading
-        timestamp_duration = micros();      
-        DEBUG_PRINT_LN("Anemometer: " + String(windspeed));
-        
-        // ----------------------------------------------------------------------------
-        // --------- RTD PT100 Sensor Amplifier Board---------------------------------- 
-        // This code is taken from the example code-files that show how temperature/resistance can be read out from the MAX31865:
-        // Link to code sources: https://github.com/adafruit/Adafruit_MAX31865/blob/master/examples/max31865/max31865.ino (Adafruit Industries)
-        //                       https://github.com/drhaney/pt100rtd/blob/master/examples/pt100_temperature/pt100_temperature.ino (drhaney)
-        uint16_t rtd, ohmsx100;
-        uint32_t rtd_dummy;        
-        //PT100_temp = max.temperature(RNOMINAL, RREF); // read temperature without lookup-table
-        rtd = max.readRTD(); // read resistance
-        // Use uint16_t (ohms * 100) since it matches data type in lookup table.
-        rtd_dummy = ((uint32_t)(rtd << 1)) * 100 * ((uint32_t) floor(RREF));
-        rtd_dummy >>= 16;
-        ohmsx100 = (uint16_t) (rtd_dummy & 0xFFFF);
-        PT100_temp = PT100.celsius(ohmsx100); // lookup temperature for determined resistance in lookup-table (empirical data)
-        uint8_t fault = max.readFault();
-        
-        #ifdef DEBUG   
-          Serial.print("PT100: "); Serial.println(PT100_temp); 
-          // Check and print any faults
-          if (fault) 
+        Serial.print("Fault 0x"); Serial.println(fault, HEX);
+        if (fault & MAX31865_FAULT_HIGHTHRESH) 
+        {
+          Serial.println("RTD High Threshold"); 
+        }
+        if (fault & MAX31865_FAULT_LOWTHRESH) 
+        {
+          Serial.println("RTD Low Threshold"); 
+        }
+        if (fault & MAX31865_FAULT_REFINLOW) 
+        {
+          Serial.println("REFIN- > 0.85 x Bias"); 
+        }
+        if (fault & MAX31865_FAULT_REFINHIGH) 
+        {
+          Serial.println("REFIN- < 0.85 x Bias - FORCE- open"); 
+        }
+        if (fault & MAX31865_FAULT_RTDINLOW) 
+        {
+          Serial.println("RTDIN- < 0.85 x Bias - FORCE- open"); 
+        }
+        if (fault & MAX31865_FAULT_OVUV) 
+        {
+          Serial.println("Under/Over voltage"); 
+        }
+        max.clearFault();
+      }
+    #endif  
+    if(fault)PT100_temp = 9999.1; // if RTD-Amp-Board returned an invalid response
+
+    // Manage SPI-Bus: Re-Activate Ethernet-Board 
+    digitalWrite(CONTROLLINO_ETHERNET_CHIP_SELECT, LOW); // Activate SPI Slave (Ethernet)
+    digitalWrite(RTD_PT100_BOARD_CHIP_SELECT_PIN, HIGH); // Deactivate SPI Slave (RTD PT100 Amp-Board)
+
+    // ----------------------------------------------------------------------------
+    // --------- CMP3 Pyranometer ADC --------------------------------------------- 
+    double rSAMPLE_ARRAY_chan[rSAMPLES_TO_TAKE];
+    //Get and calculate data for all CMP3 sensors respectively
+    for(int i = 0; i<sizeof(ADC_CONFIG_BYTE_CHANNEL); i++)
+    {
+      // Write config byte to ADC config register (and change ADC MUX channels)
+      Wire.beginTransmission(ADC_ADDRESS); // begin I2C communication (write operation)
+      Wire.write(ADC_CONFIG_BYTE_CHANNEL[i]); // send data to ADC
+      Wire.endTransmission(); // free I2C bus
+  
+      byte s_index = 0, is_zero = 0;
+      while(s_index < rSAMPLES_TO_TAKE) // takes 4 samples per reading per channel
+      {          
+        // Read ADC digital data output and calculate physical units
+        if(!readADC(i) && !ADCfail)continue; // new sample not ready yet - repeat
+        else
+        { 
+          if(ADCfail)break; // ADC did not return any or faulty response
+          else // new sample returned
           {
-            Serial.print("Fault 0x"); Serial.println(fault, HEX);
-            if (fault & MAX31865_FAULT_HIGHTHRESH) 
+            double voltage_amp, voltage_adc, voltage_corrected, radiation;
+            if(*p_outputCode != 0x00000000) // if output code not negative/zero
             {
-              Serial.println("RTD High Threshold"); 
-            }
-            if (fault & MAX31865_FAULT_LOWTHRESH) 
-            {
-              Serial.println("RTD Low Threshold"); 
-            }
-            if (fault & MAX31865_FAULT_REFINLOW) 
-            {
-              Serial.println("REFIN- > 0.85 x Bias"); 
-            }
-            if (fault & MAX31865_FAULT_REFINHIGH) 
-            {
-              Serial.println("REFIN- < 0.85 x Bias - FORCE- open"); 
-            }
-            if (fault & MAX31865_FAULT_RTDINLOW) 
-            {
-              Serial.println("RTDIN- < 0.85 x Bias - FORCE- open"); 
-            }
-            if (fault & MAX31865_FAULT_OVUV) 
-            {
-              Serial.println("Under/Over voltage"); 
-            }
-            max.clearFault();
-          }
-        #endif  
-        if(fault)PT100_temp = 9999.1; // if RTD-Amp-Board returned an invalid response
-
-        // Manage SPI-Bus: Re-Activate Ethernet-Board 
-        digitalWrite(CONTROLLINO_ETHERNET_CHIP_SELECT, LOW); // Activate SPI Slave (Ethernet)
-        digitalWrite(RTD_PT100_BOARD_CHIP_SELECT_PIN, HIGH); // Deactivate SPI Slave (RTD PT100 Amp-Board)
-
-        // ----------------------------------------------------------------------------
-        // --------- CMP3 Pyranometer ADC --------------------------------------------- 
-        double rSAMPLE_ARRAY_chan[rSAMPLES_TO_TAKE];
-        //Get and calculate data for all CMP3 sensors respectively
-        for(int i = 0; i<sizeof(ADC_CONFIG_BYTE_CHANNEL); i++)
-        {
-          // Write config byte to ADC config register (and change ADC MUX channels)
-          Wire.beginTransmission(ADC_ADDRESS); // begin I2C communication (write operation)
-          Wire.write(ADC_CONFIG_BYTE_CHANNEL[i]); // send data to ADC
-          Wire.endTransmission(); // free I2C bus
-      
-          byte s_index = 0, is_zero = 0;
-          while(s_index < rSAMPLES_TO_TAKE) // takes 4 samples per reading per channel
-          {          
-            // Read ADC digital data output and calculate physical units
-            if(!readADC(i) && !ADCfail)continue; // new sample not ready yet - repeat
-            else
-            { 
-              if(ADCfail)break; // ADC did not return any or faulty response
-              else // new sample returned
-              {
-                double voltage_amp, voltage_adc, voltage_corrected, radiation;
-                if(*p_outputCode != 0x00000000) // if output code not negative/zero
-                {
-                  // Calculate voltage from digital output code
-                  voltage_adc = (double)*p_outputCode * (LSB_size*pow(10,-6));
-
-                  // Compensate for voltage drop
-                  voltage_corrected = voltage_adc*(1+((20*pow(10,3))*(((3.2*pow(10,-12)*262144)+(1/(21*pow(10,6)))))));
-                
-                  // Calculate radiation in W/m²
-                  voltage_amp = voltage_corrected/INA_GAIN;
-                  radiation = voltage_amp/(CMP3_sensitivity[i]*pow(10,-6));
-                }
-                else // output yields zero
-                {
-                  radiation = 0.0;
-                  is_zero++;
-                }
-                rSAMPLE_ARRAY_chan[s_index] = radiation;
-                s_index++;   
-              }
+              // Calculate voltage from digital output code
+              voltage_adc = (double)*p_outputCode * (LSB_size*pow(10,-6));
+
+              // Compensate for voltage drop
+              voltage_corrected = voltage_adc*(1+((20*pow(10,3))*(((3.2*pow(10,-12)*262144)+(1/(21*pow(10,6)))))));
+            
+              // Calculate radiation in W/m²
+              voltage_amp = voltage_corrected/INA_GAIN;
+              radiation = voltage_amp/(CMP3_sensitivity[i]*pow(10,-6));
             }
-          }
-          if(ADCfail) // ADC did not return any or faulty response
-          {
-            CMP3_DataArray[0] = 9999.21;
-            CMP3_DataArray[1] = 9999.22;
-            CMP3_DataArray[2] = 9999.23;
-            break;
-          }
-          else // ADC returned valid response - calculate required values
-          {
-            //Calculcate average of 4 samples for current channel
-            double radiation_tmp = 0.0, radiation_average;
-            if(is_zero == rSAMPLES_TO_TAKE)radiation_average = 0.0; // prevent division by zero
-            else
+            else // output yields zero
             {
-              for(int ii = 0; ii<rSAMPLES_TO_TAKE; ii++)radiation_tmp = radiation_tmp + rSAMPLE_ARRAY_chan[ii]; // take sum
-              radiation_average = radiation_tmp/rSAMPLES_TO_TAKE; // calculate average
+              radiation = 0.0;
+              is_zero++;
             }
-            CMP3_DataArray[i] = radiation_average;
+            rSAMPLE_ARRAY_chan[s_index] = radiation;
+            s_index++;   
           }
         }
-        DEBUG_PRINT("CMP3_1: "), DEBUG_PRINT_LN(CMP3_DataArray[0]);  
-        DEBUG_PRINT("CMP3_2: "), DEBUG_PRINT_LN(CMP3_DataArray[1]);  
-        DEBUG_PRINT("CMP3_3: "), DEBUG_PRINT_LN(CMP3_DataArray[2]);  
-
-        // ----------------------------------------------------------------------------
-        // --------- SPN1 Pyranometer (receive requested data) ------------------------
-        SPN1data = "_ERR_SPN1_";
-        if (SPN1_SERIAL.available() > 0) // If received data from SPN1 (buffer not empty)
-        {
-          SPN1data = SPN1_SERIAL.readString(); // read SPN1 response for the command that has been sent earlier
-          //extract needed data
-          SPN1data.remove(0, 2);
-          SPN1data.replace(" ", "");      
-          SPN1data.replace("\r", "");                    
-        }        
-        DEBUG_PRINT("SPN1: ");          
-        DEBUG_PRINT_LN(SPN1data);   
-        
-        // ----------------------------------------------------------------------------
-        // --------- EthernetShield ---------------------------------------------------  
-        // Transmit Data via Ethernet to RevPi
-        if(sampling_rounds > 2) // Do not transmit the first few samples as they might not be accurate
+      }
+      if(ADCfail) // ADC did not return any or faulty response
+      {
+        CMP3_DataArray[0] = 9999.21;
+        CMP3_DataArray[1] = 9999.22;
+        CMP3_DataArray[2] = 9999.23;
+        break;
+      }
+      else // ADC returned valid response - calculate required values
+      {
+        //Calculcate average of 4 samples for current channel
+        double radiation_tmp = 0.0, radiation_average;
+        if(is_zero == rSAMPLES_TO_TAKE)radiation_average = 0.0; // prevent division by zero
+        else
         {
-          // Create Sensor Data Package      
-          SensorDataPackage = String(windspeed) + "|" + String(PT100_temp) + "|" + String(SPN1data) + "|" + String(CMP3_DataArray[0]) + "|" + String(CMP3_DataArray[1]) + "|" + String(CMP3_DataArray[2]);
-          client_eth.println(SensorDataPackage + "\n"); // Send sensor data package to RevPi
+          for(int ii = 0; ii<rSAMPLES_TO_TAKE; ii++)radiation_tmp = radiation_tmp + rSAMPLE_ARRAY_chan[ii]; // take sum
+          radiation_average = radiation_tmp/rSAMPLES_TO_TAKE; // calculate average
         }
-        // ----------------------------------------------------------------------------
-        DEBUG_PRINT_LN("-------------------------------------");
-        DEBUG_PRINT_LN("Execution time (data acquisition): " + String(millis() - timestamp_last_sampling) + " [ms]");
-        DEBUG_PRINT_LN(); 
+        CMP3_DataArray[i] = radiation_average;
       }
-    }    
+    }
+    DEBUG_PRINT("CMP3_1: "), DEBUG_PRINT_LN(CMP3_DataArray[0]);  
+    DEBUG_PRINT("CMP3_2: "), DEBUG_PRINT_LN(CMP3_DataArray[1]);  
+    DEBUG_PRINT("CMP3_3: "), DEBUG_PRINT_LN(CMP3_DataArray[2]);  
+
+    // ----------------------------------------------------------------------------
+    // --------- SPN1 Pyranometer (receive requested data) ------------------------
+    SPN1data = "_ERR_SPN1_";
+    if (SPN1_SERIAL.available() > 0) // If received data from SPN1 (buffer not empty)
+    {
+      SPN1data = SPN1_SERIAL.readString(); // read SPN1 response for the command that has been sent earlier
+      //extract needed data
+      SPN1data.remove(0, 2);
+      SPN1data.replace(" ", "");      
+      SPN1data.replace("\r", "");                    
+    }        
+    DEBUG_PRINT("SPN1: ");          
+    DEBUG_PRINT_LN(SPN1data);   
+    
+    // ----------------------------------------------------------------------------
+    // --------- Sample buffer ---------------------------------------------------  
+    // Buffer the sample (sent to the RevPi below, together with samples that could not be sent yet)
+    if(sampling_rounds > 2)bufferSensorData(timestamp_last_sampling); // Do not transmit the first few samples as they might not be accurate
+    // ----------------------------------------------------------------------------
+    DEBUG_PRINT_LN("-------------------------------------");
+    DEBUG_PRINT_LN("Execution time (data acquisition): " + String(millis() - timestamp_last_sampling) + " [ms]");
+    DEBUG_PRINT_LN(); 
   }
+
+  // ----------------------------------------------------------------------------
+  // --------- EthernetShield ---------------------------------------------------  
+  // Transmit buffered samples via Ethernet to RevPi
+  if(isConnected)sendBufferedSamples();
   wdt_reset(); // reset watchdog timer
 }
 
+// Function builds a sensor frame out of the latest sensor readings and appends it to the sample buffer
+void bufferSensorData(uint32_t t_sampling)
+{
+  if(sample_buffer_count == SAMPLE_BUFFER_SIZE) // buffer full: the oldest sample is lost
+  {
+    sample_buffer_first = (sample_buffer_first + 1) % SAMPLE_BUFFER_SIZE;
+    sample_buffer_count--;
+    if(sample_buffer_sent > 0)sample_buffer_sent--;
+  }
+  SensorDataFrame &frame = sample_buffer[(sample_buffer_first + sample_buffer_count) % SAMPLE_BUFFER_SIZE];
+  sample_buffer_count++;
+  frame.sync[0] = BINARY_SYNC_1;
+  frame.sync[1] = BINARY_SYNC_2;
+  frame.version = BINARY_VERSION;
+  frame.length = sizeof(frame) - 6; // without sync, version, length and checksum
+  frame.seq = frame_sequence++;
+  frame.t_millis = t_sampling;
+  frame.status = 0;
+  frame.values[0] = windspeed;
+  frame.values[1] = PT100_temp;
+  if(PT100_temp > 9999.0)frame.status |= (1 << 1); // RTD-Amp-Board returned an invalid response
+  if(SPN1data == "_ERR_SPN1_") // SPN1 did not return a valid reading
+  {
+    frame.status |= (1 << 2) | (1 << 3) | (1 << 4);
+    frame.values[2] = frame.values[3] = frame.values[4] = 0.0;
+  }
+  else // SPN1 returns a comma separated string: total,diffuse,sunshine
+  {
+    int sep_1 = SPN1data.indexOf(',');
+    int sep_2 = SPN1data.indexOf(',', sep_1 + 1);
+    frame.values[2] = SPN1data.substring(0, sep_1).toFloat();
+    frame.values[3] = SPN1data.substring(sep_1 + 1, sep_2).toFloat();
+    frame.values[4] = SPN1data.substring(sep_2 + 1).toFloat();
+    if(sep_1 < 0 || sep_2 < 0)frame.status |= (1 << 2) | (1 << 3) | (1 << 4);
+  }
+  for(int i = 0; i<CMP3PyranometersInUse; i++)
+  {
+    frame.values[5 + i] = CMP3_DataArray[i];
+    if(CMP3_DataArray[i] > 9999.0)frame.status |= (1 << (5 + i)); // ADC did not return any or faulty response
+  }
+  // Fletcher-16 checksum
+  uint8_t *p_frame = (uint8_t *)&frame;
+  uint16_t sum1 = 0, sum2 = 0;
+  for(int i = 2; i<sizeof(frame) - 2; i++)
+  {
+    sum1 = (sum1 + p_frame[i]) % 255;
+    sum2 = (sum2 + sum1) % 255;
+  }
+  frame.checksum = (sum2 << 8) | sum1;
+}
+
+// Function sends the buffered samples that have not been sent yet (binary frames or text packages) to the RevPi
+void sendBufferedSamples()
+{
+  while(sample_buffer_sent < sample_buffer_count)
+  {
+    SensorDataFrame &frame = sample_buffer[(sample_buffer_first + sample_buffer_sent) % SAMPLE_BUFFER_SIZE];
+    bool isSent;
+    if(isBinaryProtocol)isSent = (client_eth.write((uint8_t *)&frame, sizeof(frame)) == sizeof(frame)); // Send binary sensor frame to RevPi
+    else
+    {
+      // Create Sensor Data Package (sequence number and sampling time, followed by the sensor values)
+      String SPN1text = "_ERR_SPN1_";
+      if(!(frame.status & (1 << 2)))SPN1text = String(frame.values[2]) + "," + String(frame.values[3]) + "," + String((int)frame.values[4]);
+      SensorDataPackage = String(frame.seq) + "," + String(frame.t_millis) + ";" + String(frame.values[0]) + "|" + String(frame.values[1]) + "|" + SPN1text + "|" + String(frame.values[5]) + "|" + String(frame.values[6]) + "|" + String(frame.values[7]);
+      isSent = (client_eth.println(SensorDataPackage + "\n") > 0); // Send sensor data package to RevPi
+    }
+    if(!isSent)break; // link problem: try again later
+    sample_buffer_sent++;
+    if(sample_buffer_sent > SAMPLE_RESEND_COUNT) // keep the last samples sent for a resend after a reconnect
+    {
+      sample_buffer_first = (sample_buffer_first + 1) % SAMPLE_BUFFER_SIZE;
+      sample_buffer_count--;
+      sample_buffer_sent--;
+    }
+  }
+}
+
+// Function connects to the RevPi, announces the station ID and requests the binary protocol
+bool connectToRevPi()
+{
+  wdt_reset(); // reset watchdog timer (connecting may take a while)
+  if(!client_eth.connect(RevPi_IP, REVPI_PORT_SOCKET))
+  {
+    DEBUG_PRINT_LN("Could not connect to the RevPi!");
+    return false;
+  }
+  DEBUG_PRINT("Established connection to RevPi at ");
+  DEBUG_PRINT_LN(client_eth.remoteIP());
+  client_eth.println("@" STATION_ID "\n"); // Announce station ID to RevPi
+  isBinaryProtocol = false; // until the RevPi has confirmed it
+  #ifdef USE_BINARY_PROTOCOL
+    client_eth.println("%BIN1\n"); // Request binary protocol
+  #endif
+  isConnected = true;
+  reconnect_attempts = 0;
+  return true;
+}
+
 // Function will trigger a Controllino board restart (Software Reset using the watchdog)
 void initiateRestart() 
 {
@@ -548,7 +694,7 @@ bool readADC(int channel) // changed from int32_t to bool !! check if working pr
 void CB_OnCommandReceived() 
 {
   // ---------- Check for received Commands ---------------------
-  // 'a' = restart | 'b' = NOT USED | '#' = HEARTBEAT
+  // 'a' = restart | 'b' = NOT USED | 'B' = binary protocol confirmed | '#' = HEARTBEAT
   // ------------------------------------------------------------
   while(client_eth.available() > 0) // if buffer not empty, check for commands
   {
@@ -574,6 +720,12 @@ void CB_OnCommandReceived()
           initiateRestart();
           break;
         }
+        case 'B': // RevPi confirmed binary protocol
+        {
+          DEBUG_PRINT_LN("Switching to binary protocol.");
+          isBinaryProtocol = true;
+          break;
+        }
         case 'b': // CURRENTLY NOT USED
         {
           //DEBUG_PRINT_LN("Executing command 2 (--)."); 
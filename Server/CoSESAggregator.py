@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESAggregator.py downsamples the sensor data of a station before it is saved into the primary database. Samples are
+collected per interval (e.g. 5 seconds) and saved as one dataset holding the mean, minimum, maximum and standard
+deviation of each sensor value. The latest raw samples are kept in memory (ring buffer) and can optionally be written
+to raw capture files. Rolling aggregates (1 min, 5 min, 1 h, day) and the irradiation energy are updated with every
+sample.
+"""
+
+import os
+import os.path
+import math
+import time
+from collections import deque
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+# Sensor values of a dataset
+SENSOR_FIELDS = ('temp', 'wind', 'spn1_radTot', 'spn1_radDiff', 'spn1_sun', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3')
+# Sensor values with min/max/std statistics (spn1_sun is a flag: the majority of the interval is saved)
+STATISTICS_SENSOR_FIELDS = ('temp', 'wind', 'spn1_radTot', 'spn1_radDiff', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3')
+STATISTICS_FIELDS = tuple(field + suffix for field in STATISTICS_SENSOR_FIELDS for suffix in ('_min', '_max', '_std'))
+# All values of an aggregated dataset ('samples' = number of samples aggregated)
+DATASET_FIELDS = SENSOR_FIELDS + STATISTICS_FIELDS + ('samples',)
+
+
+def format_value(value):
+    """
+    Formats an aggregated value
+    :param value: float - value
+    :return: str - value with 7 significant digits
+    """
+    return '%.7g' % value
+
+
+def read_sample(dataset):
+    """
+    Converts the capture time and the sensor values of a sample (called before any state is changed, so an invalid
+    sample is not added at all). Missing (None) and non-finite sensor values are invalid readings and skipped
+    :param dataset: dict - sample
+    :return: tuple - capture time, list of (field, value) of the valid readings; ValueError/TypeError if a value is
+             not a number or the capture time is not finite
+    """
+    t = float(dataset['t_unix'])
+    if math.isnan(t) or math.isinf(t):
+        raise ValueError('Invalid capture time: %r' % dataset['t_unix'])
+    values = []
+    for field in SENSOR_FIELDS:
+        if dataset.get(field) is None:  # invalid reading
+            continue
+        value = float(dataset[field])
+        if not math.isnan(value) and not math.isinf(value):
+            values.append((field, value))
+    return t, values
+
+
+class SampleAggregator:
+    """
+    Aggregates the samples of one station per interval. Used by the RevPiServerThread only (not thread-safe, except
+    for reading the raw window).
+    """
+    def __init__(self, station_id, interval, raw_window_size):
+        """
+        :param station_id: str - station of the samples
+        :param interval: int - aggregation interval in seconds (0 = no aggregation, every sample is a dataset)
+        :param raw_window_size: int - number of raw samples kept in memory
+        """
+        self.station_id = station_id
+        self.interval = interval
+        self.raw_window = deque(maxlen=raw_window_size)  # latest raw samples (datasets)
+        self.buckets = {}  # interval index -> {field: [count, mean, M2, min, max]} and number of samples
+        self.newest = None  # newest interval index
+        self.emitted = None  # newest interval index handed over (later samples of it are late)
+        self.late = 0  # late samples dropped (their interval has been handed over already)
+
+    def add(self, dataset):
+        """
+        Adds a sample. Intervals are complete as soon as a sample of a later interval arrives. A sample of an interval
+        handed over already is dropped and counted in late (a second dataset of the interval is not created)
+        :param dataset: dict - sample (sensor values and capture time t_unix, may be a float)
+        :return: list - aggregated datasets of completed intervals; ValueError/TypeError if a value is not a number
+                 (the sample is not added)
+        """
+        t, values = read_sample(dataset)
+        self.raw_window.append(dataset)
+        if self.interval <= 0:  # no aggregation
+            dataset = dict(dataset)
+            dataset['t_unix'] = int(t)
+            return [dataset]
+        index = int(t // self.interval)
+        if self.emitted is not None and index <= self.emitted:
+            self.late += 1
+            return []
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            bucket = self.buckets[index] = {'samples': 0}
+        bucket['samples'] += 1
+        for field, value in values:
+            stats = bucket.get(field)
+            if stats is None:
+                bucket[field] = [1, value, 0.0, value, value]
+            else:  # Welford's algorithm (numerically stable running mean and variance)
+                stats[0] += 1
+                delta = value - stats[1]
+                stats[1] += delta / stats[0]
+                stats[2] += delta * (value - stats[1])
+                stats[3] = min(stats[3], value)
+                stats[4] = max(stats[4], value)
+        if self.newest is None or index > self.newest:
+            self.newest = index
+        return self._emit([i for i in self.buckets if i < self.newest])
+
+    def flush(self, t_now=None):
+        """
+        Completes intervals that have not received a later sample (e.g. the station stopped sending)
+        :param t_now: float - intervals that ended one interval before this time are completed (None = all)
+        :return: list - aggregated datasets of completed intervals
+        """
+        if t_now is None:
+            return self._emit(list(self.buckets))
+        return self._emit([i for i in self.buckets if (i + 2) * self.interval <= t_now])
+
+    def _emit(self, indexes):
+        datasets = []
+        for index in sorted(indexes):
+            bucket = self.buckets.pop(index)
+            self.emitted = max(self.emitted, index)
+            dataset = {'station': self.station_id, 't_unix': index * self.interval, 'samples': bucket['samples']}
+            for field in SENSOR_FIELDS:
+                stats = bucket.get(field)
+                if stats is None:  # no valid reading within the interval
+                    dataset[field] = None
+                elif field == 'spn1_sun':
+                    dataset[field] = '1' if stats[1] >= 0.5 else '0'
+                else:
+                    dataset[field] = format_value(stats[1])
+            for field in STATISTICS_SENSOR_FIELDS:
+                stats = bucket.get(field)
+                if stats is None:
+                    dataset[field + '_min'] = dataset[field + '_max'] = dataset[field + '_std'] = None
+                else:
+                    dataset[field + '_min'] = format_value(stats[3])
+                    dataset[field + '_max'] = format_value(stats[4])
+                    dataset[field + '_std'] = format_value(math.sqrt(stats[2] / stats[0]))
+            datasets.append(dataset)
+        return datasets
+
+
+class RawCaptureWriter:
+    """
+    Writes raw samples into one CSV file per station and day (raw capture mode)
+    """
+    def __init__(self, path_dir, flush_every=60):
+        """
+        :param path_dir: str - directory of the capture files
+        :param flush_every: int - write buffered samples to disk after this many samples
+        """
+        self.path_dir = path_dir
+        self.flush_every = flush_every
+        self.files = {}  # station -> (date, file object)
+        self.unflushed = 0
+        if not os.path.isdir(self.path_dir):
+            os.makedirs(self.path_dir)
+
+    def write(self, dataset):
+        """
+        Appends a raw sample to the capture file of its station
+        :param dataset: dict - sample
+        :return: --
+        """
+        station = dataset.get('station') or 'main'
+        date = time.strftime('%Y%m%d', time.localtime(dataset['t_unix']))
+        entry = self.files.get(station)
+        if entry is None or entry[0] != date:  # new day: start a new file
+            if entry is not None:
+                entry[1].close()
+            path = os.path.join(self.path_dir, 'raw_' + station + '_' + date + '.csv')
+            is_new = not os.path.isfile(path)
+            entry = self.files[station] = (date, open(path, 'a'))
+            if is_new:
+                entry[1].write('t_unix,' + ','.join(SENSOR_FIELDS) + '\n')
+        values = ['' if dataset.get(field) is None else str(dataset[field]) for field in SENSOR_FIELDS]
+        entry[1].write('%.3f,' % dataset['t_unix'] + ','.join(values) + '\n')
+        self.unflushed += 1
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes buffered samples to disk
+        :param NONE: --
+        :return: --
+        """
+        for _, f in self.files.values():
+            f.flush()
+        self.unflushed = 0
+
+    def close(self):
+        """
+        Closes all capture files
+        :param NONE: --
+        :return: --
+        """
+        for _, f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+# Rolling aggregates
+ROLLING_WINDOWS = (60, 300, 3600)  # trailing windows in seconds (1 min, 5 min, 1 h)
+PERIOD_DAY = 86400
+# Irradiation values (W/m²) that are integrated to the radiant exposure (energy in Wh/m²)
+ENERGY_FIELDS = ('spn1_radTot', 'spn1_radDiff', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3')
+
+
+class RollingWindow:
+    """
+    Mean, minimum and maximum of the values of a trailing time window. Every update is O(1) (amortized): the sum is
+    updated incrementally and minimum/maximum are kept in monotonic queues.
+    """
+    def __init__(self, length):
+        """
+        :param length: float - window length in seconds
+        """
+        self.length = length
+        self.samples = deque()  # (t, value)
+        self.sum = 0.0
+        self.mins = deque()  # candidates for the minimum (increasing values)
+        self.maxs = deque()  # candidates for the maximum (decreasing values)
+
+    def add(self, t, value):
+        """
+        Adds a value (values have to be added in chronological order)
+        :param t: float - time of the value
+        :param value: float - value
+        :return: --
+        """
+        self.expire(t)
+        self.samples.append((t, value))
+        self.sum += value
+        while self.mins and self.mins[-1][1] > value:  # equal values are kept: the earliest one is reported
+            self.mins.pop()
+        self.mins.append((t, value))
+        while self.maxs and self.maxs[-1][1] < value:
+            self.maxs.pop()
+        self.maxs.append((t, value))
+
+    def expire(self, t_now):
+        """
+        Removes the values that are older than the window (window = [t_now - length, t_now])
+        :param t_now: float - current time
+        :return: --
+        """
+        t_start = t_now - self.length
+        while self.samples and self.samples[0][0] < t_start:
+            self.sum -= self.samples.popleft()[1]
+        if not self.samples:
+            self.sum = 0.0  # no rounding errors left over
+        while self.mins and self.mins[0][0] < t_start:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] < t_start:
+            self.maxs.popleft()
+
+    def get(self):
+        """
+        :param NONE: --
+        :return: tuple - (number of values, mean, (t, minimum), (t, maximum)) or None if the window is empty
+        """
+        if not self.samples:
+            return None
+        return len(self.samples), self.sum / len(self.samples), self.mins[0], self.maxs[0]
+
+
+class RollingAggregates:
+    """
+    Rolling aggregates of the sensor values of one station, updated with every sample: mean/min/max over trailing
+    windows (1 min, 5 min, 1 h), daily min/max with timestamps and mean, and the irradiation energy (Wh/m²) of each
+    window period and of the day. Completed periods are returned as summaries to be saved into the primary database.
+    """
+    def __init__(self, station_id, gap_max=300, windows=ROLLING_WINDOWS):
+        """
+        :param station_id: str - station of the samples
+        :param gap_max: float - no energy is integrated over gaps between two samples longer than this (seconds)
+        :param windows: tuple - window lengths in seconds
+        """
+        self.station_id = station_id
+        self.gap_max = gap_max
+        self.windows = dict((field, dict((length, RollingWindow(length)) for length in windows))
+                            for field in SENSOR_FIELDS)
+        self.energy = dict((field, dict((length, 0.0) for length in windows + (PERIOD_DAY,)))
+                           for field in ENERGY_FIELDS)  # energy since the start of the current period
+        self.last = {}  # field -> (t, value) of the last valid value (for the integration)
+        self.period_end = dict((length, None) for length in windows)
+        self.day = {}  # field -> [count, sum, (t, min), (t, max)]
+        self.day_end = None
+        self.t_last = None  # capture time of the latest sample
+
+    def _end_of_day(self, t):
+        date = time.localtime(t)
+        return time.mktime((date.tm_year, date.tm_mon, date.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+
+    def add(self, dataset):
+        """
+        Adds a sample
+        :param dataset: dict - sample (sensor values and capture time t_unix)
+        :return: list - summaries (dict) of the periods completed by this sample; ValueError/TypeError if a value is
+                 not a number (the sample is not added)
+        """
+        t, values = read_sample(dataset)
+        self.t_last = t
+        summaries = []
+        for length, t_end in self.period_end.items():  # window periods completed?
+            if t_end is not None and t >= t_end:
+                summaries.extend(self._summarize_window(length, t_end))
+            if t_end is None or t >= t_end:
+                self.period_end[length] = (t // length + 1) * length
+        if self.day_end is not None and t >= self.day_end:  # day completed?
+            summaries.extend(self._summarize_day())
+        if self.day_end is None or t >= self.day_end:
+            self.day_end = self._end_of_day(t)
+        for field, value in values:
+            for window in self.windows[field].values():
+                window.add(t, value)
+            day = self.day.get(field)
+            if day is None:
+                self.day[field] = [1, value, (t, value), (t, value)]
+            else:
+                day[0] += 1
+                day[1] += value
+                if value < day[2][1]:
+                    day[2] = (t, value)
+                if value > day[3][1]:
+                    day[3] = (t, value)
+            if field in ENERGY_FIELDS:
+                last = self.last.get(field)
+                if last is not None and 0 < t - last[0] <= self.gap_max:  # trapezoidal rule
+                    energy = (last[1] + value) / 2.0 * (t - last[0]) / 3600.0
+                    for length in self.energy[field]:
+                        self.energy[field][length] += energy
+                self.last[field] = (t, value)
+        return summaries
+
+    def _summarize_window(self, length, t_end):
+        summaries = []
+        for field in SENSOR_FIELDS:
+            window = self.windows[field][length]
+            window.expire(t_end)
+            result = window.get()
+            if result is None:
+                continue
+            summary = self._summary(length, t_end, field, result[0], result[1], result[2], result[3])
+            if field in ENERGY_FIELDS:
+                summary['energy'] = format_value(self.energy[field][length])
+                self.energy[field][length] = 0.0
+            summaries.append(summary)
+        return summaries
+
+    def _summarize_day(self):
+        summaries = []
+        for field, day in sorted(self.day.items()):
+            summary = self._summary(PERIOD_DAY, self.day_end, field, day[0], day[1] / day[0], day[2], day[3])
+            if field in ENERGY_FIELDS:
+                summary['energy'] = format_value(self.energy[field][PERIOD_DAY])
+                self.energy[field][PERIOD_DAY] = 0.0
+            summaries.append(summary)
+        self.day = {}
+        return summaries
+
+    def _summary(self, period, t_end, field, count, mean, minimum, maximum):
+        return {'station': self.station_id, 'period': period, 't_unix': int(t_end), 'sensor': field,
+                'samples': count, 'mean': format_value(mean), 'min': format_value(minimum[1]),
+                't_min': int(minimum[0]), 'max': format_value(maximum[1]), 't_max': int(maximum[0]), 'energy': None}
+
+    def snapshot(self, t_now):
+        """
+        Returns the current aggregates
+        :param t_now: float - current time (end of the trailing windows, at most the time of the latest sample)
+        :return: dict - field -> {window length (str) or 'day' -> {samples, mean, min, t_min, max, t_max, energy}}
+        """
+        result = {}
+        if self.t_last is None:
+            return result
+        t_now = min(t_now, self.t_last)  # do not expire values a completed period still has to summarize
+        for field in SENSOR_FIELDS:
+            aggregates = {}
+            for length, window in self.windows[field].items():
+                window.expire(t_now)
+                values = window.get()
+                if values is not None:
+                    aggregates[str(length)] = self._summary(length, 0, field, *values)
+            day = self.day.get(field)
+            if day is not None:
+                aggregates['day'] = self._summary(PERIOD_DAY, 0, field, day[0], day[1] / day[0], day[2], day[3])
+            for key, aggregate in aggregates.items():
+                for name in ('station', 'period', 't_unix', 'sensor'):
+                    del aggregate[name]
+                if field in ENERGY_FIELDS:  # energy since the start of the current period
+                    aggregate['energy'] = format_value(self.energy[field][PERIOD_DAY if key == 'day' else int(key)])
+            if aggregates:
+                result[field] = aggregates
+        return result
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESBenchmark.py benchmarks the whole data acquisition on one Linux machine: simulated CONTROLLINOs (CoSESSimulator)
+-> CoSESServer -> database API stand-in backed by SQLite (replaces db_manager.php and MySQL) -> CoSESDriver
+(genLoopPackets). Every stage runs in its own process, so CPU time and memory (RSS) are measured per stage.
+Reported: sent and persisted samples per second, latency from capture to the database (p50/p99), fetch lag of the
+driver (p50/p99), CPU and RSS per stage. The results can be saved as a baseline, later runs are compared against it
+and regressions are reported (exit code 1).
+
+Example: python CoSESBenchmark.py --stations 8 --sample-rate 1 --duration 120 --baseline benchmark_baseline.json
+"""
+
+import os
+import sys
+import errno
+import json
+import time
+import signal
+import socket
+import sqlite3
+import tempfile
+import threading
+import subprocess
+import CoSESSimulator
+from CoSESSimulator import DatabaseApiStandIn, SimulatedStation, SimulationStats, percentile
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+STAGES = ('api', 'server', 'driver', 'clients')  # start order
+DEFAULT_STATION_ID = 'main'  # station aggregated if none is requested (DEFAULT_STATION in db_manager.php)
+SENSOR_COLUMNS = ('temp', 'wind', 'spn1_radTot', 'spn1_radDiff', 'spn1_sun', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3')
+# Results compared with the baseline: key -> True if higher is better
+COMPARED_RESULTS = {'persisted_samples_per_s': True, 'persist_latency_p50': False, 'persist_latency_p99': False,
+                    'fetch_lag_p50': False, 'fetch_lag_p99': False}
+COMPARED_STAGE_RESULTS = {'cpu_percent': False, 'rss_max_kb': False}
+# Smaller absolute changes are never reported as regression (noise, e.g. one clock tick of CPU time)
+MIN_CHANGE = {'cpu_percent': 1.0, 'rss_max_kb': 1024, 'persist_latency': 1.0, 'fetch_lag': 1.0}
+t_STAGE_START = 15  # seconds a stage may take to accept connections
+
+
+class SqliteDatabaseApi(DatabaseApiStandIn):
+    """
+    Database API stand-in that saves the datasets into SQLite (table sensor_datasets like the primary database) and
+    answers the requests of the CoSESDriver (p_mode 21 and 22). Persist times are recorded per dataset (fetch times by the
+    driver stage, the driver may receive the datasets from the local feed of the CoSESServer instead)
+    """
+    def __init__(self, path_db, port, delay=0.0, failure_rate=0.0):
+        """
+        :param path_db: str - SQLite database file
+        :param port: int - HTTP port
+        :param delay: float - every request takes at least this long (seconds)
+        :param failure_rate: float - probability that saving datasets fails
+        """
+        self.db = sqlite3.connect(path_db, check_same_thread=False)
+        self.db_lock = threading.Lock()
+        self.db.execute('CREATE TABLE IF NOT EXISTS sensor_datasets (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                        'station TEXT, ' + ', '.join(column + ' REAL' for column in SENSOR_COLUMNS) +
+                        ', samples INTEGER, t_unix INTEGER, dataset_key INTEGER, archived INTEGER DEFAULT 1, '
+                        't_persisted REAL, t_fetched REAL, UNIQUE (station, t_unix, dataset_key))')
+        self.db.commit()
+        DatabaseApiStandIn.__init__(self, port, delay, failure_rate)
+
+    def store(self, datasets):
+        t_now = time.time()
+        rows = [[dataset.get('station')] + [dataset.get(column) for column in SENSOR_COLUMNS] +
+                [dataset.get('samples', 1), int(float(dataset['t_unix'])), dataset.get('dataset_key'), t_now]
+                for dataset in datasets]
+        with self.db_lock:
+            id_previous = self.db.execute('SELECT COALESCE(MAX(id), 0) FROM sensor_datasets').fetchone()[0]
+            ids = []
+            for row in rows:  # 0 = saved already (same station, capture time and key)
+                cursor = self.db.execute('INSERT OR IGNORE INTO sensor_datasets (station, ' + ', '.join(SENSOR_COLUMNS) +
+                                         ', samples, t_unix, dataset_key, t_persisted) VALUES (' +
+                                         ', '.join('?' * (len(SENSOR_COLUMNS) + 5)) + ')', row)
+                ids.append(cursor.lastrowid if cursor.rowcount else 0)
+            self.db.commit()
+        return id_previous, ids  # like db_manager.php
+
+    def handle_other(self, p_mode, data):
+        if p_mode == 22:
+            return self.aggregate(data)
+        if p_mode != 21:
+            return '__SUCCESS;'
+        # Datasets following the cursor of the driver (same reply as db_manager.php)
+        station_filter = ''
+        parameters = []
+        if data.get('p_station'):
+            station_filter = ' AND station=?'
+            parameters.append(data['p_station'])
+        with self.db_lock:
+            if 'p_after' not in data:  # cursor to start with
+                cursor = self.db.execute('SELECT COALESCE(MAX(id), 0) FROM sensor_datasets WHERE 1' + station_filter,
+                                         parameters).fetchone()[0]
+                return json.dumps(['__SUCCESS;', {'cursor': cursor}])
+            rows = self.db.execute('SELECT id, station, ' + ', '.join(SENSOR_COLUMNS) + ', t_unix FROM sensor_datasets '
+                                   'WHERE id>?' + station_filter + ' ORDER BY id LIMIT ?',
+                                   [int(data['p_after'])] + parameters +
+                                   [min(int(data.get('p_limit', 1000)), 1000)]).fetchall()
+        if not rows:
+            return json.dumps('__NO_ROWS_RETURNED;')
+        reply = ['__SUCCESS;']
+        for row in rows:
+            dataset = {'id': str(row[0]), 'station': row[1], 't_unix': str(row[-1])}
+            for column, value in zip(SENSOR_COLUMNS, row[2:-1]):
+                dataset[column] = None if value is None else str(value)  # MySQL returns strings
+            reply.append(dataset)
+        return json.dumps(reply)
+
+    def aggregate(self, data):
+        """
+        Aggregates the datasets following the cursor of the driver per archive interval (same reply as db_manager.php)
+        :param data: dict - request (p_after, p_interval, p_before, p_since, p_station)
+        :return: str - reply (JSON)
+        """
+        station_filter = ' AND station=?'  # datasets of different stations are never aggregated into one record
+        parameters = [int(data['p_after']), data.get('p_station') or DEFAULT_STATION_ID]
+        interval = int(data['p_interval'])
+        with self.db_lock:
+            id_stop = self.db.execute('SELECT MIN(id) FROM sensor_datasets WHERE id>? AND t_unix>?' + station_filter,
+                                      parameters[:1] + [int(data['p_before'])] + parameters[1:]).fetchone()[0]
+            id_last = self.db.execute('SELECT MAX(id) FROM sensor_datasets WHERE id>? AND id<?' + station_filter,
+                                      parameters[:1] + [id_stop or sys.maxint] + parameters[1:]).fetchone()[0]
+            if id_last is None:
+                return json.dumps('__NO_ROWS_RETURNED;')
+            rows = self.db.execute('SELECT t_unix - (t_unix - 1) %% %d - 1 + %d AS t_end, COUNT(*), %s, MAX(wind) '
+                                   'FROM sensor_datasets WHERE id>? AND id<=? AND t_unix>?%s GROUP BY t_end '
+                                   'ORDER BY t_end' % (interval, interval,
+                                                       ', '.join('SUM(%s * COALESCE(samples, 1)) / SUM(CASE WHEN '
+                                                                 '%s IS NULL THEN NULL ELSE COALESCE(samples, 1) END)'
+                                                                 % (column, column) for column in SENSOR_COLUMNS),
+                                                       station_filter),
+                                   parameters[:1] + [id_last, int(data.get('p_since', 0))] +
+                                   parameters[1:]).fetchall()
+        reply = ['__SUCCESS;', {'cursor': id_last}]
+        for row in rows:
+            record = {'t_end': str(row[0]), 'datasets': str(row[1]),
+                      'wind_max': None if row[-1] is None else str(row[-1])}
+            for column, value in zip(SENSOR_COLUMNS, row[2:-1]):
+                record[column] = None if value is None else str(value)  # MySQL returns strings
+            reply.append(record)
+        return json.dumps(reply)
+
+
+def read_process_usage(pid):
+    """
+    Returns the CPU time and the memory of a process (Linux /proc)
+    :param pid: int - process ID
+    :return: tuple - CPU time (user + system, seconds), RSS (kB); None if the process does not exist anymore
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()  # the name of the process may contain spaces
+        cpu = (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))  # utime, stime
+        rss = 0
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])
+        return cpu, rss
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def get_free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_port(port, process, timeout=t_STAGE_START):
+    """
+    Waits until a stage accepts connections
+    :param port: int - TCP port
+    :param process: subprocess.Popen - process of the stage
+    :param timeout: float - maximum time to wait (seconds)
+    :return: bool - True if the port accepts connections
+    """
+    t_end = time.time() + timeout
+    while time.time() < t_end and process.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return True
+        except socket.error:
+            time.sleep(0.1)
+    return False
+
+
+def run_stage(options):
+    """
+    Runs one stage (in a process started by run_benchmark)
+    :param options: argparse.Namespace
+    :return: --
+    """
+    api_url = 'http://127.0.0.1:%d/db_manager.php' % options.api_port
+    if options.stage == 'api':
+        SqliteDatabaseApi(os.path.join(options.workdir, 'benchmark.db'), options.api_port, options.api_delay,
+                          options.api_failure_rate)
+        while True:
+            signal.pause()
+    elif options.stage == 'server':
+        CoSESSimulator.launch_server(api_url, options.port, options.stations, options.workdir)
+        while True:
+            signal.pause()
+    elif options.stage == 'driver':
+        import CoSESDriver  # requires WeeWx
+        CoSESDriver.path_ini = os.path.join(options.workdir, 'CoSESWeather.ini')  # written by the server stage
+        CoSESDriver.path_contacts = os.path.join(options.workdir, 'user_notification.txt')
+        driver = CoSESDriver.CoSESDriver(fetch_interval=options.fetch_interval,
+                                         notification_state=os.path.join(options.workdir, 'notification_driver.json'),
+                                         cursor_state=os.path.join(options.workdir, 'driver_cursor.json'),
+                                         fetch_mode=options.fetch_mode)
+        db = sqlite3.connect(os.path.join(options.workdir, 'benchmark.db'), timeout=30)
+        fetched = []  # IDs of the datasets converted into packets (fetch lag)
+        dataset_to_packet = driver.dataset_to_packet
+        driver.dataset_to_packet = lambda dataset: fetched.append(int(dataset['id'])) or dataset_to_packet(dataset)
+        for _ in driver.genLoopPackets():
+            db.executemany('UPDATE sensor_datasets SET t_fetched=? WHERE id=?', [(time.time(), i) for i in fetched])
+            db.commit()
+            del fetched[:]
+    elif options.stage == 'clients':
+        stats = SimulationStats()
+        stations = [SimulatedStation('sim%02d' % i, options, stats, options.seed + i) for i in range(options.stations)]
+        for station in stations:
+            station.start()
+        time.sleep(options.duration)
+        for station in stations:
+            station.stop()
+        with open(os.path.join(options.workdir, 'clients.json'), 'w') as f:
+            json.dump(stats.get(), f)
+
+
+def run_benchmark(options, argv):
+    """
+    Starts the stages, measures their resource usage and collects the results
+    :param options: argparse.Namespace
+    :param argv: list - command line arguments (passed on to the stages)
+    :return: dict - results
+    """
+    workdir = options.workdir or tempfile.mkdtemp(prefix='CoSESBenchmark_')
+    try:  # the stages expect an existing directory (e.g. the database of the api stage)
+        os.makedirs(workdir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    options.port = options.port or get_free_port()
+    options.api_port = options.api_port or get_free_port()
+    processes = {}
+    usage = {}  # stage -> [CPU time at start, CPU time at the end, max RSS]
+    try:
+        for stage in STAGES:
+            processes[stage] = subprocess.Popen([sys.executable, os.path.abspath(__file__)] + argv +
+                                                ['--stage', stage, '--workdir', workdir, '--port', str(options.port),
+                                                 '--api-port', str(options.api_port)])
+            port = {'api': options.api_port, 'server': options.port}.get(stage)
+            if port and not wait_for_port(port, processes[stage]):
+                raise RuntimeError('Stage ' + stage + ' did not start! See ' + workdir)
+            print('[Benchmark] Stage ' + stage + ' started (pid ' + str(processes[stage].pid) + ').')
+        t_start = time.time()
+        for stage, process in processes.items():
+            cpu, rss = read_process_usage(process.pid) or (0.0, 0)
+            usage[stage] = [cpu, cpu, rss]
+        # load phase (resource usage is measured while the clients are sending)
+        while processes['clients'].poll() is None:
+            for stage, process in processes.items():
+                measured = read_process_usage(process.pid)
+                if measured:
+                    usage[stage][1] = measured[0]
+                    usage[stage][2] = max(usage[stage][2], measured[1])
+            time.sleep(0.5)
+        t_load = time.time() - t_start
+        # drain phase: wait until the server has saved and the driver has fetched the remaining datasets
+        with open(os.path.join(workdir, 'clients.json')) as f:
+            sent = json.load(f)
+        path_db = os.path.join(workdir, 'benchmark.db')
+        t_drain_end = time.time() + options.drain
+        while time.time() < t_drain_end:
+            with sqlite3.connect(path_db) as db:
+                persisted, unfetched = db.execute('SELECT COALESCE(SUM(samples), 0), '
+                                                  'COALESCE(SUM(t_fetched IS NULL), 0) FROM sensor_datasets').fetchone()
+            if persisted >= sent['sent'] and not unfetched:
+                break
+            time.sleep(1)
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            process.wait()
+    with sqlite3.connect(path_db) as db:
+        rows = db.execute('SELECT samples, t_unix, t_persisted, t_fetched FROM sensor_datasets').fetchall()
+    results = {
+        'config': dict((key, getattr(options, key)) for key in ('stations', 'sample_rate', 'binary', 'duration',
+                                                                'fetch_interval', 'jitter', 'burst_rate',
+                                                                'error_rate', 'api_delay', 'fetch_mode')),
+        'sent_samples_per_s': sent['sent'] / t_load,
+        'persisted_samples_per_s': sum(row[0] for row in rows if row[2] - t_start <= t_load) / t_load,
+        'persisted_fraction': sum(row[0] for row in rows) / float(max(1, sent['sent'])),
+        'persist_latency_p50': percentile([row[2] - row[1] for row in rows], 50),
+        'persist_latency_p99': percentile([row[2] - row[1] for row in rows], 99),
+        'fetch_lag_p50': percentile([row[3] - row[1] for row in rows if row[3] is not None], 50),
+        'fetch_lag_p99': percentile([row[3] - row[1] for row in rows if row[3] is not None], 99),
+        'stages': dict((stage, {'cpu_percent': 100.0 * (usage[stage][1] - usage[stage][0]) / t_load,
+                                'rss_max_kb': usage[stage][2]}) for stage in STAGES),
+        'clients': sent,
+        't_run': time.strftime('%d.%m.%Y|%H:%M:%S', time.localtime(t_start)),
+    }
+    return results
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compares the results with a baseline
+    :param results: dict - results of this run
+    :param baseline: dict - results of the baseline run
+    :param tolerance: float - relative deviation that is accepted (0.2 = 20 %)
+    :return: list - regressions (str)
+    """
+    def _compare(name, current, reference, isHigherBetter):
+        if current is None or reference is None or reference == 0:
+            return
+        change = (current - reference) / float(abs(reference))
+        min_change = [value for key, value in MIN_CHANGE.items() if key in name]
+        isRegression = (-change if isHigherBetter else change) > tolerance and \
+            abs(current - reference) >= (min_change[0] if min_change else 0)
+        print('[Benchmark] %-30s %12.3f  baseline %12.3f  %+6.1f %%%s' %
+              (name, current, reference, 100 * change, '  REGRESSION' if isRegression else ''))
+        if isRegression:
+            regressions.append(name)
+
+    regressions = []
+    if results['config'] != baseline.get('config'):
+        print('[Benchmark] Warning: the configuration differs from the baseline, results may not be comparable.')
+    for key, isHigherBetter in sorted(COMPARED_RESULTS.items()):
+        _compare(key, results.get(key), baseline.get(key), isHigherBetter)
+    for stage in STAGES:
+        for key, isHigherBetter in sorted(COMPARED_STAGE_RESULTS.items()):
+            _compare(stage + '.' + key, results['stages'][stage][key],
+                     baseline.get('stages', {}).get(stage, {}).get(key), isHigherBetter)
+    return regressions
+
+
+def format_results(results):
+    """
+    Formats the results
+    :param results: dict - results of a run
+    :return: str - report
+    """
+    def _s(value):
+        return '-' if value is None else '%.2fs' % value
+    lines = ['[Benchmark] sent=%.1f samples/s persisted=%.1f samples/s (%.1f %% of the sent samples saved)' %
+             (results['sent_samples_per_s'], results['persisted_samples_per_s'], 100 * results['persisted_fraction']),
+             '[Benchmark] capture -> database: p50=%s p99=%s | capture -> driver (fetch lag): p50=%s p99=%s' %
+             (_s(results['persist_latency_p50']), _s(results['persist_latency_p99']), _s(results['fetch_lag_p50']),
+              _s(results['fetch_lag_p99']))]
+    for stage in STAGES:
+        lines.append('[Benchmark] %-8s cpu=%5.1f %% rss=%6d kB' % (stage, results['stages'][stage]['cpu_percent'],
+                                                                 results['stages'][stage]['rss_max_kb']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    parser = CoSESSimulator.create_argument_parser('Benchmarks the data acquisition (clients -> CoSESServer -> '
+                                                   'database API -> CoSESDriver).')
+    parser.set_defaults(port=0, api_port=0)  # 0 = free port (a running CoSESServer is not disturbed)
+    parser.add_argument('--fetch-interval', type=float, default=60, help='fetch interval of the driver (seconds)')
+    parser.add_argument('--fetch-mode', choices=('notify', 'feed', 'poll'), default='notify',
+                        help='fetch mode of the driver (see CoSESDriver)')
+    parser.add_argument('--drain', type=float, default=120,
+                        help='maximum seconds to wait for the remaining datasets after the load phase')
+    parser.add_argument('--baseline', help='JSON file with the results of a previous run')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='accepted deviation from the baseline (0.2 = 20 %%)')
+    parser.add_argument('--stage', choices=STAGES, help='(internal) run one stage')
+    parser.add_argument('--workdir', help='directory for the files of the stages (default: new temporary directory)')
+    options = CoSESSimulator.parse_arguments(argv, parser)
+    if options.stage:
+        run_stage(options)
+        return 0
+    results = run_benchmark(options, argv)
+    print(format_results(results))
+    regressions = []
+    if options.baseline and os.path.isfile(options.baseline) and not options.save_baseline:
+        with open(options.baseline) as f:
+            regressions = compare_results(results, json.load(f), options.tolerance)
+        if regressions:
+            print('[Benchmark] Regressions: ' + ', '.join(regressions))
+    if options.baseline and (options.save_baseline or not os.path.isfile(options.baseline)):
+        with open(options.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('[Benchmark] Baseline saved: ' + options.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESCapture.py records the frames received by the CoSESServer (packet capture) and reads them back for a replay
+(see CoSESServer.py --replay). Capture files are compressed (gzip) and rotated by size and age, only a limited number
+of files is kept.
+Record format (one line per frame, tab separated):
+    <arrival time> <capture time> <station> <frame>
+Times are Unix timestamps (seconds, float). The capture time is the time assigned to a sensor data package by the
+server (empty for other frames). Text frames are written as received (escaped: string_escape), binary sensor frames
+as 'BIN1:' followed by the payload in hex. Data logged elsewhere (e.g. on the CONTROLLINO) can be converted into this
+format to backfill outages.
+"""
+
+import os
+import os.path
+import gzip
+import time
+import binascii
+from CoSESFraming import BinarySensorFrame, BINARY_PAYLOAD, BINARY_PROTOCOL
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+CAPTURE_PREFIX = 'capture_'
+CAPTURE_SUFFIX = '.txt.gz'
+BINARY_RECORD_PREFIX = BINARY_PROTOCOL + ':'
+
+
+def format_record(t_arrival, t_capture, station, frame):
+    """
+    Formats a capture record
+    :param t_arrival: float - arrival time of the frame
+    :param t_capture: float - capture time assigned to the frame (None for frames without sensor data)
+    :param station: str - station that sent the frame
+    :param frame: str | BinarySensorFrame - frame
+    :return: str - record (one line)
+    """
+    if isinstance(frame, BinarySensorFrame):
+        frame = BINARY_RECORD_PREFIX + binascii.hexlify(BINARY_PAYLOAD.pack(frame.seq, frame.t_millis, frame.status,
+                                                                            *frame.values))
+    else:
+        frame = frame.encode('string_escape')
+    t_capture = '' if t_capture is None else '%.3f' % t_capture
+    return '%.3f\t%s\t%s\t%s\n' % (t_arrival, t_capture, station, frame)
+
+
+def parse_record(line):
+    """
+    Parses a capture record
+    :param line: str - record
+    :return: tuple - arrival time (float), capture time (float or None), station (str), frame (str or
+             BinarySensorFrame); None if the record is invalid
+    """
+    fields = line.rstrip('\r\n').split('\t', 3)
+    if len(fields) != 4:
+        return None
+    try:
+        t_arrival = float(fields[0])
+        t_capture = float(fields[1]) if fields[1] else None
+        if fields[3].startswith(BINARY_RECORD_PREFIX):
+            payload = BINARY_PAYLOAD.unpack(binascii.unhexlify(fields[3][len(BINARY_RECORD_PREFIX):]))
+            frame = BinarySensorFrame(payload[0], payload[1], payload[2], payload[3:])
+        else:
+            frame = fields[3].decode('string_escape')
+    except (ValueError, TypeError):
+        return None
+    return t_arrival, t_capture, fields[2], frame
+
+
+def read_capture(paths):
+    """
+    Reads capture files (plain or gzip compressed). A file that ends abruptly (e.g. power loss while writing) is read
+    up to its last complete record
+    :param paths: list - capture files (read in this order)
+    :return: generator - records (see parse_record), invalid records are skipped
+    """
+    for path in paths:
+        f = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'r')
+        try:
+            while True:
+                try:
+                    line = f.readline()
+                except (IOError, EOFError, ValueError):  # truncated or corrupt compressed data
+                    break
+                if not line:
+                    break
+                if line.endswith('\n'):  # an incomplete last line is skipped
+                    record = parse_record(line)
+                    if record is not None:
+                        yield record
+        finally:
+            f.close()
+
+
+def list_capture_files(path_dir):
+    """
+    Returns the capture files of a directory, oldest first
+    :param path_dir: str - capture directory
+    :return: list - paths
+    """
+    names = [name for name in os.listdir(path_dir) if name.startswith(CAPTURE_PREFIX) and name.endswith(CAPTURE_SUFFIX)]
+    return [os.path.join(path_dir, name) for name in sorted(names)]
+
+
+class PacketCaptureWriter:
+    """
+    Writes capture records into compressed files that are rotated by size and age. Records are buffered and written
+    with flush() (called periodically by the RevPiServerThread). Not thread-safe
+    """
+    def __init__(self, path_dir, max_size=10485760, max_age=86400, backup_count=30):
+        """
+        :param path_dir: str - directory of the capture files (created if it does not exist)
+        :param max_size: int - a new file is started as soon as the current file is larger than this (bytes, compressed)
+        :param max_age: float - a new file is started as soon as the current file is older than this (seconds)
+        :param backup_count: int - number of files that are kept (the oldest files are deleted)
+        """
+        self.path_dir = path_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        self.backup_count = backup_count
+        if not os.path.isdir(path_dir):
+            os.makedirs(path_dir)
+        self.file = None
+        self.path = None
+        self.t_started = None
+        self.buffer = []
+
+    def write(self, t_arrival, t_capture, station, frame):
+        """
+        Appends a record (buffered)
+        :param t_arrival: float - arrival time of the frame
+        :param t_capture: float - capture time assigned to the frame (None for frames without sensor data)
+        :param station: str - station that sent the frame
+        :param frame: str | BinarySensorFrame - frame
+        :return: --
+        """
+        self.buffer.append(format_record(t_arrival, t_capture, station, frame))
+
+    def flush(self):
+        """
+        Compresses and writes the buffered records (rotates the file if necessary)
+        :param NONE: --
+        :return: --
+        """
+        if not self.buffer:
+            return
+        if self.file is None or os.path.getsize(self.path) > self.max_size or \
+                time.time() - self.t_started > self.max_age:
+            self.rotate()
+        self.file.write(''.join(self.buffer))
+        self.file.flush()  # complete deflate block: everything written so far can be read back
+        self.buffer = []
+
+    def rotate(self):
+        """
+        Closes the current file, starts a new one and deletes the oldest files
+        :param NONE: --
+        :return: --
+        """
+        self.close()
+        self.t_started = time.time()
+        name = CAPTURE_PREFIX + time.strftime('%Y%m%d_%H%M%S', time.localtime(self.t_started))
+        self.path = os.path.join(self.path_dir, name + CAPTURE_SUFFIX)
+        i = 1
+        while os.path.exists(self.path):  # several files within one second
+            self.path = os.path.join(self.path_dir, '%s_%d%s' % (name, i, CAPTURE_SUFFIX))
+            i += 1
+        self.file = gzip.open(self.path, 'wb')
+        for path in list_capture_files(self.path_dir)[:-self.backup_count]:
+            os.remove(path)
+
+    def close(self):
+        """
+        Closes the current file
+        :param NONE: --
+        :return: --
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESConfig.py keeps the content of the CoSESWeather.ini in memory so values can be looked up without reading and
+parsing the file again. The file is reloaded as soon as it has been modified (or a reload has been requested, e.g. by
+the SIGHUP handler of the CoSESServer), so changes take effect without restarting the processes.
+"""
+
+import os
+import threading
+import time
+import ConfigParser
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+_NO_DEFAULT = object()
+_BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                   '0': False, 'no': False, 'false': False, 'off': False}
+
+_configs = {}  # path -> Config (one shared instance per file)
+_configs_lock = threading.Lock()
+
+
+def get_config(path):
+    """
+    Returns the shared Config of a file (loads the file on the first call)
+    :param path: str - path to the .ini file
+    :return: Config
+    """
+    with _configs_lock:
+        config = _configs.get(path)
+        if config is None:
+            config = _configs[path] = Config(path)
+        return config
+
+
+class Config:
+    """
+    Content of an .ini file held in memory. Lookups only check the modification time of the file (at most once per
+    check_interval seconds) and reload it if it has changed.
+    """
+    def __init__(self, path, check_interval=2.0):
+        """
+        :param path: str - path to the .ini file
+        :param check_interval: float - minimum time in seconds between two checks of the modification time
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.values = {}  # section -> {option -> value}, replaced as a whole on reload
+        self.t_modified = None
+        self.t_checked = 0
+        self.isReloadRequested = False
+        self.reload_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        Reads and parses the file. The values in memory are only replaced if the whole file could be parsed
+        :param NONE: --
+        :return: --
+        """
+        t_modified = os.stat(self.path).st_mtime
+        parser = ConfigParser.ConfigParser()
+        with open(self.path) as f:
+            parser.readfp(f)
+        values = dict((section, dict(parser.items(section))) for section in parser.sections())
+        self.values = values  # atomic: readers see either the old or the new content
+        self.t_modified = t_modified
+
+    def request_reload(self):
+        """
+        Reloads the file on the next lookup. Safe to call from a signal handler
+        :param NONE: --
+        :return: --
+        """
+        self.isReloadRequested = True
+
+    def check(self):
+        """
+        Reloads the file if it has been modified or a reload has been requested. A file that cannot be read or parsed
+        (e.g. while it is being written) is ignored and the previous values are kept
+        :param NONE: --
+        :return: bool - True if the file has been reloaded
+        """
+        t_now = time.time()
+        if not self.isReloadRequested and (t_now - self.t_checked) < self.check_interval:
+            return False
+        with self.reload_lock:
+            self.t_checked = t_now
+            isReloadRequested, self.isReloadRequested = self.isReloadRequested, False
+            try:
+                if not isReloadRequested and os.stat(self.path).st_mtime == self.t_modified:
+                    return False
+                self.load()
+                return True
+            except (OSError, IOError, ConfigParser.Error):
+                return False
+
+    def get(self, section, option, default=_NO_DEFAULT):
+        """
+        Returns a value
+        :param section: str - section of the .ini file
+        :param option: str - option within the section
+        :param default: value returned if the option does not exist (if not provided a KeyError is raised)
+        :return: str - value
+        """
+        self.check()
+        try:
+            return self.values[section][option.lower()]  # options are case-insensitive (as with ConfigParser)
+        except KeyError:
+            if default is _NO_DEFAULT:
+                raise KeyError('Option ' + option + ' (section ' + section + ') missing in ' + self.path)
+            return default
+
+    def getint(self, section, option, default=_NO_DEFAULT):
+        """
+        Returns a value as int
+        :param section: str - section of the .ini file
+        :param option: str - option within the section
+        :param default: value returned if the option does not exist
+        :return: int - value
+        """
+        value = self.get(section, option, default)
+        return int(value) if value is not default else default
+
+    def getfloat(self, section, option, default=_NO_DEFAULT):
+        """
+        Returns a value as float
+        :param section: str - section of the .ini file
+        :param option: str - option within the section
+        :param default: value returned if the option does not exist
+        :return: float - value
+        """
+        value = self.get(section, option, default)
+        return float(value) if value is not default else default
+
+    def getboolean(self, section, option, default=_NO_DEFAULT):
+        """
+        Returns a value as bool (1/0, yes/no, true/false, on/off)
+        :param section: str - section of the .ini file
+        :param option: str - option within the section
+        :param default: value returned if the option does not exist
+        :return: bool - value
+        """
+        value = self.get(section, option, default)
+        if value is default:
+            return default
+        if value.lower() not in _BOOLEAN_STATES:
+            raise ValueError('Not a boolean: ' + value)
+        return _BOOLEAN_STATES[value.lower()]
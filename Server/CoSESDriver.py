@@ -10,14 +10,19 @@ weather report.
 
 import sys
 import os
-import subprocess
 import time
+import math
 import traceback
 import datetime
+import json
+import socket
 import requests
-import ConfigParser
 import syslog
 import weewx.drivers
+from CoSESConfig import get_config
+from CoSESNotifier import NotificationDispatcher
+from CoSESSystem import create_system_services
+from CoSESMetrics import MetricsRegistry, MetricsServer
 
 
 __author__ = "Miroslav Lach"
@@ -34,6 +39,8 @@ DRIVER_VERSION = 'v1.0'
 path_ini = r'/opt/CoSESWeather/CoSESWeather.ini'
 # Path to the user_notification.txt file
 path_contacts = r'/opt/CoSESWeather/user_notification.txt'
+# Default port of the metrics endpoint (driver_port in the [metrics] section of the CoSESWeather.ini, 0 = off)
+METRICS_PORT = 9786
 
 
 def loader(config_dict, _):  # Required and expected by WeeWx
@@ -56,7 +63,32 @@ class CoSESDriver(weewx.drivers.AbstractDevice):
         self.fetch_interval = float(stn_dict.get('fetch_interval', 60))  # fetch datasets for accumulation from primary database once every minute
         self.record_interval = float(stn_dict.get('record_interval', 300))  # archive (accumulated datasets) in secondary database (WeeWx database) once every 5 minutes
         self.t_warn_no_fetch = float(stn_dict.get('t_warn_if_no_fetch', 900))  # timeout in 15 minutes
+        self.station_id = stn_dict.get('station_id')  # only record datasets of this weather station (None = all stations, archive records of the backlog: 'main')
         self.php_path = self.read_ini('php_paths', 'link_db_api')
+        # email notifications are sent in the background (coalesced, repeated alerts suppressed, rate limited)
+        self.system = create_system_services(get_config(path_ini))
+        self.notifier = NotificationDispatcher(self.getDB_user_emails, self.system.transport,
+                                               stn_dict.get('notification_state',
+                                                            '/opt/CoSESWeather/notification_state_driver.json'),
+                                               path_contacts, loginf)
+        # datasets are fetched following a cursor (ID of the last dataset processed by WeeWx), in pages of this size
+        self.fetch_page_size = int(stn_dict.get('fetch_page_size', 1000))  # at most 1000 (db_manager.php)
+        self.path_cursor = stn_dict.get('cursor_state', '/opt/CoSESWeather/driver_cursor.json')
+        self.cursor = self.load_cursor()  # None = not initialised yet (first start)
+        self.cursor_pending = None  # ID of the last packet handed over to WeeWx (see commit_cursor)
+        self.t_newest_dataset = None  # capture time of the newest dataset fetched so far
+        # 'notify': wait for the CoSESServer to report saved datasets (long-poll on its local endpoint, fetch_interval
+        # is the maximum wait) | 'feed': receive the saved datasets directly from the local feed of the CoSESServer
+        # (the primary database is only read to catch up, e.g. after a restart) | 'poll': fetch periodically. Polling
+        # starts at fetch_interval_min and backs off up to fetch_interval while no datasets arrive (also used if the
+        # local endpoint is not available)
+        self.fetch_mode = stn_dict.get('fetch_mode', 'notify')
+        self.fetch_interval_min = min(float(stn_dict.get('fetch_interval_min', 5)), self.fetch_interval)
+        self.poll_interval = self.fetch_interval_min
+        self.path_local_socket = get_config(path_ini).get('config', 'path_local_socket', None)
+        self.saved_count = None  # number of saves reported by the CoSESServer (long-poll)
+        self.isNotifyAvailable = True
+        self.init_metrics()
         loginf("Initiating WeeWx CoSESDriver for CoSESWeather ...")
         loginf('CoSESDriver %s started.' % DRIVER_VERSION)
 
@@ -67,6 +99,10 @@ class CoSESDriver(weewx.drivers.AbstractDevice):
         :return: --
         """
         loginf("Shutting down WeeWx CoSESDriver for CoSESWeather ...")
+        self.save_cursor()
+        if self.metrics_server:
+            self.metrics_server.close()  # release the port (WeeWx may load the driver again)
+            self.metrics_server = None
         loginf('CoSESDriver %s shut down.' % DRIVER_VERSION)
 
     @property
@@ -86,107 +122,283 @@ class CoSESDriver(weewx.drivers.AbstractDevice):
         :param NONE: --
         :return: dictionary - Emits data packets parsed so WeeWx can process them and use it for weather report generation.
         """
+        self.commit_cursor()  # WeeWx ends the loop after processing a packet (end of the archive period)
         while True:
-            # Requesting datasets from primary database
-            data_php = {"p_mode": 2}
-            php_response = requests.post(self.php_path, data=data_php)
-            try:
-                php_response = php_response.json()
-            except Exception:
-                php_response = php_response.text
-
-            try:  # ok?
-                if '__SUCCESS;' in php_response[0]:  # Valid datasets returned by primary MySQL database
-                    del php_response[0]
-                    self.t_last_fetch = time.time()
-                    for dataset in php_response:
-                        data = dict()
-                        data['dateTime'] = int(dataset['t_unix'])  # Timestamp
-                        data['usUnits'] = weewx.METRICWX  # use METRIC (for km/h windspeed) or METRICWX (for m/s windspeed)
-                        # Anemometer
-                        if dataset['wind']:  # if value available
-                            data['windSpeed'] = float(dataset['wind'])
-                        # PT100
-                        if dataset['temp']:
-                            data['outTemp'] = float(dataset['temp'])  # PT100
-                        # SPN1 total radiation
-                        if dataset['spn1_radTot']:
-                            data['radiation'] = float(dataset['spn1_radTot'])
-                        # SPN1 diffuse radiation
-                        if dataset['spn1_radDiff']:
-                            data['radiationDiff'] = float(dataset['spn1_radDiff'])
-                        # SPN1 sunshine presence
-                        if dataset['spn1_sun']:
-                            data['sun'] = float(dataset['spn1_sun'])
-                        # CMP3 1
-                        if dataset['rad_cmp1']:
-                            data['radiation1'] = float(dataset['rad_cmp1'])
-                        # CMP3 2
-                        if dataset['rad_cmp2']:
-                            data['radiation2'] = float(dataset['rad_cmp2'])
-                        # CMP3 3
-                        if dataset['rad_cmp3']:
-                            data['radiation3'] = float(dataset['rad_cmp3'])
-                        yield data  # send data package including all acquired sensor data
-                else:
-                    if '__NO_ROWS_RETURNED;' in php_response:
-                        # no new datasets available in primary database for WeeWx to fetch and record
-                        if (time.time() - self.t_last_fetch) > self.t_warn_no_fetch:
-                            msg = "[FATAL] Could not fetch any new datasets within specified timeout window! " \
-                                  "Seems that no new datasets are saved into primary database. " \
-                                  "Please check system as soon as possible!"
+            isIdle = True
+            isPageFull = True
+            isFeed = self.fetch_mode == 'feed'
+            while isPageFull:  # fetch pages until all new datasets have been processed
+                isPageFull = False
+                if self.cursor is None and not self.init_cursor():
+                    break
+                php_response = self.request_feed(self.cursor) if isFeed else None  # long-poll, waits for datasets
+                if php_response is None:  # not in the local feed: datasets following the cursor from primary database
+                    isFeed = False
+                    php_response = self.request_datasets(self.cursor)
+
+                try:  # ok?
+                    if '__SUCCESS;' in php_response[0]:  # Valid datasets returned by primary MySQL database
+                        del php_response[0]
+                        self.t_last_fetch = time.time()
+                        self.metric_datasets_fetched.inc(len(php_response))
+                        if php_response:
+                            self.t_newest_dataset = max(self.t_newest_dataset, max(int(dataset['t_unix'])
+                                                                                   for dataset in php_response))
+                        # more datasets waiting (the local feed is requested again without waiting anyway)
+                        isPageFull = not isFeed and len(php_response) >= self.fetch_page_size
+                        isIdle = isIdle and not php_response
+                        for dataset in php_response:
+                            data = self.dataset_to_packet(dataset)
+                            self.metric_packet_lag.observe(time.time() - data['dateTime'])
+                            # the cursor is advanced only after WeeWx has processed the packet (a crash does not
+                            # lose datasets): WeeWx requests the next packet or calls genLoopPackets again
+                            self.cursor_pending = int(dataset['id'])
+                            yield data  # send data package including all acquired sensor data
+                            self.commit_cursor(isSaved=False)
+                        self.save_cursor()
+                    else:
+                        if '__NO_ROWS_RETURNED;' in php_response:
+                            # no new datasets available in primary database for WeeWx to fetch and record
+                            if (time.time() - self.t_last_fetch) > self.t_warn_no_fetch:
+                                msg = "[FATAL] Could not fetch any new datasets within specified timeout window! " \
+                                      "Seems that no new datasets are saved into primary database. " \
+                                      "Please check system as soon as possible!"
+                                self.send_notification(msg)  # send email notification to admin
+                                logerr(msg)  # log event
+                                self.restart_system()  # reboot system
+                        else:  # Error occurred in PHP script
+                            self.metric_fetch_errors.inc()
+                            msg = "[FATAL] Failed to fetch datasets from primary database! Reply: " + php_response
                             self.send_notification(msg)  # send email notification to admin
+                            self.generate_status_file('Email notification sent by driver script')
                             logerr(msg)  # log event
-                            self.restart_system()  # reboot system
-                    else:  # Error occurred in PHP script
-                        msg = "[FATAL] Failed to fetch datasets from primary database! Reply: " + php_response
-                        self.send_notification(msg)  # send email notification to admin
-                        self.generate_status_file('Email notification sent by driver script')
-                        logerr(msg)  # log event
-            except Exception:  # unexpected crash
-                crash_msg = "[FATAL] Unexpected crash occurred in CoSESDriver! Reply: " + \
-                            str(traceback.format_exc() + str(php_response) + 'Database API db_manager.php accessible '
-                                                            'with required permissions? Apache server up and running?')
-                self.send_notification(crash_msg)  # send email notification to admin
-                self.generate_status_file('Email notification sent by driver script')
-                logerr(crash_msg)  # log event
-            time.sleep(self.fetch_interval)
+                except Exception:  # unexpected crash
+                    self.metric_fetch_errors.inc()
+                    isFeed = False  # wait before the next attempt
+                    crash_msg = "[FATAL] Unexpected crash occurred in CoSESDriver! Reply: " + \
+                                str(traceback.format_exc() + str(php_response) + 'Database API db_manager.php accessible '
+                                                                'with required permissions? Apache server up and running?')
+                    self.send_notification(crash_msg)  # send email notification to admin
+                    self.generate_status_file('Email notification sent by driver script')
+                    logerr(crash_msg)  # log event
+            if not isFeed:  # the local feed has waited for new datasets already
+                self.wait_for_datasets(isIdle)
+
+    def wait_for_datasets(self, isIdle):
+        """
+        Waits until new datasets may be available. In 'notify' mode the CoSESServer replies to a long-poll request on
+        its local endpoint as soon as datasets have been saved into the primary database. Otherwise (or if the local
+        endpoint is not available) the primary database is polled, backing off while no datasets arrive
+        :param isIdle: bool - True if the last fetch did not return any datasets
+        :return: --
+        """
+        if self.fetch_mode in ('notify', 'feed'):
+            request = 'wait' if self.saved_count is None else 'wait %d %d' % (self.saved_count, self.fetch_interval)
+            reply = self.request_local_endpoint(request)
+            if reply is not None:
+                saved_count = reply[1]['saved']
+                self.metric_wakeups.labels('timeout' if saved_count == self.saved_count else 'notify').inc()
+                self.saved_count = saved_count
+                return
+        # adaptive polling: fast while datasets arrive, backing off while idle
+        self.poll_interval = min(self.poll_interval * 2, self.fetch_interval) if isIdle else self.fetch_interval_min
+        self.metric_wakeups.labels('poll').inc()
+        time.sleep(self.poll_interval)
+
+    def request_feed(self, cursor):
+        """
+        Requests the datasets following a cursor from the local feed of the CoSESServer (long-poll: waits at most
+        fetch_interval for new datasets). The feed only holds the datasets saved recently, older datasets (e.g. saved
+        while WeeWx was not running) have to be read from the primary database
+        :param cursor: int - ID of the last dataset processed
+        :return: list | str - reply like request_datasets | None if the datasets have to be read from the primary
+                 database (not in the local feed or local endpoint not available)
+        """
+        request = 'feed %d %d %d' % (cursor, self.fetch_interval, self.fetch_page_size)
+        if self.station_id:
+            request += ' ' + self.station_id
+        reply = self.request_local_endpoint(request)
+        if reply == '__GAP;':
+            self.metric_feed_gaps.inc()
+            return None
+        if reply is not None:
+            self.metric_wakeups.labels('timeout' if reply == '__NO_ROWS_RETURNED;' else 'feed').inc()
+        return reply
+
+    def request_local_endpoint(self, request):
+        """
+        Sends a request to the local endpoint of the CoSESServer (see CoSESServer.handle_local_request)
+        :param request: str - request
+        :return: list | str - reply (decoded) | None if the local endpoint is not available
+        """
+        if not self.path_local_socket:
+            return None
+        sock = None
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.fetch_interval + 10)
+            sock.connect(self.path_local_socket)
+            sock.sendall(request + '\n')
+            reply = ''
+            while not reply.endswith('\n'):
+                data = sock.recv(65536)
+                if not data:
+                    break
+                reply += data
+            reply = json.loads(reply)
+            if not self.isNotifyAvailable:
+                self.isNotifyAvailable = True
+                loginf('Local endpoint of the CoSESServer available again.')
+            return reply
+        except Exception:
+            if self.isNotifyAvailable:  # logged once, polling until the local endpoint is available again
+                self.isNotifyAvailable = False
+                logerr('[- Warning -] Local endpoint of the CoSESServer not available, polling the primary '
+                       'database instead! ' + traceback.format_exc().splitlines()[-1])
+            return None
+        finally:
+            if sock:
+                sock.close()
+
+    def genArchiveRecords(self, since_ts):
+        """
+        Required and expected by WeeWx (hardware record generation: called on startup and after every archive period).
+        This function requests the datasets of completed archive intervals that have not been processed yet (e.g.
+        saved while WeeWx was not running) aggregated per interval by the primary database (p_mode 22: one row per
+        interval instead of every dataset), so WeeWx does not have to accumulate the backlog packet by packet. Datasets
+        of the current interval are left for genLoopPackets. Without backlog, NotImplementedError is raised and WeeWx
+        generates the record from the loop packets (software record generation)
+        :param since_ts: int - time of the newest archive record in the WeeWx database (None = empty database)
+        :return: dictionary - Emits archive records (mean of every interval, windGust = maximum wind speed)
+        """
+        t_start_current = self.get_interval_end(time.time()) - self.record_interval  # start of the current interval
+        self.commit_cursor()  # called by WeeWx after the loop packets of the archive period have been processed
+        if self.cursor is None and not self.init_cursor():
+            raise NotImplementedError('No backlog: the archive record is generated from the loop packets')
+        php_response = self.request_archive_records(self.cursor, t_start_current, since_ts or 0)
+        if not isinstance(php_response, list) or '__SUCCESS;' not in php_response[0]:
+            # no backlog (errors are reported by genLoopPackets)
+            raise NotImplementedError('No backlog: the archive record is generated from the loop packets')
+        intervals = php_response[2:]
+        for interval in intervals:
+            yield self.make_archive_record(interval)
+        # advanced only after WeeWx has processed the records (intervals written by WeeWx are skipped by the database
+        # if the records are requested again)
+        self.cursor = int(php_response[1]['cursor'])
+        self.save_cursor()
+        self.metric_datasets_fetched.inc(sum(int(interval['datasets']) for interval in intervals))
+        if not intervals:
+            raise NotImplementedError('No backlog: the archive record is generated from the loop packets')
+        self.metric_archive_records.inc(len(intervals))
+        loginf('Backlog aggregated into %d archive records (up to %s).' %
+               (len(intervals), time.strftime('%d.%m.%Y|%H:%M:%S', time.localtime(int(intervals[-1]['t_end'])))))
+
+    @property
+    def archive_interval(self):
+        """
+        Required and expected by WeeWx (hardware record generation).
+        :param NONE: --
+        :return: int - archive interval in seconds (record_interval)
+        """
+        return int(self.record_interval)
+
+    def get_interval_end(self, t_unix):
+        """
+        Returns the end of the archive interval a time belongs to (intervals include their end like in WeeWx)
+        :param t_unix: float - time
+        :return: int - end of the interval
+        """
+        return int(math.ceil(t_unix / self.record_interval) * self.record_interval)
+
+    def make_archive_record(self, interval):
+        """
+        Creates an archive record of an interval aggregated by the primary database
+        :param interval: dict - interval (values as returned by db_manager.php, p_mode 22)
+        :return: dictionary - archive record
+        """
+        record = self.dataset_to_packet(dict(interval, t_unix=interval['t_end']))
+        record['interval'] = int(self.record_interval / 60)
+        if interval['wind_max']:
+            record['windGust'] = float(interval['wind_max'])
+        return record
+
+    def dataset_to_packet(self, dataset):
+        """
+        Converts a dataset of the primary database into a WeeWx data packet
+        :param dataset: dict - dataset (values as returned by db_manager.php)
+        :return: dictionary - data packet
+        """
+        data = dict()
+        data['dateTime'] = int(dataset['t_unix'])  # Timestamp
+        data['usUnits'] = weewx.METRICWX  # use METRIC (for km/h windspeed) or METRICWX (for m/s windspeed)
+        # Anemometer
+        if dataset['wind']:  # if value available
+            data['windSpeed'] = float(dataset['wind'])
+        # PT100
+        if dataset['temp']:
+            data['outTemp'] = float(dataset['temp'])  # PT100
+        # SPN1 total radiation
+        if dataset['spn1_radTot']:
+            data['radiation'] = float(dataset['spn1_radTot'])
+        # SPN1 diffuse radiation
+        if dataset['spn1_radDiff']:
+            data['radiationDiff'] = float(dataset['spn1_radDiff'])
+        # SPN1 sunshine presence
+        if dataset['spn1_sun']:
+            data['sun'] = float(dataset['spn1_sun'])
+        # CMP3 1
+        if dataset['rad_cmp1']:
+            data['radiation1'] = float(dataset['rad_cmp1'])
+        # CMP3 2
+        if dataset['rad_cmp2']:
+            data['radiation2'] = float(dataset['rad_cmp2'])
+        # CMP3 3
+        if dataset['rad_cmp3']:
+            data['radiation3'] = float(dataset['rad_cmp3'])
+        return data
+
+    def request_datasets(self, cursor):
+        """
+        Requests the datasets following a cursor from the primary database (one page)
+        :param cursor: int - ID of the last dataset processed
+        :return: list - reply of the database API (['__SUCCESS;', datasets ...]) | str - reply in case of errors
+        """
+        data_php = {"p_mode": 21, "p_after": cursor, "p_limit": self.fetch_page_size}
+        if self.station_id:
+            data_php["p_station"] = self.station_id
+        php_response = self.post_db_api(data_php)
+        try:
+            return php_response.json()
+        except Exception:
+            return php_response.text
+
+    def request_archive_records(self, cursor, t_before, t_since):
+        """
+        Requests the datasets following a cursor from the primary database, aggregated per archive interval (backlog)
+        :param cursor: int - ID of the last dataset processed
+        :param t_before: int - start of the current interval (datasets from the first one captured later on are left)
+        :param t_since: int - end of the newest archived interval (older datasets are skipped)
+        :return: list - reply of the database API (['__SUCCESS;', {'cursor': ID}, intervals ...]) | str - reply in
+                 case of errors
+        """
+        data_php = {"p_mode": 22, "p_after": cursor, "p_interval": int(self.record_interval),
+                    "p_before": int(t_before), "p_since": int(t_since)}
+        if self.station_id:
+            data_php["p_station"] = self.station_id
+        php_response = self.post_db_api(data_php)
+        try:
+            return php_response.json()
+        except Exception:
+            return php_response.text
 
     def send_notification(self, msg):
         """
-        Send an email notification
+        Send an email notification. The message is handed over to the NotificationDispatcher (CoSESNotifier) that
+        coalesces alerts into digests, suppresses repeated alerts and sends the emails in the background
         :param msg: str - The message to be sent via email
         :return: --
         """
-        def _send(inst, message):
-            email_list = inst.getDB_user_emails()
-            mail_content = '[' + time.strftime("%d.%m.%Y|%H:%M:%S", time.localtime()) + ']' + message
-            mail_subject = '[CoSESWeather]Warning: Faulty Behaviour detected!'
-            try:  # database returned updated contact/email list
-                if email_list[0]:  # if there are mail addresses in database
-                    for mail in email_list:
-                        process = subprocess.Popen(['mail', '-s', str(mail_subject), str(mail)], stdin=subprocess.PIPE) # Send email notification
-                        process.communicate(str(mail_content))  # Using PIPE to inject message body into the unix-process
-                    loginf('Notification sent to system administrators.')
-            except Exception:  # database did not reply - get emails out of notification file directly
-                try:
-                    f = open(path_contacts, 'r')  # read notification.txt file
-                    email_list = f.readlines()
-                    f.close()
-                    if email_list:  # if there are mail addresses in .txt file
-                        for mail in email_list:
-                            process = subprocess.Popen(['mail', '-s', str(mail_subject), str(mail)], stdin=subprocess.PIPE)  # Send email notification
-                            process.communicate(str(mail_content))  # Using PIPE to inject message body into the unix-process
-                        loginf('Notification sent to system administrators.')
-                except Exception:
-                    pass
-
-        if not self.check_status_file():  # If no status file exists, send notification
-            _send(self, msg)
-        else:  # If status file exists, only send one notification per day (to prevent notification spamming)
-            if self.check_status_file_date():
-                _send(self, msg + ' This is a repeating message. The system is still not running properly. '
-                                  'Please look into it as soon as possible.')
+        self.notifier.notify(msg)
 
     def check_status_file(self):
         """
@@ -210,8 +422,10 @@ class CoSESDriver(weewx.drivers.AbstractDevice):
         """
         try:
             file_path = self.read_ini('config', 'path_status_file')  # Get path from .ini file
-            with open(file_path, 'r') as file_r:  # read status file and check the last line
-                lastLine = list(file_r)[-1]
+            with open(file_path, 'r') as file_r:  # read status file and check the last line (only the end of the file)
+                file_r.seek(0, os.SEEK_END)
+                file_r.seek(max(0, file_r.tell() - 512))
+                lastLine = file_r.read().splitlines()[-1]
             date_log = lastLine[1:20]  # extract the timestamp of the log line
             day_of_month_CURRENT = int(time.strftime("%d", time.localtime()))
             day_of_month_LOG = int(datetime.datetime.strptime(date_log, "%d.%m.%Y|%H:%M:%S").day)
@@ -248,11 +462,143 @@ class CoSESDriver(weewx.drivers.AbstractDevice):
         :return: --
         """
         loginf('Initiating system reboot ...')
+        self.metric_reboots.inc()
         # Create local file so system knows there just has been a restart in order to fix issues before
         self.generate_status_file('Restart triggered by driver')
         # wait and trigger restart
+        self.notifier.flush()  # send the pending notifications first
         time.sleep(5)
-        subprocess.call(['shutdown', '-r', 'now'])  # Restart RevPi (call = blocking)
+        try:
+            self.system.request_reboot()  # Restart RevPi
+        except Exception:
+            logerr('[FATAL] System reboot failed! ' + traceback.format_exc())
+
+    def init_metrics(self):
+        """
+        Creates the metrics of the driver and starts the metrics endpoint (see CoSESMetrics)
+        :param NONE: --
+        :return: --
+        """
+        self.metrics = MetricsRegistry()
+        m = self.metrics
+        self.metric_datasets_fetched = m.counter('cosesdriver_datasets_fetched_total',
+                                                 'Datasets fetched from the primary database')
+        self.metric_archive_records = m.counter('cosesdriver_archive_records_total',
+                                                'Archive records generated by the driver from a backlog of datasets')
+        self.metric_fetch_errors = m.counter('cosesdriver_fetch_errors_total',
+                                             'Fetches that failed (database API error or invalid reply)')
+        m.gauge('cosesdriver_fetch_lag_seconds', 'Age of the newest dataset fetched from the primary database',
+                callback=lambda: time.time() - self.t_newest_dataset if self.t_newest_dataset else {})
+        m.gauge('cosesdriver_last_fetch_age_seconds', 'Time since datasets have been fetched successfully',
+                callback=lambda: time.time() - self.t_last_fetch)
+        self.metric_packet_lag = m.histogram('cosesdriver_packet_lag_seconds',
+                                             'Time from the capture of a dataset until it is handed over to WeeWx',
+                                             buckets=(1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0))
+        self.metric_wakeups = m.counter('cosesdriver_fetch_wakeups_total',
+                                        'Fetches by trigger (notify = datasets saved, feed = datasets received '
+                                        'from the local feed, timeout = long-poll expired, poll = polling interval '
+                                        'elapsed)', ('reason',))
+        self.metric_feed_gaps = m.counter('cosesdriver_feed_gaps_total',
+                                          'Datasets not in the local feed of the CoSESServer (read from the primary '
+                                          'database instead)')
+        m.gauge('cosesdriver_poll_interval_seconds', 'Current polling interval (used without local endpoint)',
+                callback=lambda: self.poll_interval)
+        self.metric_php_duration = m.histogram('cosesdriver_php_request_duration_seconds',
+                                               'Latency of the requests to the database API', ('p_mode',))
+        self.metric_php_errors = m.counter('cosesdriver_php_request_errors_total',
+                                           'Requests to the database API that failed (no reply)', ('p_mode',))
+        self.metric_reboots = m.counter('cosesdriver_reboots_total', 'System reboots initiated by the driver')
+        self.metrics_server = None
+        config = get_config(path_ini)
+        metrics_port = config.getint('metrics', 'driver_port', METRICS_PORT)
+        if metrics_port > 0:
+            try:  # not essential, the driver keeps running without the endpoint
+                self.metrics_server = MetricsServer(self.metrics, metrics_port,
+                                                    config.get('metrics', 'bind', '127.0.0.1'))
+            except Exception:
+                logerr('Metrics endpoint could not be started! ' + traceback.format_exc())
+
+    def init_cursor(self):
+        """
+        Initialises the cursor on the first start (no cursor saved yet): datasets not fetched by the previous driver
+        version (p_mode 2) are fetched first, otherwise only datasets saved from now on
+        :param NONE: --
+        :return: bool - True if the cursor has been initialised
+        """
+        data_php = {"p_mode": 21}
+        if self.station_id:
+            data_php["p_station"] = self.station_id
+        try:
+            php_response = self.post_db_api(data_php, timeout=30).json()
+            if '__SUCCESS;' in php_response[0]:
+                self.cursor = int(php_response[1]['cursor'])
+                self.save_cursor()
+                loginf('No cursor saved yet: fetching datasets following ID %d.' % self.cursor)
+                return True
+        except Exception:
+            php_response = traceback.format_exc()
+        self.metric_fetch_errors.inc()
+        logerr('[FATAL] Cursor could not be initialised! Reply: ' + str(php_response))
+        return False
+
+    def commit_cursor(self, isSaved=True):
+        """
+        Advances the cursor to the last packet handed over to WeeWx. Called when WeeWx requests the next packet or calls
+        genLoopPackets (genArchiveRecords) again: at the end of an archive period WeeWx processes the packet and then
+        drops the generator without requesting another packet
+        :param isSaved: bool - persist the cursor
+        :return: --
+        """
+        if self.cursor_pending is None:
+            return
+        self.cursor = self.cursor_pending
+        self.cursor_pending = None
+        if isSaved:
+            self.save_cursor()
+
+    def load_cursor(self):
+        """
+        Reads the persisted cursor (ID of the last dataset processed by WeeWx)
+        :param NONE: --
+        :return: int - cursor (None if no cursor has been saved yet)
+        """
+        try:
+            with open(self.path_cursor, 'r') as f:
+                return int(json.load(f)['id'])
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def save_cursor(self):
+        """
+        Persists the cursor (the file is replaced atomically)
+        :param NONE: --
+        :return: --
+        """
+        if self.cursor is None:
+            return
+        try:
+            path_tmp = self.path_cursor + '.tmp'
+            with open(path_tmp, 'w') as f:
+                json.dump({'id': self.cursor, 't_saved': int(time.time())}, f)
+            os.rename(path_tmp, self.path_cursor)  # atomic: the file is never half-written
+        except (IOError, OSError):
+            logerr('[- Warning -] Cursor could not be saved! ' + str(traceback.format_exc()))
+
+    def post_db_api(self, data, timeout=None):
+        """
+        Sends a request to the database API (db_manager.php) and records its latency
+        :param data: dict - POST parameters (p_mode, ...)
+        :param timeout: float - timeout in seconds (None = no timeout)
+        :return: requests.Response (exceptions are passed on)
+        """
+        t_start = time.time()
+        try:
+            return requests.post(self.php_path, data=data, timeout=timeout)
+        except Exception:
+            self.metric_php_errors.labels(data['p_mode']).inc()
+            raise
+        finally:
+            self.metric_php_duration.labels(data['p_mode']).observe(time.time() - t_start)
 
     def getDB_user_emails(self):
         """
@@ -262,11 +608,14 @@ class CoSESDriver(weewx.drivers.AbstractDevice):
         """
         data_php = {"p_mode": 3}
         # Requesting emails from user database
-        php_response = requests.post(self.php_path, data=data_php)
+        try:
+            php_response = self.post_db_api(data_php, timeout=10)
+        except Exception:
+            php_response = None
         try:
             php_response = php_response.json()
         except Exception:
-            php_response = php_response.text
+            php_response = getattr(php_response, 'text', php_response)
 
         try:  # ok?
             if '__SUCCESS;' in php_response[0]:  # valid php response returned by MySQL user database
@@ -284,15 +633,14 @@ class CoSESDriver(weewx.drivers.AbstractDevice):
 
     def read_ini(self, section, value):
         """
-        Read the CoSESWeather.ini to extract paths to files
+        Read the CoSESWeather.ini to extract paths to files (the file is parsed once and kept in memory, changes are
+        reloaded automatically - see CoSESConfig)
         :param section: str - Desired section that should be extracted from the .ini file
         :param value: str - Desired value that should be extracted from the .ini file
         :return data_out: str - requested value
         """
         try:
-            config = ConfigParser.ConfigParser()
-            config.read(path_ini)
-            data_out = config.get(section, value)
+            data_out = get_config(path_ini).get(section, value)
             return data_out
         except Exception:
             logerr("[FATAL] CoSESWeather.ini file could not be found! Please make sure the file exists and is in "
@@ -304,10 +652,3 @@ if __name__ == '__main__':
     driver = CoSESDriver()
     for packet in driver.genLoopPackets():
         print packet
-
-
-
-
-
-
-
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESEventLoop.py implements a small event loop (epoll, or poll where epoll is not available) with timer scheduling.
+It is used by the CoSESServer to wait for incoming connections and data without busy polling the sockets.
+"""
+
+import os
+import errno
+import fcntl
+import heapq
+import itertools
+import select
+import threading
+import time
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+if hasattr(select, 'epoll'):
+    EVENT_READ = select.EPOLLIN | select.EPOLLPRI | select.EPOLLERR | select.EPOLLHUP
+else:
+    EVENT_READ = select.POLLIN | select.POLLPRI | select.POLLERR | select.POLLHUP
+
+
+class Timer:
+    """
+    Handle of a scheduled callback. Returned by EventLoop.call_later() and EventLoop.call_every()
+    """
+    def __init__(self, deadline, interval, callback, args):
+        self.deadline = deadline
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Cancels the scheduled callback
+        :param NONE: --
+        :return: --
+        """
+        self.cancelled = True
+
+
+class EventLoop:
+    """
+    Dispatches socket readiness and timers to callbacks. All callbacks run on the thread that calls run().
+    Exceptions raised by callbacks are not caught and end run().
+    """
+    def __init__(self, max_timeout=1.0):
+        """
+        :param max_timeout: float - maximum time in seconds the loop sleeps before checking the keep-running condition
+        """
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+        else:
+            self._poller = select.poll()
+        self.max_timeout = max_timeout
+        self._readers = {}  # fd -> callback
+        self._timers = []  # heap of (deadline, sequence number, Timer)
+        self._sequence = itertools.count()
+        self._pending = []  # callbacks handed over from other threads
+        self._pending_lock = threading.Lock()
+        self._running = False
+        # Pipe that allows other threads to wake up the loop
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._poller.register(self._wakeup_r, EVENT_READ)
+
+    def add_reader(self, sock, callback):
+        """
+        Calls callback() whenever the socket is readable (new data, incoming connection or connection closed)
+        :param sock: socket object (or file descriptor)
+        :param callback: function - called without arguments
+        :return: --
+        """
+        fd = sock if isinstance(sock, int) else sock.fileno()
+        if fd in self._readers:
+            self._poller.modify(fd, EVENT_READ)
+        else:
+            self._poller.register(fd, EVENT_READ)
+        self._readers[fd] = callback
+
+    def remove_reader(self, sock):
+        """
+        Stops watching the socket
+        :param sock: socket object (or file descriptor)
+        :return: --
+        """
+        try:
+            fd = sock if isinstance(sock, int) else sock.fileno()
+        except Exception:  # socket already closed
+            return
+        if fd in self._readers:
+            del self._readers[fd]
+            try:
+                self._poller.unregister(fd)
+            except Exception:
+                pass
+
+    def call_later(self, delay, callback, *args):
+        """
+        Calls callback(*args) once after delay seconds
+        :param delay: float - delay in seconds
+        :param callback: function
+        :return: Timer - handle to cancel the call
+        """
+        timer = Timer(time.time() + delay, None, callback, args)
+        heapq.heappush(self._timers, (timer.deadline, next(self._sequence), timer))
+        return timer
+
+    def call_every(self, interval, callback, *args):
+        """
+        Calls callback(*args) every interval seconds (first call after one interval)
+        :param interval: float - interval in seconds
+        :param callback: function
+        :return: Timer - handle to cancel the calls
+        """
+        timer = Timer(time.time() + interval, interval, callback, args)
+        heapq.heappush(self._timers, (timer.deadline, next(self._sequence), timer))
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+        Hands a callback over from another thread. It will be called by the loop thread as soon as possible
+        :param callback: function
+        :return: --
+        """
+        with self._pending_lock:
+            self._pending.append((callback, args))
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, 'x')
+        except OSError, e:
+            if e.errno != errno.EAGAIN:  # pipe full = loop will wake up anyway
+                raise
+
+    def stop(self):
+        """
+        Ends run() after the current callback has returned. Can be called from any thread
+        :param NONE: --
+        :return: --
+        """
+        self._running = False
+        self._wakeup()
+
+    def run(self, keep_running=None):
+        """
+        Runs the loop until stop() is called or keep_running() returns False
+        :param keep_running: function - optional condition checked at least every max_timeout seconds
+        :return: --
+        """
+        self._running = True
+        while self._running and (keep_running is None or keep_running()):
+            self.run_once()
+
+    def run_once(self):
+        """
+        Waits for the next socket event or timer and calls the respective callbacks
+        :param NONE: --
+        :return: --
+        """
+        timeout = self.max_timeout
+        while self._timers and self._timers[0][2].cancelled:  # discard cancelled timers
+            heapq.heappop(self._timers)
+        if self._timers:
+            timeout = max(0.0, min(timeout, self._timers[0][0] - time.time()))
+        try:
+            if hasattr(select, 'epoll') and isinstance(self._poller, select.epoll):
+                events = self._poller.poll(timeout)
+            else:
+                events = self._poller.poll(timeout * 1000)  # poll() expects milliseconds
+        except (IOError, OSError, select.error), e:
+            if e.args[0] == errno.EINTR:  # interrupted by a signal
+                return
+            raise
+        for fd, _ in events:
+            if not self._running:
+                return
+            if fd == self._wakeup_r:
+                try:
+                    while os.read(self._wakeup_r, 512):
+                        pass
+                except OSError:
+                    pass
+            elif fd in self._readers:
+                self._readers[fd]()
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        for callback, args in pending:
+            callback(*args)
+        now = time.time()
+        while self._running and self._timers and self._timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+            if timer.interval is not None:  # periodic timer: schedule next call (without drift)
+                timer.deadline = max(timer.deadline + timer.interval, now)
+                heapq.heappush(self._timers, (timer.deadline, next(self._sequence), timer))
+            timer.callback(*timer.args)
+
+    def close(self):
+        """
+        Releases the poller and the wakeup pipe. Registered sockets are not closed
+        :param NONE: --
+        :return: --
+        """
+        self._readers.clear()
+        self._timers = []
+        try:
+            if hasattr(self._poller, 'close'):
+                self._poller.close()
+        finally:
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESFraming.py splits the byte stream received from a CONTROLLINO into complete frames (text lines or binary sensor
+frames). Data received by one recv() call may contain several frames or only a part of a frame, so incomplete data is
+kept until the rest arrives.
+"""
+
+import struct
+from collections import namedtuple
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+# Frame types
+FRAME_SENSOR = 'sensor'  # sensor data package: values separated by '|' (optional header: '<seq>,<millis>;')
+FRAME_HEARTBEAT = 'heartbeat'  # HeartBeat reply: '*'
+FRAME_HELLO = 'hello'  # station ID announcement (after connecting): '@<station_id>'
+FRAME_PROTOCOL = 'protocol'  # protocol request (after connecting): '%<protocol>', e.g. '%BIN1'
+FRAME_BINARY = 'binary'  # binary sensor frame (BinarySensorFrame)
+FRAME_UNKNOWN = 'unknown'
+
+SensorValue_separator = '|'
+SequenceHeader_separator = ';'
+HeartBeatControllinoReply_char = '*'
+StationHello_char = '@'
+ProtocolRequest_char = '%'
+
+# Binary sensor frame (little-endian, as sent by the CONTROLLINO):
+# sync (0xA5 0x5A) | version (uint8) | payload length (uint8) | payload | Fletcher-16 checksum of version to payload
+# Payload (version 1): sequence number (uint16) | client time in ms (uint32, millis()) | status (uint16, bit i set =
+# sensor value i invalid) | 8 sensor values (float32) in the order wind, temp, spn1_radTot, spn1_radDiff, spn1_sun,
+# rad_cmp1, rad_cmp2, rad_cmp3
+BINARY_PROTOCOL = 'BIN1'
+BINARY_SYNC = '\xa5\x5a'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<2sBB')
+BINARY_PAYLOAD = struct.Struct('<HIH8f')
+BINARY_CHECKSUM = struct.Struct('<H')
+BINARY_FRAME_SIZE = BINARY_HEADER.size + BINARY_PAYLOAD.size + BINARY_CHECKSUM.size
+
+BinarySensorFrame = namedtuple('BinarySensorFrame', 'seq t_millis status values')
+
+# Text sensor data packages of current clients start with a header: sequence number (uint16) and client time in ms
+# (uint32, millis()) of the sample, e.g. '17,85000;2.94|17.09|796.94,85.78,1|800.24|787.10|787.48'. Packages of older
+# clients have no header
+
+# A line without line break that grows longer than this is garbage (e.g. noise on the line) and will be discarded
+MAX_LINE_LENGTH = 512
+
+
+def fletcher16(data):
+    """
+    Calculates the Fletcher-16 checksum (cheap to calculate on the CONTROLLINO)
+    :param data: str - data
+    :return: int - checksum
+    """
+    sum1 = 0
+    sum2 = 0
+    for byte in bytearray(data):
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+
+def classify_frame(line):
+    """
+    Determines the type of a received frame
+    :param line: str - complete frame (without line break)
+    :return: str - FRAME_SENSOR | FRAME_BINARY | FRAME_HEARTBEAT | FRAME_HELLO | FRAME_PROTOCOL | FRAME_UNKNOWN
+    """
+    if isinstance(line, BinarySensorFrame):
+        return FRAME_BINARY
+    elif SensorValue_separator in line:
+        return FRAME_SENSOR
+    elif line[0] == StationHello_char:
+        return FRAME_HELLO
+    elif line[0] == ProtocolRequest_char:
+        return FRAME_PROTOCOL
+    elif line == HeartBeatControllinoReply_char:
+        return FRAME_HEARTBEAT
+    return FRAME_UNKNOWN
+
+
+def split_sequenced_package(line):
+    """
+    Splits a text sensor data package into its header (sequence number and client time) and the sensor values
+    :param line: str - sensor data package
+    :return: tuple - sequence number (int), client time in ms (int) and sensor values (str); sequence number and client
+             time are None if the package has no (valid) header
+    """
+    header, separator, package = line.partition(SequenceHeader_separator)
+    if not separator:
+        return None, None, line
+    try:
+        seq, t_millis = header.split(',')
+        return int(seq) & 0xffff, int(t_millis) & 0xffffffff, package
+    except ValueError:  # corrupt header: the package is dropped as invalid
+        return None, None, line
+
+
+class LineFramer:
+    """
+    Incremental line framing of one connection. Keeps incomplete lines between recv() calls.
+    """
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        """
+        :param max_line_length: int - maximum length of a line (longer lines are discarded)
+        """
+        self.max_line_length = max_line_length
+        self.buffer = ''
+        self.isDiscarding = False  # True while the rest of an overlong line is being skipped
+        self.discarded = 0  # number of discarded overlong lines
+
+    def feed(self, data):
+        """
+        Adds received data and returns all lines completed by it
+        :param data: str - data returned by recv()
+        :return: list - complete lines (stripped, empty lines are skipped)
+        """
+        lines = (self.buffer + data).split('\n')
+        self.buffer = lines.pop()  # incomplete rest (empty if the data ended with a line break)
+        if self.isDiscarding and lines:  # end of the overlong line reached
+            del lines[0]
+            self.isDiscarding = False
+        if len(self.buffer) > self.max_line_length:
+            if not self.isDiscarding:
+                self.discarded += 1
+            self.buffer = ''
+            self.isDiscarding = True
+        return [line.strip() for line in lines if line.strip()]
+
+
+class BinaryFramer(LineFramer):
+    """
+    Framing of a connection that uses the binary protocol. Binary sensor frames are recognized by their sync bytes,
+    everything else is still handled as text lines (HeartBeat replies, announcements).
+    """
+    def feed(self, data):
+        """
+        Adds received data and returns all frames completed by it
+        :param data: str - data returned by recv()
+        :return: list - complete frames: text lines (str, stripped) and binary sensor frames (BinarySensorFrame)
+        """
+        buf = self.buffer + data
+        frames = []
+        pos = 0
+        while pos < len(buf):
+            if buf.startswith(BINARY_SYNC, pos) or (pos == len(buf) - 1 and buf[pos] == BINARY_SYNC[0]):
+                if len(buf) - pos < BINARY_HEADER.size:  # header incomplete
+                    break
+                _, version, length = BINARY_HEADER.unpack_from(buf, pos)
+                end = pos + BINARY_HEADER.size + length + BINARY_CHECKSUM.size
+                if version == BINARY_VERSION and length == BINARY_PAYLOAD.size:
+                    if len(buf) < end:  # frame incomplete
+                        break
+                    checksum = BINARY_CHECKSUM.unpack_from(buf, end - BINARY_CHECKSUM.size)[0]
+                    if fletcher16(buf[pos + 2:end - BINARY_CHECKSUM.size]) == checksum:
+                        payload = BINARY_PAYLOAD.unpack_from(buf, pos + BINARY_HEADER.size)
+                        frames.append(BinarySensorFrame(payload[0], payload[1], payload[2], payload[3:]))
+                        pos = end
+                        continue
+                # corrupt frame (or sync bytes within garbage): skip to the next sync bytes
+                self.discarded += 1
+                pos = self._resync(buf, pos + 1)
+            else:  # text line
+                end = buf.find('\n', pos)
+                sync = buf.find(BINARY_SYNC, pos)
+                if 0 <= sync < end or (end < 0 and sync >= 0):  # binary frame starts within the line: garbage
+                    self.discarded += 1
+                    pos = sync
+                elif end < 0:  # line incomplete
+                    break
+                else:
+                    line = buf[pos:end].strip()
+                    if line:
+                        frames.append(line)
+                    pos = end + 1
+        self.buffer = buf[pos:]
+        if len(self.buffer) > max(self.max_line_length, BINARY_FRAME_SIZE):
+            self.discarded += 1
+            self.buffer = self.buffer[self._resync(self.buffer, 1):]
+        return frames
+
+    def _resync(self, buf, pos):
+        # Returns the position of the next sync bytes (or of the last byte if it could be the first sync byte)
+        sync = buf.find(BINARY_SYNC, pos)
+        if sync >= 0:
+            return sync
+        if buf.endswith(BINARY_SYNC[0]):
+            return max(len(buf) - 1, pos)
+        return len(buf)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESImport.py imports the datasets of the primary database (table sensor_datasets) into the archive of the secondary
+database (WeeWx) in bulk, e.g. to rebuild the WeeWx database after a corruption or a schema change. Replaying the
+datasets through the CoSESDriver takes days, here the datasets are read in ranges of IDs and aggregated into archive
+records by the database (GROUP BY archive interval, same records as generated by CoSESDriver.genArchiveRecords). The
+records are inserted in one transaction per range and the daily summaries (archive_day_*, including the CoSES
+observations radiationDiff, sun and radiation1..3) of the imported days are rebuilt in one pass afterwards.
+The databases are opened with the configuration of WeeWx (weewx.conf): the primary database is expected on the same
+database server as the WeeWx database (same credentials, see db_config.php). WeeWx must not be running during the
+import. Only completed archive intervals are imported, existing archive records are kept (unless --replace).
+
+Example: python CoSESImport.py --from 2019-06-01 --to 2019-06-30
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import traceback
+import configobj
+import weedb
+import weewx
+import weewx.manager
+import weewx.units
+from CoSESConfig import get_config
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+# Path to the CoSESWeather.ini file
+path_ini = r'/opt/CoSESWeather/CoSESWeather.ini'
+
+# Columns of the table sensor_datasets -> WeeWx observations (same as CoSESDriver.dataset_to_packet)
+OBSERVATIONS = (('wind', 'windSpeed'), ('temp', 'outTemp'), ('spn1_radTot', 'radiation'),
+                ('spn1_radDiff', 'radiationDiff'), ('spn1_sun', 'sun'), ('rad_cmp1', 'radiation1'),
+                ('rad_cmp2', 'radiation2'), ('rad_cmp3', 'radiation3'))
+PRIMARY_DB = 'CoSESWeather_DB'  # MYSQL_DB1 in db_config.php
+DEFAULT_STATION_ID = 'main'  # station of single station setups (DEFAULT_STATION in db_manager.php)
+ImportChunk_size = 50000  # datasets (range of IDs) read and aggregated per query
+t_ImportLate = 3600  # intervals are written once datasets this much newer have been read (later datasets are skipped)
+
+
+class ArchiveImporter:
+    """
+    Aggregates the datasets of the primary database into archive records and inserts them into the WeeWx archive
+    """
+    def __init__(self, config_dict, options):
+        """
+        :param config_dict: ConfigObj - configuration of WeeWx (weewx.conf)
+        :param options: argparse.Namespace - see create_argument_parser
+        """
+        driver_dict = config_dict.get('CoSESDriver', {})
+        self.record_interval = int(driver_dict.get('record_interval', 300))  # as the CoSESDriver
+        # datasets of different stations are never aggregated into one record (default: single station setups)
+        self.station_id = options.station or driver_dict.get('station_id') or DEFAULT_STATION_ID
+        self.path_cursor = driver_dict.get('cursor_state', '/opt/CoSESWeather/driver_cursor.json')
+        self.options = options
+        self.archive = weewx.manager.open_manager_with_config(config_dict, options.binding, initialize=True)
+        # the primary database is on the database server of the WeeWx database
+        database_dict = weewx.manager.get_database_dict_from_config(
+            config_dict, config_dict['DataBindings'][options.binding]['database'])
+        database_dict['database_name'] = options.primary_db
+        self.primary = weedb.connect(database_dict)
+        self.check_unit_system(config_dict)
+        columns = self.archive.connection.columnsOf(self.archive.table_name)
+        self.observations = [(column, key) for column, key in OBSERVATIONS if key in columns]
+        self.record_keys = ['dateTime', 'usUnits', 'interval'] + [key for _, key in self.observations]
+        if 'windGust' in columns and 'windSpeed' in self.record_keys:
+            self.record_keys.append('windGust')
+        self.buckets = {}  # end of interval -> [datasets, sum, weight, maximum, sum, weight, maximum, ...]
+        self.t_written = 0  # intervals up to this time have been written
+        self.t_first = None  # first and last archive record inserted
+        self.t_last = None
+        self.datasets = 0
+        self.records = 0
+        self.records_existing = 0
+        self.datasets_late = 0
+
+    def check_unit_system(self, config_dict):
+        """
+        Checks that the archive uses the unit system of the CoSESDriver (METRICWX): the records are not converted
+        :param config_dict: ConfigObj - configuration of WeeWx
+        :return: --
+        """
+        unit_system = self.archive.std_unit_system  # None = empty archive
+        if unit_system is None:
+            target_unit = config_dict.get('StdConvert', {}).get('target_unit', 'US')
+            unit_system = weewx.units.unit_constants[target_unit.upper()]
+        if unit_system != weewx.METRICWX:
+            raise weewx.UnitError('The WeeWx archive does not use the unit system METRICWX of the CoSESDriver!')
+
+    def run(self):
+        """
+        Imports the datasets of the selected time range (completed archive intervals only)
+        :param NONE: --
+        :return: --
+        """
+        t_current = self.get_interval_end(time.time()) - self.record_interval  # start of the current interval
+        t_start = to_timestamp(self.options.date_from) if self.options.date_from else 0
+        t_stop = min(to_timestamp(self.options.date_to + datetime.timedelta(days=1)) if self.options.date_to
+                     else t_current, t_current)
+        sql = 'SELECT MIN(id), MAX(id) FROM sensor_datasets WHERE t_unix > ? AND t_unix <= ? AND station = ?'
+        id_first, id_last = self.query_primary(sql, [t_start, t_stop, self.station_id]).next()
+        if id_first is None:
+            print('[Import] No datasets in the selected time range.')
+            return
+        print('[Import] Importing datasets %d to %d (%s - %s) ...' %
+              (id_first, id_last, format_time(t_start), format_time(t_stop)))
+        t_import = time.time()
+        for id_chunk in xrange(id_first, id_last + 1, self.options.chunk_size):
+            t_newest = self.read_chunk(id_chunk, min(id_chunk + self.options.chunk_size - 1, id_last),
+                                       t_start, t_stop)
+            self.write_records(t_newest - self.options.late)
+            print('[Import] %d datasets read, %d archive records inserted.' % (self.datasets, self.records))
+        self.write_records(t_stop)
+        print('[Import] %d archive records inserted (%d existing records kept, %d late datasets skipped) in %.1f s.' %
+              (self.records, self.records_existing, self.datasets_late, time.time() - t_import))
+        if self.records:
+            self.rebuild_day_summaries()
+            if not self.options.date_to:  # the CoSESDriver continues with the datasets saved from now on
+                self.advance_driver_cursor(id_last)
+
+    def read_chunk(self, id_first, id_last, t_start, t_stop):
+        """
+        Aggregates a range of datasets per archive interval (in the database) and adds them to the open intervals
+        :param id_first: int - first ID of the range
+        :param id_last: int - last ID of the range
+        :param t_start: int - only datasets captured after this time
+        :param t_stop: int - only datasets captured up to this time
+        :return: int - end of the newest interval read so far
+        """
+        # end of the interval, intervals include their end like in WeeWx (ceil, integer arithmetic of MySQL and SQLite)
+        t_end = 't_unix - (t_unix - 1) %% %d - 1 + %d' % (self.record_interval, self.record_interval)
+        # a downsampled dataset is the mean of 'samples' samples: weighted sum and weight (number of samples, 1 for
+        # datasets without) of every observation, + 0E0: DOUBLE instead of DECIMAL (MySQL, e.g. SUM of a TINYINT)
+        aggregates = ', '.join('SUM(%s * COALESCE(samples, 1)) + 0E0, SUM(CASE WHEN %s IS NULL THEN 0 ELSE '
+                               'COALESCE(samples, 1) END) + 0E0, MAX(%s)' % ((column,) * 3)
+                               for column, _ in self.observations)
+        sql = 'SELECT %s AS t_end, COUNT(*), %s FROM sensor_datasets WHERE id >= ? AND id <= ? AND t_unix > ? AND ' \
+              't_unix <= ? AND station = ?' % (t_end, aggregates)
+        parameters = [id_first, id_last, t_start, t_stop, self.station_id]
+        t_newest = self.t_written
+        for row in self.query_primary(sql + ' GROUP BY t_end', parameters):
+            t_end, count = int(row[0]), int(row[1])
+            self.datasets += count
+            t_newest = max(t_newest, t_end)
+            if t_end <= self.t_written:  # interval written already (late datasets)
+                self.datasets_late += count
+                continue
+            bucket = self.buckets.get(t_end)
+            if bucket is None:
+                self.buckets[t_end] = list(row[1:])
+                continue
+            bucket[0] += count
+            for i in xrange(1, len(bucket), 3):
+                if row[i + 2]:  # weight
+                    bucket[i] = add_values(bucket[i], row[i + 1])
+                    bucket[i + 1] += row[i + 2]
+                    bucket[i + 2] = row[i + 3] if bucket[i + 2] is None else max(bucket[i + 2], row[i + 3])
+        return t_newest
+
+    def write_records(self, t_until):
+        """
+        Inserts the archive records of the intervals ending up to a time (one transaction)
+        :param t_until: int - end of the newest interval written
+        :return: --
+        """
+        records = []
+        for t_end in sorted(t for t in self.buckets if t <= t_until):
+            records.append(self.make_archive_record(t_end, self.buckets.pop(t_end)))
+        self.t_written = max(self.t_written, t_until)
+        if not records:
+            return
+        table = self.archive.table_name
+        with weedb.Transaction(self.archive.connection) as cursor:
+            if not self.options.replace:  # records written by WeeWx (or a previous import) are kept
+                existing = set(row[0] for row in cursor.execute('SELECT dateTime FROM %s WHERE dateTime >= ? AND '
+                                                                'dateTime <= ?' % table,
+                                                                (records[0][0], records[-1][0])))
+                self.records_existing += len(existing)
+                records = [record for record in records if record[0] not in existing]
+            sql = '%s INTO %s (`%s`) VALUES (%s)' % ('REPLACE' if self.options.replace else 'INSERT', table,
+                                                     '`, `'.join(self.record_keys),
+                                                     ', '.join('?' * len(self.record_keys)))
+            executemany(cursor, sql, records)
+        if records:
+            self.records += len(records)
+            self.t_first = min(self.t_first or records[0][0], records[0][0])
+            self.t_last = max(self.t_last, records[-1][0])
+
+    def make_archive_record(self, t_end, bucket):
+        """
+        Creates an archive record of an interval (like CoSESDriver.make_archive_record)
+        :param t_end: int - end of the interval
+        :param bucket: list - datasets, then weighted sum, weight (samples) and maximum of every observation
+        :return: tuple - values in the order of record_keys (None = no value)
+        """
+        record = [t_end, weewx.METRICWX, self.record_interval / 60]
+        for i in xrange(1, 3 * len(self.observations), 3):
+            record.append(bucket[i] / bucket[i + 1] if bucket[i + 1] else None)
+        if 'windGust' in self.record_keys:  # maximum wind speed
+            record.append(bucket[3 * self.record_keys.index('windSpeed') - 6])
+        return tuple(record)
+
+    def rebuild_day_summaries(self):
+        """
+        Rebuilds the daily summaries of the imported days (one pass over the archive records of these days)
+        :param NONE: --
+        :return: --
+        """
+        print('[Import] Rebuilding the daily summaries ...')
+        self.archive.first_timestamp = self.archive.firstGoodStamp()  # records inserted without the manager
+        self.archive.last_timestamp = self.archive.lastGoodStamp()
+        start_d = datetime.date.fromtimestamp(self.t_first - 1)  # a record at midnight belongs to the previous day
+        stop_d = datetime.date.fromtimestamp(self.t_last - 1)
+        last_update = self.archive._read_metadata('lastUpdate')  # as wee_database
+        if last_update is None or int(last_update) < self.archive.last_timestamp:
+            # summaries behind the archive (e.g. new database): completed from their last update first
+            self.archive.backfill_day_summary()
+            if last_update is None:
+                return
+            stop_d = min(stop_d, datetime.date.fromtimestamp(int(last_update)))
+            if start_d > stop_d:
+                return
+        self.archive.backfill_day_summary(start_d, stop_d)
+
+    def advance_driver_cursor(self, id_last):
+        """
+        Advances the cursor of the CoSESDriver past the imported datasets (the driver would replay them as loop packets
+        otherwise)
+        :param id_last: int - ID of the last dataset imported
+        :return: --
+        """
+        try:
+            with open(self.path_cursor, 'r') as f:
+                cursor = int(json.load(f)['id'])
+        except (IOError, ValueError, KeyError, TypeError):
+            cursor = None
+        if cursor is not None and cursor >= id_last:
+            return
+        path_tmp = self.path_cursor + '.tmp'
+        with open(path_tmp, 'w') as f:
+            json.dump({'id': id_last, 't_saved': int(time.time())}, f)
+        os.rename(path_tmp, self.path_cursor)  # atomic like CoSESDriver.save_cursor
+        print('[Import] Cursor of the CoSESDriver advanced to ID %d.' % id_last)
+
+    def get_interval_end(self, t_unix):
+        """
+        Returns the end of the archive interval a time belongs to (like CoSESDriver.get_interval_end)
+        :param t_unix: float - time
+        :return: int - end of the interval
+        """
+        return -int(-t_unix // self.record_interval) * self.record_interval
+
+    def query_primary(self, sql, parameters):
+        """
+        Runs a query on the primary database
+        :param sql: str - query (placeholder: ?)
+        :param parameters: tuple - values of the placeholders
+        :return: generator - rows
+        """
+        cursor = self.primary.cursor()
+        try:
+            for row in cursor.execute(sql, tuple(parameters)):
+                yield row
+        finally:
+            cursor.close()
+
+    def close(self):
+        """
+        Closes the databases
+        :param NONE: --
+        :return: --
+        """
+        self.primary.close()
+        self.archive.close()
+
+
+def executemany(cursor, sql, rows):
+    """
+    Executes a statement for every row (weedb only wraps execute of the MySQL cursor)
+    :param cursor: weedb cursor
+    :param sql: str - statement (placeholder: ?)
+    :param rows: list - values of the placeholders per row
+    :return: --
+    """
+    if not rows:
+        return
+    if hasattr(cursor, 'executemany'):  # weedb.sqlite: sqlite3 cursor
+        cursor.executemany(sql, rows)
+    else:  # weedb.mysql: MySQLdb cursor
+        cursor.cursor.executemany(sql.replace('?', '%s'), rows)
+
+
+def to_timestamp(date):
+    """
+    :param date: datetime.date - day (local time)
+    :return: int - timestamp of the start of the day
+    """
+    return int(time.mktime(date.timetuple()))
+
+
+def format_time(t_unix):
+    """
+    :param t_unix: int - timestamp
+    :return: str - local time
+    """
+    return time.strftime('%d.%m.%Y|%H:%M:%S', time.localtime(t_unix))
+
+
+def add_values(value, addend):
+    """
+    Adds a value to a sum that may not have been started yet (the type of the values is kept)
+    :param value: float | None - sum so far (None = no value yet)
+    :param addend: float | None - value added (None = no value)
+    :return: float | None
+    """
+    if value is None:
+        return addend
+    return value if addend is None else value + addend
+
+
+def parse_date(value):
+    """
+    :param value: str - date (YYYY-MM-DD)
+    :return: datetime.date
+    """
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date (YYYY-MM-DD): ' + value)
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description='Imports the datasets of the primary database into the WeeWx archive '
+                                                 '(WeeWx must not be running).')
+    parser.add_argument('--config', help='weewx.conf (default: in path_weewx_root of CoSESWeather.ini)')
+    parser.add_argument('--binding', default='wx_binding', help='data binding of the WeeWx archive')
+    parser.add_argument('--primary-db', default=PRIMARY_DB,
+                        help='name of the primary database (on the database server of the WeeWx archive)')
+    parser.add_argument('--station', help='only datasets of this station (default: station_id of the CoSESDriver, '
+                                           'otherwise \'%s\')' % DEFAULT_STATION_ID)
+    parser.add_argument('--from', dest='date_from', type=parse_date, help='first day to import (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='date_to', type=parse_date, help='last day to import (YYYY-MM-DD)')
+    parser.add_argument('--replace', action='store_true', help='replace existing archive records')
+    parser.add_argument('--chunk-size', type=int, default=ImportChunk_size, help='datasets (IDs) read per query')
+    parser.add_argument('--late', type=int, default=t_ImportLate,
+                        help='seconds an interval is kept open for datasets saved later (buffered by the stations)')
+    return parser
+
+
+def main(argv=None):
+    options = create_argument_parser().parse_args(argv)
+    path_config = options.config or os.path.join(get_config(path_ini).get('weewx_paths', 'path_weewx_root'),
+                                                 'weewx.conf')
+    config_dict = configobj.ConfigObj(path_config, file_error=True)
+    importer = ArchiveImporter(config_dict, options)
+    try:
+        importer.run()
+    except Exception:
+        print('[Import] Import failed! ' + traceback.format_exc())
+        return 1
+    finally:
+        importer.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
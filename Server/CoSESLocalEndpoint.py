@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESLocalEndpoint.py implements a small request/response server on a Unix socket. It runs on the event loop of the
+CoSESServer and lets local consumers (e.g. the database API db_manager.php) read data kept in memory by the server
+without querying the MySQL database.
+Protocol: the client sends one request line, the server replies with one line and closes the connection. The reply to
+a long-poll request can be deferred (DeferredReply) until an event occurs or a timeout has elapsed.
+"""
+
+import os
+import os.path
+import errno
+import socket
+import json
+import threading
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+class DeferredReply:
+    """
+    Reply of a long-poll request. Returned by the handler instead of the reply: the connection is kept open until
+    send() is called (from any thread) or the timeout has elapsed
+    """
+    def __init__(self, t_timeout, timeout_reply):
+        """
+        :param t_timeout: float - the timeout reply is sent after this time (seconds)
+        :param timeout_reply: str - reply sent after the timeout
+        """
+        self.t_timeout = t_timeout
+        self.timeout_reply = timeout_reply
+        self.lock = threading.Lock()
+        self.reply = None
+        self.callback = None
+
+    def send(self, reply):
+        """
+        Sends the reply (only the first call has an effect)
+        :param reply: str - reply
+        :return: --
+        """
+        with self.lock:
+            if self.reply is not None:
+                return
+            self.reply = reply
+            callback = self.callback
+        if callback:
+            callback(reply)
+
+    def is_pending(self):
+        """
+        :param NONE: --
+        :return: bool - True if the reply has not been sent yet
+        """
+        return self.reply is None
+
+    def _attach(self, callback):
+        with self.lock:
+            self.callback = callback
+            reply = self.reply
+        if reply is not None:
+            callback(reply)
+
+
+class LocalEndpoint:
+    """
+    Unix socket server driven by an EventLoop (CoSESEventLoop)
+    """
+    def __init__(self, path, handler, max_request_length=256, t_timeout=2.0):
+        """
+        :param path: str - path of the Unix socket
+        :param handler: function - called with the request line (str), returns the reply (str or DeferredReply)
+        :param max_request_length: int - longer requests are rejected
+        :param t_timeout: float - connections are closed if the request is not complete within this time (seconds)
+        """
+        self.path = path
+        self.handler = handler
+        self.max_request_length = max_request_length
+        self.t_timeout = t_timeout
+        self.loop = None
+        self.sock = None
+        self.connections = {}  # fd -> [socket, received data, timeout timer, deferred reply]
+
+    def start(self, loop):
+        """
+        Creates the Unix socket and registers it with the event loop
+        :param loop: EventLoop
+        :return: --
+        """
+        self.loop = loop
+        if os.path.exists(self.path):  # left over from a previous run
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0666)  # local consumers (e.g. the web server user) must be able to connect
+        self.sock.listen(8)
+        self.sock.setblocking(False)
+        loop.add_reader(self.sock, self._on_connecting)
+
+    def _on_connecting(self):
+        try:
+            conn, _ = self.sock.accept()
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        conn.setblocking(False)
+        fd = conn.fileno()
+        self.connections[fd] = [conn, '', self.loop.call_later(self.t_timeout, self._close, fd), None]
+        self.loop.add_reader(conn, lambda: self._on_request(fd))
+
+    def _on_request(self, fd):
+        entry = self.connections.get(fd)
+        if entry is None:
+            return
+        try:
+            data = entry[0].recv(self.max_request_length)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:  # connection closed by the client
+            self._close(fd)
+            return
+        if entry[3] is not None:  # waiting for a deferred reply: further data is ignored
+            return
+        entry[1] += data
+        if '\n' not in entry[1] and len(entry[1]) < self.max_request_length:  # request incomplete
+            return
+        request = entry[1].split('\n')[0].strip()
+        try:
+            reply = self.handler(request)
+        except Exception, e:
+            reply = json.dumps('[ERROR] ' + str(e))
+        if isinstance(reply, DeferredReply):  # long-poll: the connection is kept open
+            entry[2].cancel()
+            entry[2] = self.loop.call_later(reply.t_timeout, reply.send, reply.timeout_reply)
+            entry[3] = reply
+            reply._attach(lambda deferred_reply: self.loop.call_soon_threadsafe(self._send_reply, fd, deferred_reply,
+                                                                                entry))
+            return
+        self._send_reply(fd, reply, entry)
+
+    def _send_reply(self, fd, reply, entry):
+        if self.connections.get(fd) is not entry:  # connection closed in the meantime
+            return
+        try:
+            entry[0].setblocking(True)
+            entry[0].settimeout(self.t_timeout)  # replies are small, a reader that does not read is dropped
+            entry[0].sendall(reply + '\n')
+        except socket.error:
+            pass
+        self._close(fd)
+
+    def _close(self, fd):
+        entry = self.connections.pop(fd, None)
+        if entry is None:
+            return
+        entry[2].cancel()
+        if entry[3] is not None:
+            entry[3].send('')  # no longer pending (the client is gone)
+        self.loop.remove_reader(entry[0])
+        entry[0].close()
+
+    def close(self):
+        """
+        Closes all connections and removes the Unix socket
+        :param NONE: --
+        :return: --
+        """
+        for fd in self.connections.keys():
+            self._close(fd)
+        if self.sock:
+            if self.loop:
+                self.loop.remove_reader(self.sock)
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
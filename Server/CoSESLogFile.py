@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESLogFile.py implements the log file of the CoSESServer. The file is kept open between writes and is rotated as soon
+as it grows too large or too old: the current file is renamed, compressed (gzip) and a new file with a header is started.
+Only a limited number of compressed files is kept.
+"""
+
+import os
+import os.path
+import gzip
+import shutil
+import time
+import datetime
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+LOG_HEADER = ('---------------------------------------------------------------------------',
+              '--------------------- CoSESServer Log -------------------------------------',
+              '---------------------------------------------------------------------------')
+LOG_TIME_FORMAT = '%d.%m.%Y|%H:%M:%S'  # timestamp at the beginning of every log line: [dd.mm.YYYY|HH:MM:SS]
+
+
+class RotatingLogFile:
+    """
+    Log file that is rotated by size and age. Not thread-safe: only used by the LogWriterThread
+    """
+    def __init__(self, max_size=5242880, max_age=2592000, backup_count=10):
+        """
+        :param max_size: int - the file is rotated as soon as it is larger than this (bytes, 0 = no limit)
+        :param max_age: float - the file is rotated as soon as its first entry is older than this (seconds, 0 = no limit)
+        :param backup_count: int - number of rotated (compressed) files that are kept: <path>.1.gz (newest) ...
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        self.backup_count = backup_count
+        self.path = None
+        self.file = None
+        self.size = 0
+        self.t_started = None  # time of the first entry of the current file
+
+    def write(self, path, lines):
+        """
+        Appends lines to the log file (creates the file with a header if it does not exist)
+        :param path: str - path of the log file (may change, e.g. after the CoSESWeather.ini has been modified)
+        :param lines: list - log lines (str, without line break)
+        :return: --
+        """
+        if path != self.path or not os.path.isfile(path):  # new path, or file removed (e.g. by the admin)
+            self._open(path)
+        elif self._is_rotation_due():
+            self.rotate()
+        data = ''.join(line + '\n' for line in lines)
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    def _open(self, path):
+        self.close()
+        self.path = path
+        isNew = not os.path.isfile(path)
+        self.file = open(path, 'a')
+        if isNew:
+            self._write_header()
+        else:
+            self.size = os.path.getsize(path)
+            self.t_started = self._read_start_time()
+
+    def _write_header(self):
+        data = ''.join(line + '\n' for line in LOG_HEADER)
+        self.file.write(data)
+        self.size = len(data)
+        self.t_started = time.time()
+
+    def _read_start_time(self):
+        # Returns the time of the first timestamped entry of the existing file (modification time if there is none)
+        try:
+            with open(self.path, 'r') as f:
+                for _ in range(len(LOG_HEADER) + 1):
+                    line = f.readline()
+                    if line.startswith('['):
+                        return time.mktime(datetime.datetime.strptime(line[1:20], LOG_TIME_FORMAT).timetuple())
+        except (IOError, ValueError):
+            pass
+        return os.path.getmtime(self.path)
+
+    def _is_rotation_due(self):
+        if self.max_size and self.size > self.max_size:
+            return True
+        return bool(self.max_age and self.t_started is not None and time.time() - self.t_started > self.max_age)
+
+    def rotate(self):
+        """
+        Compresses the current file to <path>.1.gz (older files are shifted: .1.gz -> .2.gz ...) and starts a new file
+        :param NONE: --
+        :return: --
+        """
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            older = '%s.%d.gz' % (self.path, i)
+            if os.path.exists(older):
+                os.rename(older, '%s.%d.gz' % (self.path, i + 1))
+        rotated = self.path + '.1'
+        os.rename(self.path, rotated)
+        if self.backup_count > 0:
+            with open(rotated, 'rb') as f_in:
+                f_out = gzip.open(rotated + '.gz', 'wb')
+                try:
+                    shutil.copyfileobj(f_in, f_out)
+                finally:
+                    f_out.close()
+        os.remove(rotated)
+        self.file = open(self.path, 'a')
+        self._write_header()
+
+    def close(self):
+        """
+        Closes the log file
+        :param NONE: --
+        :return: --
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESMetrics.py collects metrics (counters, gauges and latency histograms) of the CoSESServer and the CoSESDriver and
+serves them over a local HTTP endpoint in the Prometheus text format (GET /metrics), so the health of the data
+acquisition can be monitored and alerted on without reading the log files.
+Rates (e.g. samples per second) are derived from the counters by the monitoring system (e.g. rate() in Prometheus).
+"""
+
+import threading
+import BaseHTTPServer
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if value != value:
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(name + '="' + value + '"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Metric:
+    """
+    Metric with optional labels. Every combination of label values has its own value (child)
+    """
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        """
+        :param name: str - name of the metric (e.g. cosesserver_samples_received_total)
+        :param documentation: str - description
+        :param labelnames: tuple - names of the labels (e.g. ('station',))
+        :param callback: function - returns the current value (or a dict: tuple of label values -> value). Used for
+                         values that are maintained elsewhere (e.g. statistics of the write queue), read on every scrape
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.children = {}  # tuple of label values -> child
+        self.lock = threading.Lock()
+        if not self.labelnames and callback is None:
+            self.labels()  # metrics without labels are reported (as 0) from the start
+
+    def labels(self, *values):
+        """
+        Returns the child of a combination of label values (created on first use)
+        :param values: str - label values (in the order of labelnames)
+        :return: child with inc() | set() | observe()
+        """
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError('Metric ' + self.name + ' expects labels ' + str(self.labelnames))
+            with self.lock:
+                child = self.children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _collect(self):
+        # Returns a list of (label values, child or value)
+        if self.callback is None:
+            with self.lock:
+                return sorted(self.children.items())
+        value = self.callback()
+        if isinstance(value, dict):
+            return sorted(value.items())
+        return [((), value)]
+
+    def render(self):
+        """
+        Returns the metric in the Prometheus text format
+        :param NONE: --
+        :return: list - lines
+        """
+        lines = ['# HELP ' + self.name + ' ' + self.documentation.replace('\\', '\\\\').replace('\n', '\\n'),
+                 '# TYPE ' + self.name + ' ' + self.metric_type]
+        for values, child in self._collect():
+            value = child.value if isinstance(child, _Value) else child
+            lines.append(self.name + _format_labels(self.labelnames, values) + ' ' + _format_value(value))
+        return lines
+
+
+class _Value:
+    """
+    Value of a counter or gauge (one combination of label values)
+    """
+    def __init__(self, lock):
+        self.value = 0.0
+        self.lock = lock
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = float(value)
+
+
+class Counter(_Metric):
+    """
+    Value that only increases (e.g. number of received samples)
+    """
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _Value(self.lock)
+
+    def inc(self, amount=1):
+        """
+        Increments the counter (metrics without labels)
+        :param amount: float - increment
+        :return: --
+        """
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down (e.g. depth of the write queue)
+    """
+    metric_type = 'gauge'
+
+    def _new_child(self):
+        return _Value(self.lock)
+
+    def set(self, value):
+        """
+        Sets the gauge (metrics without labels)
+        :param value: float - value
+        :return: --
+        """
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    """
+    Observations of a histogram (one combination of label values)
+    """
+    def __init__(self, lock, buckets):
+        self.lock = lock
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (e.g. latency of requests to the database API)
+    """
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        :param name: str - name of the metric (e.g. cosesserver_php_request_duration_seconds)
+        :param documentation: str - description
+        :param labelnames: tuple - names of the labels
+        :param buckets: tuple - upper bounds of the buckets (ascending, +Inf is added)
+        """
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        _Metric.__init__(self, name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.lock, self.buckets)
+
+    def observe(self, value):
+        """
+        Adds an observation (metrics without labels)
+        :param value: float - observed value
+        :return: --
+        """
+        self.labels().observe(value)
+
+    def render(self):
+        lines = ['# HELP ' + self.name + ' ' + self.documentation.replace('\\', '\\\\').replace('\n', '\\n'),
+                 '# TYPE ' + self.name + ' histogram']
+        labelnames = self.labelnames + ('le',)
+        for values, child in self._collect():
+            with self.lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(self.name + '_bucket' + _format_labels(labelnames, values + (_format_value(bound),)) +
+                             ' ' + str(cumulative))
+            lines.append(self.name + '_sum' + _format_labels(self.labelnames, values) + ' ' + _format_value(total))
+            lines.append(self.name + '_count' + _format_labels(self.labelnames, values) + ' ' + str(count))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of a process
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def _register(self, metric):
+        if [m for m in self.metrics if m.name == metric.name]:
+            raise ValueError('Metric ' + metric.name + ' already registered')
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        """
+        Creates and registers a counter
+        :param name: str - name of the metric (should end with _total)
+        :param documentation: str - description
+        :param labelnames: tuple - names of the labels
+        :param callback: function - returns the current value (see _Metric)
+        :return: Counter
+        """
+        return self._register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        """
+        Creates and registers a gauge
+        :param name: str - name of the metric
+        :param documentation: str - description
+        :param labelnames: tuple - names of the labels
+        :param callback: function - returns the current value (see _Metric)
+        :return: Gauge
+        """
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        Creates and registers a histogram
+        :param name: str - name of the metric
+        :param documentation: str - description
+        :param labelnames: tuple - names of the labels
+        :param buckets: tuple - upper bounds of the buckets
+        :return: Histogram
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text format. A metric whose callback fails is left out
+        :param NONE: --
+        :return: str - exposition
+        """
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                pass
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    timeout = 5  # a client that does not send its request is disconnected
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not logged
+
+
+class MetricsServer:
+    """
+    HTTP endpoint serving the metrics of a registry (runs in a background thread)
+    """
+    def __init__(self, registry, port, host='127.0.0.1'):
+        """
+        :param registry: MetricsRegistry
+        :param port: int - TCP port
+        :param host: str - address to bind to (default: only reachable from the local machine)
+        """
+        self.httpd = BaseHTTPServer.HTTPServer((host, port), _MetricsRequestHandler)
+        self.httpd.registry = registry
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True  # must not keep the process (e.g. weewxd) alive
+        self.thread.start()
+
+    def close(self):
+        """
+        Stops the endpoint and releases the port
+        :param NONE: --
+        :return: --
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
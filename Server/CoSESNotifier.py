@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESNotifier.py sends the email notifications of the CoSESServer and the CoSESDriver. Notifications are queued and
+sent by a background thread, so callers never wait for the database (recipients) or the mail server. Alerts raised
+within a short time are coalesced into one digest, identical alerts are only repeated after a while and the number of
+emails per hour is limited. This state is kept in memory and persisted, so it survives restarts.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import traceback
+import Queue
+from collections import OrderedDict
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+MAIL_SUBJECT = '[CoSESWeather]Warning: Faulty Behaviour detected!'
+REPEAT_NOTE = ' This is a repeating message. The system is still not running properly. ' \
+              'Please look into it as soon as possible.'
+TIME_FORMAT = '%d.%m.%Y|%H:%M:%S'
+t_TRANSPORT_IDLE = 60  # the transport (SMTP connection) is closed if it has not been used for 60 seconds
+SENT_KEEP = 604800  # alerts are remembered for 7 days (a later alert is marked as repeating message)
+
+
+def alert_key(message):
+    """
+    Returns the key of an alert: messages that only differ in numbers (times, counts, line numbers) are identical.
+    Digits within a word (e.g. station1) and the ID following 'station' are kept: alerts of different stations differ
+    :param message: str - message of the alert
+    :return: str - key
+    """
+    return re.sub(r'(?<![Ss]tation )\b\d+', '#', message.strip())[:200]
+
+
+class NotificationDispatcher:
+    """
+    Queue and background thread that send notifications (digests) by email
+    """
+    def __init__(self, get_recipients, transport, path_state, path_contacts=None, log=None, coalesce_window=30,
+                 repeat_interval=86400, rate_max=6, recipients_ttl=3600, queue_size=1000):
+        """
+        :param get_recipients: function - returns the email addresses of the admins (list) or None on failure
+        :param transport: email transport with send(recipients, subject, content) and close(), see CoSESSystem
+        :param path_state: str - file the dedup and rate limit state is persisted in
+        :param path_contacts: str - file with email addresses (one per line), used if the recipients are not available
+        :param log: function - called with log messages (str)
+        :param coalesce_window: float - alerts raised within this time (seconds) are sent as one digest
+        :param repeat_interval: float - an identical alert is sent again at the earliest after this time (seconds)
+        :param rate_max: int - maximum number of emails per hour
+        :param recipients_ttl: float - the recipients are fetched again after this time (seconds)
+        :param queue_size: int - maximum number of queued alerts (further alerts are dropped)
+        """
+        self.get_recipients = get_recipients
+        self.transport = transport
+        self.path_state = path_state
+        self.path_contacts = path_contacts
+        self.log = log or (lambda message: None)
+        self.coalesce_window = coalesce_window
+        self.repeat_interval = repeat_interval
+        self.rate_max = rate_max
+        self.recipients_ttl = recipients_ttl
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.pending = OrderedDict()  # key -> [message, count, t_first, t_last] (alerts of the next digest)
+        self.recipients = None
+        self.t_recipients = 0
+        self.t_transport_used = None  # None = transport not used since it has been closed
+        self.t_hold = 0  # no digest is sent before this time (rate limit reached or sending failed)
+        self.state = {'sent': {}, 'suppressed': {}, 'emails': []}  # key -> time | key -> [message, count] | times
+        self._load_state()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True  # must not keep the process (e.g. weewxd) alive
+        self.thread.start()
+
+    def notify(self, message):
+        """
+        Queues an alert (never blocks)
+        :param message: str - message of the alert
+        :return: bool - True if the alert has been queued
+        """
+        try:
+            self.queue.put_nowait((message, time.time()))
+            return True
+        except Queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout=30):
+        """
+        Sends all queued alerts now (without waiting for the coalescing window), e.g. before a system reboot
+        :param timeout: float - maximum time to wait in seconds
+        :return: bool - True if the alerts have been handled
+        """
+        event = threading.Event()
+        try:
+            self.queue.put(event, True, timeout)
+        except Queue.Full:
+            return False
+        event.wait(timeout)
+        return event.is_set()
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self.pending:
+                timeout = max(0.1, self._get_t_due() - time.time())
+            elif self.t_transport_used is not None:
+                timeout = t_TRANSPORT_IDLE
+            try:
+                entry = self.queue.get(True, timeout)
+            except Queue.Empty:
+                entry = None
+            events = []
+            while entry is not None:  # take everything that is waiting
+                if isinstance(entry, tuple):
+                    self._add(*entry)
+                else:  # flush() event
+                    events.append(entry)
+                try:
+                    entry = self.queue.get_nowait()
+                except Queue.Empty:
+                    entry = None
+            try:
+                if self.pending and (events or time.time() >= self._get_t_due()):
+                    self._dispatch(isForced=bool(events))
+                if self.t_transport_used is not None and time.time() - self.t_transport_used > t_TRANSPORT_IDLE:
+                    self.transport.close()
+                    self.t_transport_used = None
+            except Exception:
+                self.log('[- Warning -] Notification could not be sent! ' + str(traceback.format_exc()))
+            for event in events:
+                event.set()
+
+    def _get_t_due(self):
+        # Time the pending alerts have to be sent (end of the coalescing window of the oldest alert)
+        return max(min(alert[2] for alert in self.pending.values()) + self.coalesce_window, self.t_hold)
+
+    def _add(self, message, t):
+        key = alert_key(message)
+        alert = self.pending.get(key)
+        if alert is None:
+            if len(self.pending) >= 50:  # digest is long enough: further alerts are only counted
+                self.dropped += 1
+                return
+            self.pending[key] = [message, 1, t, t]
+        else:
+            alert[1] += 1
+            alert[3] = t
+
+    def _dispatch(self, isForced=False):
+        # Sends the pending alerts as one digest (respecting the repeat interval and the rate limit)
+        t_now = time.time()
+        sent = self.state['sent']
+        suppressed = self.state['suppressed']
+        for key, alert in self.pending.items():
+            if t_now - sent.get(key, 0) < self.repeat_interval:  # already sent recently: only count
+                entry = suppressed.setdefault(key, [alert[0], 0])
+                entry[1] += alert[1]
+                del self.pending[key]
+        emails = [t for t in self.state['emails'] if t_now - t < 3600]
+        self.state['emails'] = emails
+        if not self.pending:
+            self._save_state()
+            return
+        if len(emails) >= self.rate_max and not isForced:  # rate limit reached: keep the alerts for the next digest
+            self.t_hold = emails[0] + 3600
+            return
+        lines = []
+        for key, alert in self.pending.items():
+            line = '[' + time.strftime(TIME_FORMAT, time.localtime(alert[2])) + ']' + alert[0]
+            if alert[1] > 1:
+                line += ' (' + str(alert[1]) + 'x, last: ' + time.strftime(TIME_FORMAT, time.localtime(alert[3])) + ')'
+            if key in sent or key in suppressed:
+                line += REPEAT_NOTE
+                if key in suppressed:
+                    line += ' (' + str(suppressed[key][1]) + 'x since the last notification)'
+            lines.append(line)
+        if self.dropped:
+            lines.append(str(self.dropped) + ' further alerts have been dropped.')
+        if not self._send(MAIL_SUBJECT, '\n\n'.join(lines)):
+            self.t_hold = t_now + 300  # keep the alerts and try again in 5 minutes
+            return
+        self.dropped = 0
+        for key in self.pending:
+            sent[key] = t_now
+            suppressed.pop(key, None)
+        for key in [key for key, t in sent.items() if t_now - t > SENT_KEEP]:
+            del sent[key]
+            suppressed.pop(key, None)
+        emails.append(t_now)
+        self.pending.clear()
+        self._save_state()
+
+    def _get_recipients(self):
+        if self.recipients is None or time.time() - self.t_recipients > self.recipients_ttl:
+            try:
+                recipients = self.get_recipients()
+            except Exception:
+                recipients = None
+            if recipients:
+                self.recipients = [str(mail).strip() for mail in recipients if str(mail).strip()]
+                self.t_recipients = time.time()
+        if self.recipients:
+            return self.recipients
+        try:  # database did not reply - get emails out of notification file directly
+            with open(self.path_contacts, 'r') as f:
+                return [line.strip() for line in f if line.strip()]
+        except Exception:
+            return []
+
+    def _send(self, subject, content):
+        recipients = self._get_recipients()
+        if not recipients:
+            self.log('[- Warning -] Notification could not be sent: no recipients available.')
+            return False
+        self.t_transport_used = time.time()
+        if self.transport.send(recipients, subject, content):
+            self.log('[Notifier] Notification sent to system administrators.')
+            return True
+        self.log('[- Warning -] Notification could not be sent (no email transport available).')
+        return False
+
+    def _load_state(self):
+        try:
+            with open(self.path_state, 'r') as f:
+                state = json.load(f)
+            self.state['sent'].update(state.get('sent', {}))
+            self.state['suppressed'].update(state.get('suppressed', {}))
+            self.state['emails'] = list(state.get('emails', []))
+        except (IOError, ValueError, AttributeError):
+            pass
+
+    def _save_state(self):
+        try:
+            path_tmp = self.path_state + '.tmp'
+            with open(path_tmp, 'w') as f:
+                json.dump(self.state, f)
+            os.rename(path_tmp, self.path_state)  # atomic: the file is never half-written
+        except (IOError, OSError):
+            self.log('[- Warning -] Notification state could not be saved! ' + str(traceback.format_exc()))
@@ -11,14 +11,32 @@ import sys
 import os
 import os.path
 import errno
-import subprocess
 import socket
 import time
 import datetime
 import threading
 import traceback
+import Queue
+import itertools
+import random
+from collections import deque
+import json
 import requests
-import ConfigParser
+import signal
+import argparse
+from CoSESConfig import get_config
+from CoSESNotifier import NotificationDispatcher
+from CoSESSystem import create_system_services, PidFile
+from CoSESLogFile import RotatingLogFile, LOG_TIME_FORMAT
+from CoSESMetrics import MetricsRegistry, MetricsServer
+from CoSESSpool import SampleSpool
+from CoSESAggregator import SampleAggregator, RawCaptureWriter, RollingAggregates
+from CoSESCapture import PacketCaptureWriter, read_capture, list_capture_files
+from CoSESEventLoop import EventLoop
+from CoSESLocalEndpoint import LocalEndpoint, DeferredReply
+from CoSESFraming import LineFramer, BinaryFramer, classify_frame, split_sequenced_package, FRAME_SENSOR, \
+    FRAME_BINARY, FRAME_HEARTBEAT, FRAME_HELLO, FRAME_PROTOCOL, BINARY_PROTOCOL, SequenceHeader_separator, \
+    BinarySensorFrame
 
 
 __author__ = "Miroslav Lach"
@@ -37,17 +55,92 @@ path_contacts = r'/opt/CoSESWeather/user_notification.txt'
 host = ''
 port = 7785
 
+# Define station parameters
+MaxClients = 16  # Maximum number of clients (CONTROLLINOs / weather stations) connected at the same time
+DEFAULT_STATION_ID = 'main'  # Station ID of clients that do not announce their own ID
+StationID_valid_chars = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-'
+StationID_max_length = 16
+SensorSampleRate = 5  # Sample interval of the clients in seconds (SENSOR_SAMPLE_RATE_MSEC of the CONTROLLINO)
+SensorFrame_fields = 6  # Number of '|'-separated fields of a sensor data package
+# Keys of the sensor values in the order of the CONTROLLINO (index = bit in the status field of binary frames)
+SensorValue_keys = ('wind', 'temp', 'spn1_radTot', 'spn1_radDiff', 'spn1_sun', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3')
+BinaryProtocol_enabled = True  # Accept requests of clients to send sensor data as binary frames
+ClientClockDrift_max = 0.01  # Max. drift of the client clock (1 %) when converting client timestamps to capture times
+SequenceWindow_size = 256  # Number of samples per station whose sequence number is remembered (duplicates are dropped)
+
 # Define Controllino commands
 CMD_HeartBeat_char = '#'
 CMD_RESET_CONTROLLINO = 'a'
+CMD_BINARY_PROTOCOL_ACK = 'B'  # confirms the request of the client to switch to binary frames
 # CMD_RESTART_SYSTEM = 'b'  # currently not used
 
 # Define HeartBeat and Timeout parameters
-HeartBeatControllinoReply_char = '*'
 t_HeartBeatRate = 7  # Send a HeartBeat e.g. 7 = one HeartBeat every 7 seconds
 HeartBeats_missed_TIMEOUT = 2  # System recovery measures will be taken if more than 2 HeartBeats have been ignored
 t_clientTimeout = 120  # Timeout for incoming connections in seconds (waiting for client to connect to the server)
 
+# Define admin command parameters
+t_AdminCommandPoll = 300  # Commands are executed as soon as the database API wakes the server up (local endpoint),
+# the database is additionally checked every 5 minutes (e.g. commands submitted while the server was not running)
+
+# Define write queue parameters (buffer between the socket thread and the primary database)
+WriteQueue_size = 720  # Maximum number of datasets held in memory (720 datasets = 1 hour of sensor data)
+WriteQueue_overflow_policy = 'drop_oldest'  # Action if queue is full: 'drop_oldest' | 'drop_newest' | 'block'
+WriteQueue_block_timeout = 1  # Max. time in seconds the socket thread waits for a free slot (only policy 'block')
+t_WriteQueueStats = 3600  # Write queue statistics will be logged once every hour
+WriteBatch_max_count = 12  # Datasets are saved in batches: flush as soon as 12 datasets (1 minute of data) are waiting
+WriteBatch_max_age = 60  # ... or as soon as the oldest dataset of the batch has been waiting for 60 seconds
+WriteBatch_max_age_waiting = 5  # ... or after 5 seconds while a consumer (CoSESDriver) waits for new datasets
+t_DatabaseRequestTimeout = 10  # Timeout for requests to the database API in seconds (slower requests count as failed)
+SpoolReplay_batch = 500  # Number of spooled datasets that are saved into the primary database per request (replay)
+t_SpoolRetry = 30  # After a failed request, wait 30 seconds before trying to replay spooled datasets again
+
+# Define downsampling parameters (clients may sample faster than datasets are saved into the primary database)
+Aggregation_interval = 5  # Samples are saved as one dataset (mean, min, max, std) per 5 seconds (0 = every sample)
+RawWindow_size = 3600  # Number of raw samples kept in memory per station (1 hour at 1 Hz)
+RawCapture_enabled = False  # Additionally write every raw sample into CSV files (path_raw_capture, e.g. for studies)
+
+# Define packet capture and replay parameters (see CoSESCapture and --replay)
+PacketCapture_enabled = False  # Record every received frame with its arrival time (path_packet_capture)
+t_PacketCaptureFlush = 5  # Captured frames are compressed and written once every 5 seconds
+PacketCapture_rotate_size = 10485760  # A new capture file is started as soon as the current one is larger than 10 MB ...
+PacketCapture_rotate_age = 86400  # ... or older than one day
+PacketCapture_backup_count = 30  # Number of capture files that are kept
+Replay_queue_max = 0.8  # Replay waits while the write queue is filled to more than 80 % (no datasets are dropped)
+t_ReplayDatabaseTimeout = 600  # Replay gives up if no spooled dataset has been saved within 10 minutes (database down)
+
+# Define rolling aggregate parameters (1 min / 5 min / 1 h windows and daily summaries, updated with every sample)
+RollingAggregates_gap_max = 300  # Irradiation energy is not integrated over gaps longer than 5 minutes (no data)
+SummaryQueue_size = 5000  # Maximum number of summaries waiting to be saved into the primary database
+SummaryBatch_max_count = 500  # Number of summaries that are saved into the primary database per request
+
+# Define local endpoint parameters (Unix socket serving the latest samples kept in memory, see path_local_socket)
+LocalEndpoint_history_max = 720  # Maximum number of samples returned by one 'history' request
+t_LocalEndpointWaitMax = 300  # Maximum time a 'wait' request (long-poll) is kept open in seconds
+LocalFeed_size = 720  # Number of saved datasets kept for the local feed of the CoSESDriver ('feed' requests)
+
+# Define log parameters (log entries are written by the LogWriterThread, see log_event)
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_ERROR = 40
+Log_level = LOG_INFO  # Entries below this level are not logged
+LogQueue_size = 10000  # Maximum number of entries waiting to be written (further entries are dropped and counted)
+t_LogFlush = 5  # Entries logged with push=False are written at the latest after 5 seconds (or with the next push)
+Log_rotate_size = 5242880  # The log file is compressed and a new file is started as soon as it is larger than 5 MB ...
+Log_rotate_age = 2592000  # ... or older than 30 days
+Log_backup_count = 10  # Number of compressed log files that are kept (CoSESServer_log.txt.1.gz ... .10.gz)
+
+# Define notification parameters (emails to the admins are sent by the NotificationDispatcher, see CoSESNotifier)
+Notification_coalesce_window = 30  # Alerts raised within 30 seconds are sent as one email (digest)
+Notification_repeat_interval = 86400  # An identical alert is sent again at the earliest after one day
+Notification_rate_max = 6  # Maximum number of emails per hour
+Notification_recipients_ttl = 3600  # The email addresses of the admins are fetched from the database once every hour
+
+# Define metrics parameters (local HTTP endpoint in the Prometheus text format, see CoSESMetrics)
+Metrics_port = 9785  # Default port of the metrics endpoint (server_port in the [metrics] section of the .ini, 0 = off)
+HeartBeatRTT_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, t_HeartBeatRate)  # seconds
+
 # General
 version = 'v1.0'
 RevPiServerLaunched = False
@@ -82,26 +175,36 @@ def UpdateNotificationFileThread(inst):
 
 def AdminCommandCheckerThread(inst):
     """
-    Checks for admin commands to be executed (submitted by CoSESWeather-App admin users)
+    Executes admin commands (submitted by CoSESWeather-App admin users). The database API wakes this thread up over the
+    local endpoint as soon as a command has been submitted, the database is only polled as a fallback
     :param inst: Instance object
     :return: --
     """
     while True:
-        if not inst.isServerRestarting:
+        inst.admin_command_event.wait(t_AdminCommandPoll)  # wait for a wake-up (or poll once in a while)
+        inst.admin_command_event.clear()
+        while not inst.isServerRestarting:  # execute all waiting commands (oldest first)
             data_php = {"p_mode": 14}
-            php_response = requests.post(inst.php_path, data=data_php)  # Requesting admin commands
+            php_response = None
             try:
+                php_response = inst.post_db_api(data_php)  # Requesting admin commands
                 php_response = php_response.json()
             except Exception:
-                php_response = php_response.text
+                php_response = getattr(php_response, 'text', str(traceback.format_exc()))
 
             try:  # ok?
                 if '__SUCCESS;' in php_response[0]:  # php response ok
                     del php_response[0]
+                    # acknowledge first: a command is executed at most once (also if it reboots the system)
+                    if not inst.acknowledge_admin_command(php_response[0]['id']):
+                        break
                     msg = '[CoSESServer] Executing admin command: '
                     if 'Microcontroller reset' in php_response[0]['cmd']:  # reset Controllino
-                        msg += 'Microcontroller reset ...'
-                        inst.send_command(CMD_RESET_CONTROLLINO)
+                        station_id = None  # reset all Controllinos if no station is specified ('Microcontroller reset: <station>')
+                        if ':' in php_response[0]['cmd']:
+                            station_id = php_response[0]['cmd'].split(':', 1)[1].strip()
+                        msg += 'Microcontroller reset (' + (station_id or 'all stations') + ') ...'
+                        inst.send_command(CMD_RESET_CONTROLLINO, station_id)
                     elif 'System restart' in php_response[0]['cmd']:  # restart system
                         msg += 'System restart ...'
                         inst.send_command(CMD_RESET_CONTROLLINO)  # reset Controllino
@@ -116,6 +219,7 @@ def AdminCommandCheckerThread(inst):
                         inst.log_event(message)
                         inst.send_notification(message)
                         inst.generate_status_file('Email notification sent by server script')
+                    break
             except Exception:  # unexpected crash
                 crash_msg = "[- Warning -] Unexpected crash occurred in CoSESServer! Reply: " + \
                             str(traceback.format_exc() + str(php_response) + 'Database API db_manager.php accessible '
@@ -123,216 +227,522 @@ def AdminCommandCheckerThread(inst):
                 inst.log_event(crash_msg)
                 inst.send_notification(crash_msg)
                 inst.generate_status_file('Email notification sent by server script')
-        time.sleep(10)  # runs every 10 seconds
+                break
+
+
+def DatabaseWriterThread(inst):
+    """
+    Saves the queued sensor datasets into the primary database (in batches). Runs separately from the
+    RevPiServerThread so a slow or stalled database never delays the socket and HeartBeat handling
+    :param inst: Instance object
+    :return: --
+    """
+    t_last_stats = time.time()
+    batch = []
+    t_batch_start = time.time()
+    while True:
+        isReplayPending = inst.is_spool_replay_pending()
+        if isReplayPending:  # do not wait for new datasets while spooled datasets can be replayed
+            t_wait = 0.01
+        elif batch:  # wait at most until the current batch has to be flushed
+            t_wait = max(0.1, inst.get_write_batch_max_age() - (time.time() - t_batch_start))
+        else:
+            t_wait = 5
+        try:
+            dataset = inst.write_queue.get(True, t_wait)  # wait for new datasets
+        except Queue.Empty:
+            dataset = None
+        if dataset is not None:
+            if not batch:
+                t_batch_start = time.time()
+            batch.append(dataset)
+        if batch and (len(batch) >= inst.write_batch_max or
+                      (time.time() - t_batch_start) >= inst.get_write_batch_max_age() or
+                      (inst.isReplay and inst.write_queue.empty())):  # replay: do not wait for further datasets
+            inst.persist_sensor_datasets(batch)  # flush batch (one request and one multi-row insert for all datasets)
+            for _ in batch:
+                inst.write_queue.task_done()  # see replay_capture (waits until all datasets are saved or spooled)
+            batch = []
+        if isReplayPending:
+            inst.replay_spool()  # replay the oldest spooled datasets
+        elif (time.time() - inst.t_spool_last_failure) > t_SpoolRetry:
+            inst.save_summaries()  # save the summaries of completed periods (rolling aggregates)
+        if(time.time() - t_last_stats) > t_WriteQueueStats:  # It's time to log the write queue statistics
+            stats = inst.get_write_queue_stats()
+            inst.log_event('[CoSESServer] Write queue: depth=' + str(stats['depth']) + ' max_depth=' +
+                           str(stats['max_depth']) + ' enqueued=' + str(stats['enqueued']) + ' written=' +
+                           str(stats['written']) + ' failed=' + str(stats['failed']) + ' dropped=' +
+                           str(stats['dropped']) + ' spooled=' + str(stats['spooled']) + ' replayed=' +
+                           str(stats['replayed']) + ' spool_pending=' + str(stats['spool_pending']))
+            stats = inst.get_frame_stats()
+            inst.log_event('[CoSESServer] Frames: received=' + str(stats['received']) + ' dropped=' +
+                           str(stats['dropped']) + ' duplicates=' + str(stats['duplicates']) + ' bursts=' +
+                           str(stats['bursts']) + ' lost=' + str(stats['lost']) + ' late=' + str(stats['late']))
+            t_last_stats = time.time()
+
+
+def LogWriterThread(inst):
+    """
+    Writes the log entries queued by log_event into the log file (in batches) and prints them to the server terminal.
+    Runs separately so no other thread (especially the RevPiServerThread) ever waits for the disk
+    :param inst: Instance object
+    :return: --
+    """
+    log_file = RotatingLogFile(Log_rotate_size, Log_rotate_age, Log_backup_count)
+    pending = []
+    t_pending = None
+    while True:
+        try:
+            entry = inst.log_queue.get(True, t_LogFlush if pending else None)
+        except Queue.Empty:
+            entry = None
+        entries = [entry] if entry is not None else []
+        while True:  # take everything that is waiting (one write for all entries)
+            try:
+                entries.append(inst.log_queue.get_nowait())
+            except Queue.Empty:
+                break
+        isFlushDue = False
+        events = []
+        for entry in entries:
+            if not isinstance(entry, tuple):  # event of flush_log(): set as soon as everything queued before is written
+                events.append(entry)
+                isFlushDue = True
+                continue
+            line, push = entry
+            if not pending:
+                t_pending = time.time()
+            pending.append(line)
+            isFlushDue = isFlushDue or push
+        if pending and (isFlushDue or (time.time() - t_pending) >= t_LogFlush):
+            dropped = inst.get_dropped_log_entries()
+            if dropped:
+                pending.append('[' + time.strftime(LOG_TIME_FORMAT, time.localtime()) + '][- Warning -] ' +
+                               str(dropped) + ' log entries have been dropped (log queue full).')
+            for line in pending:
+                print(line)
+            try:
+                log_path = get_config(path_ini).get('config', 'path_log', inst.log_path)
+                if inst.isReplay:  # never write into the log of the running server
+                    log_path = get_replay_path(log_path)
+                log_file.write(log_path, pending)
+            except Exception:
+                print('[- Warning -] Log file could not be written! ' + str(traceback.format_exc()))
+                log_file.close()
+            pending = []
+        for event in events:
+            event.set()
 
 
 def RevPiServerThread(inst):
     """
-    Main Server Thread. Binds socket and waits for incoming TCP packets
+    Main Server Thread. Runs the event loop that waits for incoming connections and TCP packets of all clients and
+    schedules HeartBeats, client timeout and watchdog resets (no busy polling of the sockets)
     :param inst: Instance object
     :return: --
     """
-    while inst.threadRunning:
+    loop = EventLoop()
+    timeout_handle = []  # Timer of the client timeout (active while no client is connected)
+    local_endpoint = LocalEndpoint(inst.local_socket_path, inst.handle_local_request)
+
+    def _on_client_timeout():
+        # No client connected within 120 seconds
+        if inst.clients or inst.isServerRestarting:  # Client connected or restart has already been triggered
+            return
+        if inst.alreadyTimedOutClientConnect:  # Already experienced timeout before, now try system reboot
+            message = '[- Warning -] Timeout recurs. No client connected within ' + \
+                      str(t_clientTimeout) + ' seconds. Trying to reboot system. ' \
+                                             'Please make sure the reboot solved the issue.'
+            inst.log_event(message)
+            inst.send_notification(message)
+            inst.close_connection()  # stop the connection in a clean way
+            inst.restart_system()  # reboot RevPi
+        else:  # First time exception, try to just re-launch the connection
+            message = '[- Warning -] Timeout. No client connected within ' + \
+                      str(t_clientTimeout) + ' seconds. Trying to revive connection ...'
+            inst.log_event(message)
+            inst.close_connection()  # stop the connection in a clean way
+            inst.revive_connection()
+        inst.alreadyTimedOutClientConnect = True
+        loop.stop()
+
+    def _start_client_timeout():
+        timeout_handle[:] = [loop.call_later(t_clientTimeout, _on_client_timeout)]
+
+    def _on_client_connecting():
+        # Incoming connection on the listening socket
         try:
-            if not inst.isConnected:  # In case no client is connected yet
-                if(time.time() - inst.t_Timout_listening_client) > t_clientTimeout:  # If no client connected within 120 seconds
-                    if not inst.isServerRestarting:  # If restart has not been triggered already
-                        if inst.alreadyTimedOutClientConnect:  # Already experienced timeout before, now try system reboot
-                            message = '[- Warning -] Timeout recurs. No client connected within ' + \
-                                      str(t_clientTimeout) + ' seconds. Trying to reboot system. ' \
-                                                             'Please make sure the reboot solved the issue.'
-                            inst.log_event(message)
-                            inst.send_notification(message)
-                            inst.close_connection()  # stop the connection in a clean way
-                            inst.restart_system()  # reboot RevPi
-                        else:  # First time exception, try to just re-launch the connection
-                            message = '[- Warning -] Timeout. No client connected within ' + \
-                                      str(t_clientTimeout) + ' seconds. Trying to revive connection ...'
-                            inst.log_event(message)
-                            inst.close_connection()  # stop the connection in a clean way
-                            inst.revive_connection()
-                        inst.alreadyTimedOutClientConnect = True
-                        break
-                else:  # No Timeout occurred yet
-                    try:
-                        inst.conn, addr = inst.s.accept()
-                        inst.conn.setblocking(False)  # Set as non-blocking socket
-                        message = '[CoSESServer] Client connected to server: ' + str(addr)
-                        inst.isServerRestarting = False
-                        inst.log_event(message)
-                        # inst.delete_status_file()
-                        time.sleep(2)  # Give the client some time to fully initialize the connection
-                        inst.isConnected = True
-                        inst.t_lastHeartBeat = time.time()
-                        inst.isConnectionClosing = False
-                    except Exception, e:
-                        if e.args[0] == errno.EAGAIN:  # Exception is caused by non-blocking socket (no user connecting)
-                            pass
-                        else:  # Other exception, try to re-establish connection to Controllino after clean shutdown
-                            message = '[Traceback_4] ' + str(traceback.format_exc())
-                            inst.log_event(message, False)
-                            if inst.alreadyExperiencedException_04:  # Already experienced this exception, now try system reboot
-                                inst.log_event('[CoSESServer] Failed. Trying to reboot system ...')
-                                inst.send_notification('[- Warning -] Exception re-occurred. Trying to reboot system. '
-                                                       'Please make sure the reboot solved the issue.')
-                                inst.close_connection()  # stop the connection in a clean way
-                                inst.restart_system()  # reboot RevPi
-                            else:  # First time exception, try to just re-launch the connection
-                                inst.log_event('[CoSESServer] Failed. Trying to revive connection ...')
-                                inst.close_connection()  # stop the connection in a clean way
-                                inst.revive_connection()
-                            inst.alreadyExperiencedException_04 = True
-                            break
-            else:  # Client is currently connected
-                try:
-                    # Receiving Data from Client
-                    data = inst.conn.recv(1024)
-                    if data:  # If data in input buffer
-                        process_arriving_packet = True
-                        data_tmp = data.split('\n')
-                        for item in data_tmp:
-                            # Collecting Sensor Data received over TCP Socket
-                            if item and "|" in item:  # Sensor Data received
-                                if process_arriving_packet:  # Accept only one sensor data packet per cycle (as multiple packets are caused by a timeout and contain duplicate timestamps)
-                                    inst.parse_sensor_data(item)
-                                    process_arriving_packet = False
-                            elif item and HeartBeatControllinoReply_char in item:  # HeartBeat response detected
-                                inst.HeartBeatValid = True
-                except Exception, e:
-                    if e.args[0] == errno.EWOULDBLOCK:  # Exception is caused by non-blocking socket (currently no data recv)
-                        pass
-                    else:  # Other exception, try to re-establish connection to Controllino after clean shutdown
-                        message = '[Traceback_3] ' + str(traceback.format_exc())
-                        inst.log_event(message, False)
-                        if inst.alreadyExperiencedException_03:  # Already experienced this exception, now try system reboot
-                            inst.log_event('[CoSESServer] Failed. Trying to reboot system ...')
-                            inst.send_notification('[- Warning -] Exception re-occurred. Trying to reboot system. '
-                                                   'Please make sure the reboot solved the issue.')
-                            inst.send_command(CMD_RESET_CONTROLLINO)  # Try to send reset command to Cotrollino
-                            time.sleep(2)
-                            inst.close_connection()  # stop the connection in a clean way
-                            inst.restart_system()  # reboot RevPi
-                        else:  # First time exception, try to just re-launch the connection
-                            inst.log_event('[CoSESServer] Failed. Trying to revive connection ...')
-                            inst.close_connection()  # stop the connection in a clean way
-                            inst.revive_connection()
-                        inst.alreadyExperiencedException_03 = True
-                        break
-                if(time.time() - inst.t_lastHeartBeat) > t_HeartBeatRate:  # It's time to send a new HeartBeat
-                    if inst.HeartBeatValid:  # Last HeartBeat has been acknowledged
-                        inst.conn.send(CMD_HeartBeat_char)  # Send new HeartBeat signal to Cotrollino
-                        inst.HeartBeatValid = False
-                        inst.t_lastHeartBeat = time.time()
-                        inst.alreadyRevivedConnection = False
-                        inst.alreadyTimedOutClientConnect = False
-                        inst.alreadyExperiencedException_01 = False
-                        inst.alreadyExperiencedException_02 = False
-                        inst.alreadyExperiencedException_03 = False
-                        inst.alreadyExperiencedException_04 = False
-                    else:  # No reply for last HeartBeat!
-                        if inst.missedHeartBeats > HeartBeats_missed_TIMEOUT:  # Something is wrong, multiple HeartBeats not received!
-                            if inst.alreadyRevivedConnection:  # If previously a connection revive has been tried but failed, now try to restart the whole system
-                                message = '[- Warning -] Multiple HeartBeats left unanswered! Previous measures failed. ' \
-                                          'Trying to reboot whole system. Please make sure the reboot solved the issue.'
-                                inst.log_event(message)
-                                inst.send_notification(message)
-                                inst.send_command(CMD_RESET_CONTROLLINO)  # Try to send reset command to Cotrollino
-                                time.sleep(2)
-                                inst.close_connection()  # stop the connection in a clean way
-                                inst.restart_system()  # reboot RevPi
-                            else:  # This is the first time that multiple heartbeats have been missed, first try just a simple connection re-launch
-                                inst.log_event('[- Warning -] Multiple HeartBeats left unanswered! '
-                                               'Initiating reconnect ...')
-                                inst.send_command(CMD_RESET_CONTROLLINO)  # Try to send reset command to Cotrollino
-                                time.sleep(2)
-                                inst.close_connection()  # stop the connection in a clean way
-                                inst.revive_connection()
-                            inst.alreadyRevivedConnection = True
-                            break
-                        else:  # HeartBeat missed!
-                            if(t_HeartBeatRate * 5) < (time.time() - inst.t_temp):  # Reset counter if no HeartBeats missed for a while
-                                inst.missedHeartBeats = 0
-                            inst.missedHeartBeats += 1
-                            inst.HeartBeatValid = True
-                            inst.log_event('[- Warning -] HeartBeat not received in time by client. (Skipping a Beat)')
-                            inst.t_temp = time.time()
-        except Exception:
-            message = '[Traceback_2] ' + str(traceback.format_exc())
+            conn, addr = inst.s.accept()
+        except Exception, e:
+            if e.args[0] == errno.EAGAIN:  # Exception is caused by non-blocking socket (no user connecting anymore)
+                return
+            # Other exception, try to re-establish connection to Controllino after clean shutdown
+            message = '[Traceback_4] ' + str(traceback.format_exc())
             inst.log_event(message, False)
-            if inst.alreadyExperiencedException_02:  # Already experienced this exception, now try system reboot
+            if inst.alreadyExperiencedException_04:  # Already experienced this exception, now try system reboot
                 inst.log_event('[CoSESServer] Failed. Trying to reboot system ...')
                 inst.send_notification('[- Warning -] Exception re-occurred. Trying to reboot system. '
                                        'Please make sure the reboot solved the issue.')
-                inst.send_command(CMD_RESET_CONTROLLINO)  # Try to send reset command to Cotrollino
-                time.sleep(2)
                 inst.close_connection()  # stop the connection in a clean way
                 inst.restart_system()  # reboot RevPi
             else:  # First time exception, try to just re-launch the connection
                 inst.log_event('[CoSESServer] Failed. Trying to revive connection ...')
                 inst.close_connection()  # stop the connection in a clean way
                 inst.revive_connection()
-            inst.alreadyExperiencedException_02 = True
-            break
-        if(time.time() - inst.t_Watchdog) > 45:  # Hardware watchdog will be reset every 45 seconds
-            inst.reset_watchdog_timer()  # reset watchdog timer
-            inst.t_Watchdog = time.time()
-        time.sleep(0.05)  # slow down loop to decrease CPU usage!
+            inst.alreadyExperiencedException_04 = True
+            loop.stop()
+            return
+        if len(inst.clients) >= MaxClients:  # Refuse further clients
+            inst.log_event('[- Warning -] Maximum number of clients (' + str(MaxClients) +
+                           ') reached! Refused connection: ' + str(addr))
+            conn.close()
+            return
+        conn.setblocking(False)  # Set as non-blocking socket
+        client = ClientConnection(conn, addr)
+        inst.isServerRestarting = False
+        inst.log_event('[CoSESServer] Client connected to server: ' + str(addr))
+        inst.metric_connections.inc()
+        inst.add_client(client)
+        for timer in timeout_handle:
+            timer.cancel()
+        loop.add_reader(conn, lambda: _on_data_received(client))
+        client.heartbeat_timer = loop.call_every(t_HeartBeatRate, _on_heartbeat_due, client)
 
+    def _drop_client(client, message):
+        # Closes the connection of a single client (the client will reconnect after its restart)
+        if client.isDropped:  # e.g. a failed send and a failed receive
+            return
+        client.isDropped = True
+        inst.log_event(message)
+        inst.metric_connection_drops.labels(client.station_id).inc()
+        loop.remove_reader(client.conn)
+        if client.heartbeat_timer:
+            client.heartbeat_timer.cancel()
+        inst.remove_client(client)
+        if not inst.clients:  # Wait for clients to (re-)connect
+            _start_client_timeout()
 
-class RevPiServerClass:
+    def _on_data_received(client):
+        # Receiving Data from Client
+        try:
+            data = client.conn.recv(1024)
+        except Exception, e:
+            if e.args[0] == errno.EWOULDBLOCK:  # Exception is caused by non-blocking socket (currently no data recv)
+                return
+            # Other exception, drop the connection to this client (it will restart and reconnect)
+            inst.log_event('[Traceback_3] ' + str(traceback.format_exc()), False)
+            _drop_client(client, '[CoSESServer] Failed. Closing connection to station ' + client.station_id + ' ...')
+            return
+        if not data:  # Connection has been closed by the client
+            _drop_client(client, '[- Warning -] Station ' + client.station_id + ' closed the connection.')
+            return
+        sensor_frames = []  # text packages of older clients (no sequence number and sampling time)
+        sequenced_frames = []  # binary frames and text packages that carry their sequence number and sampling time
+        for frame in client.framer.feed(data):  # complete lines only (incomplete rest is kept for the next recv)
+            frame_type = classify_frame(frame)
+            if frame_type != FRAME_SENSOR and frame_type != FRAME_BINARY:  # sensor data: captured with capture time
+                inst.capture_frame(client, frame)
+            if frame_type == FRAME_SENSOR:  # Sensor Data received
+                seq, t_millis, _ = split_sequenced_package(frame)
+                if seq is None:
+                    sensor_frames.append(frame)
+                else:
+                    sequenced_frames.append((seq, t_millis, frame))
+            elif frame_type == FRAME_BINARY:  # Sensor Data received (binary frame, carries its own timestamp)
+                sequenced_frames.append((frame.seq, frame.t_millis, frame))
+            elif frame_type == FRAME_HELLO:  # Client announces its station ID
+                inst.set_client_station(client, frame[1:])
+            elif frame_type == FRAME_PROTOCOL:  # Client requests a protocol
+                inst.set_client_protocol(client, frame[1:])
+            elif frame_type == FRAME_HEARTBEAT:  # HeartBeat response detected
+                if not client.HeartBeatValid:  # first reply to the last HeartBeat: round trip time
+                    inst.metric_heartbeat_rtt.labels(client.station_id).observe(time.time() - client.t_lastHeartBeat)
+                client.HeartBeatValid = True
+            else:
+                inst.count_frame('dropped')
+        if client.framer.discarded:  # overlong garbage lines
+            inst.count_frame('dropped', client.framer.discarded)
+            client.framer.discarded = 0
+        if sequenced_frames:
+            inst.ingest_sequenced_frames(client, sequenced_frames)
+        # Several sensor data packages of an older client at once = burst after a stall of the connection. The client
+        # sends one package per SensorSampleRate, so the earlier packages are back-dated accordingly (but never before
+        # the last package)
+        t_now = int(time.time())
+        if len(sensor_frames) > 1:
+            inst.count_frame('bursts')
+        for i, frame in enumerate(sensor_frames):
+            t_capture = max(t_now - (len(sensor_frames) - 1 - i) * SensorSampleRate, client.t_lastFrame + 1)
+            client.t_lastFrame = t_capture
+            inst.ingest_sensor_frame(client, frame, t_capture)
+
+    def _send_heartbeat(client):
+        if not inst.send_to_client(client, CMD_HeartBeat_char):  # Send new HeartBeat signal to Cotrollino
+            return
+        client.HeartBeatValid = False
+        client.t_lastHeartBeat = time.time()
+        inst.alreadyTimedOutClientConnect = False
+        inst.alreadyExperiencedException_01 = False
+        inst.alreadyExperiencedException_02 = False
+        inst.alreadyExperiencedException_04 = False
+
+    def _on_heartbeat_due(client):
+        # It's time to send a new HeartBeat
+        if client.HeartBeatValid:  # Last HeartBeat has been acknowledged
+            inst.revivedStations.discard(client.station_id)
+            _send_heartbeat(client)
+        else:  # No reply for last HeartBeat!
+            inst.metric_heartbeats_missed.labels(client.station_id).inc()
+            if client.missedHeartBeats > HeartBeats_missed_TIMEOUT:  # Something is wrong, multiple HeartBeats not received!
+                if client.station_id in inst.revivedStations:  # Previous reconnect of this station did not help
+                    message = '[- Warning -] Multiple HeartBeats left unanswered by station ' + client.station_id + \
+                              '! Previous measures failed. Resetting microcontroller and closing connection again. ' \
+                              'Please check the station as soon as possible.'
+                    inst.send_notification(message)
+                else:  # This is the first time that multiple heartbeats have been missed, first try just a simple reconnect
+                    message = '[- Warning -] Multiple HeartBeats left unanswered by station ' + client.station_id + \
+                              '! Initiating reconnect ...'
+                inst.revivedStations.add(client.station_id)
+                try:
+                    client.conn.send(CMD_RESET_CONTROLLINO)  # Try to send reset command to Cotrollino
+                except Exception:
+                    pass
+                _drop_client(client, message)
+            else:  # HeartBeat missed!
+                if(t_HeartBeatRate * 5) < (time.time() - client.t_temp):  # Reset counter if no HeartBeats missed for a while
+                    client.missedHeartBeats = 0
+                client.missedHeartBeats += 1
+                inst.log_event('[- Warning -] HeartBeat not received in time by station ' + client.station_id +
+                               '. (Skipping a Beat)')
+                client.t_temp = time.time()
+                _send_heartbeat(client)  # Skip the beat and send the next HeartBeat right away
+
+    def _on_watchdog_due():
+        inst.reset_watchdog_timer()  # Hardware watchdog will be reset every 45 seconds
+        inst.t_Watchdog = time.time()
+
+    try:
+        loop.add_reader(inst.s, _on_client_connecting)
+        # a failed send drops the client in the loop (also called by other threads, e.g. admin commands)
+        inst.drop_client = lambda client, message: loop.call_soon_threadsafe(_drop_client, client, message)
+        _start_client_timeout()
+        loop.call_every(45, _on_watchdog_due)
+        if Aggregation_interval > 0:
+            loop.call_every(Aggregation_interval, lambda: inst.flush_aggregates(time.time()))
+        # samples of stations whose clock offset is unknown are held back until their burst is over
+        loop.call_every(SensorSampleRate, inst.release_held_frames)
+        if inst.packet_capture:
+            loop.call_every(t_PacketCaptureFlush, inst.flush_packet_capture)
+        try:
+            local_endpoint.start(loop)
+        except Exception:  # not essential, local consumers fall back to the primary database
+            inst.log_event('[- Warning -] Local endpoint could not be started! ' + str(traceback.format_exc()))
+        loop.run(lambda: inst.threadRunning)
+    except Exception:
+        message = '[Traceback_2] ' + str(traceback.format_exc())
+        inst.log_event(message, False)
+        if inst.alreadyExperiencedException_02:  # Already experienced this exception, now try system reboot
+            inst.log_event('[CoSESServer] Failed. Trying to reboot system ...')
+            inst.send_notification('[- Warning -] Exception re-occurred. Trying to reboot system. '
+                                   'Please make sure the reboot solved the issue.')
+            inst.send_command(CMD_RESET_CONTROLLINO)  # Try to send reset command to Cotrollino
+            time.sleep(2)
+            inst.close_connection()  # stop the connection in a clean way
+            inst.restart_system()  # reboot RevPi
+        else:  # First time exception, try to just re-launch the connection
+            inst.log_event('[CoSESServer] Failed. Trying to revive connection ...')
+            inst.close_connection()  # stop the connection in a clean way
+            inst.revive_connection()
+        inst.alreadyExperiencedException_02 = True
+    finally:
+        local_endpoint.close()
+        loop.close()
+        inst.flush_packet_capture()
+
+
+class ClientConnection:
+    """
+    State of the connection to one client (CONTROLLINO of a weather station)
+    """
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.station_id = DEFAULT_STATION_ID  # until the client announces its own station ID
+        self.framer = LineFramer()
+        self.last_frame = None  # last sensor data package received
+        self.t_lastFrame = 0  # capture time assigned to the last sensor data package
+        # HeartBeat
+        self.heartbeat_timer = None
+        self.t_lastHeartBeat = time.time()
+        self.t_temp = time.time()
+        self.HeartBeatValid = True
+        self.missedHeartBeats = 0
+        self.isDropped = False
+
+
+class StationClock:
+    """
+    Sequence numbers and clock of a station that sends its samples with sequence number and sampling time. Kept per
+    station (not per connection), so samples buffered by the client while reconnecting keep their sampling time
+    """
     def __init__(self):
+        self.last_seq = None  # sequence number of the last sample
+        self.last_millis = None  # client time of the last sample
+        self.t_clockOffset = None  # offset between client time (millis) and server time in seconds
+        self.recent = deque(maxlen=SequenceWindow_size)  # (sequence number, client time) of the last samples
+        self.recent_set = set()
+        # samples held back while the offset is unknown: (client, sequence number, client time, frame, arrival time)
+        self.held = []
+
+    def is_duplicate(self, seq, t_millis):
+        return (seq, t_millis) in self.recent_set
+
+    def add(self, seq, t_millis):
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_set.discard(self.recent[0])
+        self.recent.append((seq, t_millis))
+        self.recent_set.add((seq, t_millis))
+        self.last_seq = seq
+        self.last_millis = t_millis
+
+    def reset(self):
+        # Client restarted: sequence number and client time start again at 0
+        self.last_seq = None
+        self.last_millis = None
+        self.t_clockOffset = None
+
+
+class RevPiServerClass:
+    def __init__(self, isReplay=False):
+        """
+        :param isReplay: bool - instance only replays captured frames (see replay_capture): no socket, no pid file, no
+                         watchdog, own log, spool and notification state (may run next to the server)
+        """
+        self.isReplay = isReplay
+        # Log (entries are written by the LogWriterThread)
+        self.log_queue = Queue.Queue(maxsize=LogQueue_size)
+        self.log_dropped = 0
+        self.log_dropped_lock = threading.Lock()
         self.log_path = self.read_ini('config', 'path_log')  # check if log file exists
+        log_thread = threading.Thread(target=LogWriterThread, args=[self])
+        log_thread.daemon = True  # must not keep the process alive (exit_gracefully flushes the log first)
+        log_thread.start()
+        # System services (watchdog, reboot, email transport - no helper processes)
+        self.system = create_system_services(get_config(path_ini))
+        self.isWatchdogFailing = False
+        self.pidfile = PidFile(self.read_ini('config', 'path_pidfile'))
         global RevPiServerLaunched
-        if not RevPiServerLaunched:
+        if not RevPiServerLaunched and (isReplay or self.acquire_pidfile()):
             # General global Class VARs
             RevPiServerLaunched = True
             self.ReviveConnection = False
             self.isConnectionClosing = False
             self.isServerRestarting = False
             self.s = None
-            self.conn = None
+            self.clients = {}  # Connected clients (file descriptor -> ClientConnection)
+            self.clients_lock = threading.Lock()
+            self.drop_client = None  # Closes the connection of a single client (set by the RevPiServerThread)
+            self.revivedStations = set()  # Stations whose connection has been revived due to missed HeartBeats
+            self.frame_stats = {'received': 0, 'dropped': 0, 'duplicates': 0, 'bursts': 0, 'lost': 0, 'late': 0}
+            self.station_clocks = {}  # Sequence numbers and clocks of the stations (station ID -> StationClock)
             self.isConnected = False
             self.threadRunning = False
-            self.log_list = []
             self.t_Watchdog = time.time()
-            self.SensorDataDict = {
-                0: None,
-                1: None,
-                2: None,
-                3: None,
-                4: None,
-                5: None,
-                6: None,
-                7: None,
-            }
             self.php_path = self.read_ini('php_paths', 'link_db_api')
-            # HeartBeat
-            self.t_lastHeartBeat = time.time()
-            self.t_temp = time.time()
-            self.HeartBeatValid = True
-            self.missedHeartBeats = 0
+            self.init_metrics()
+            self.admin_command_event = threading.Event()  # set to wake up the AdminCommandCheckerThread
+            self.admin_command_event.set()  # execute commands submitted while the server was not running
+            self.dataset_waiters = []  # long-poll requests waiting for new datasets (DeferredReply, feed request)
+            self.local_feed = deque(maxlen=LocalFeed_size)  # saved datasets: (ID, ID of the previous dataset, dataset)
+            self.dataset_waiters_lock = threading.Lock()
+            self.datasets_saved_count = 0  # number of successful saves into the primary database
+            # Notifications (sent in the background by the NotificationDispatcher)
+            path_notification_state = self.read_ini('config', 'path_notification_state')
+            if isReplay:
+                path_notification_state = get_replay_path(path_notification_state)
+            self.notifier = NotificationDispatcher(self.getDB_user_emails, self.system.transport,
+                                                   path_notification_state, path_contacts, self.log_event,
+                                                   Notification_coalesce_window, Notification_repeat_interval,
+                                                   Notification_rate_max, Notification_recipients_ttl)
+            # Write queue (datasets waiting to be saved into the primary database)
+            self.write_queue = Queue.Queue(maxsize=WriteQueue_size)
+            self.write_batch_max = SpoolReplay_batch if isReplay else WriteBatch_max_count
+            self.write_queue_lock = threading.Lock()
+            self.write_queue_stats = {
+                'enqueued': 0,
+                'written': 0,
+                'failed': 0,
+                'dropped': 0,
+                'spooled': 0,
+                'replayed': 0,
+                'max_depth': 0,
+            }
+            self.isWriteQueueOverflowing = False
+            # Keys of the datasets (unique per station and capture time, so the database saves a dataset once even if
+            # its batch is sent again): consecutive within a run, starting at a random key
+            self.dataset_keys = itertools.count(random.getrandbits(32))
+            # Spool (on-disk journal for datasets that could not be saved into the primary database)
+            self.isDatabaseFailing = False
+            self.t_spool_last_failure = 0
+            try:
+                path_spool = self.read_ini('config', 'path_spool')
+                self.spool = SampleSpool(get_replay_path(path_spool) if isReplay else path_spool)
+                if self.spool.has_pending():
+                    self.log_event('[CoSESServer] Spool contains ' + str(self.spool.pending) +
+                                   ' datasets that will be replayed into the primary database.')
+            except Exception:
+                self.spool = None
+                self.log_event('[- Warning -] Spool could not be opened! Datasets will be lost while the primary '
+                               'database is not available. ' + str(traceback.format_exc()))
+            # Downsampling (one aggregator per station)
+            self.aggregators = {}
+            self.rolling = {}  # Rolling aggregates (one per station, also guarded by aggregators_lock)
+            self.aggregators_lock = threading.Lock()
+            self.pending_summaries = deque(maxlen=SummaryQueue_size)  # summaries waiting to be saved
+            self.summaries_lock = threading.Lock()
+            self.raw_capture = None
+            self.local_socket_path = self.read_ini('config', 'path_local_socket')
+            if RawCapture_enabled:
+                try:
+                    self.raw_capture = RawCaptureWriter(self.read_ini('config', 'path_raw_capture'))
+                except Exception:
+                    self.log_event('[- Warning -] Raw capture could not be started! ' + str(traceback.format_exc()))
+            self.packet_capture = None
+            if PacketCapture_enabled and not isReplay:
+                try:
+                    self.packet_capture = PacketCaptureWriter(self.read_ini('config', 'path_packet_capture'),
+                                                              PacketCapture_rotate_size, PacketCapture_rotate_age,
+                                                              PacketCapture_backup_count)
+                except Exception:
+                    self.log_event('[- Warning -] Packet capture could not be started! ' + str(traceback.format_exc()))
             # Advanced Exception Handling
-            self.alreadyRevivedConnection = False
             self.alreadyTimedOutClientConnect = False
             self.alreadyExperiencedException_01 = False
             self.alreadyExperiencedException_02 = False
-            self.alreadyExperiencedException_03 = False
             self.alreadyExperiencedException_04 = False
             self.notification_path = None
-            self.update_notification_file()  # Create or update user_notification.txt
-            self.reset_watchdog_timer()  # reset watchdog timer
             self.t_Timout_listening_client = time.time()
-            # Start reviver thread
-            alive_thread = threading.Thread(target=AliveCheckerThread, args=[self])
-            alive_thread.start()
-            # Start Thread that is checking the database for admin commands
-            ACMD_thread = threading.Thread(target=AdminCommandCheckerThread, args=[self])
-            ACMD_thread.start()
-            # Start Thread that keeps the notification file up-to-date
-            NotificationUpdater_thread = threading.Thread(target=UpdateNotificationFileThread, args=[self])
-            NotificationUpdater_thread.start()
+            # Start Thread that saves the acquired datasets into the primary database
+            writer_thread = threading.Thread(target=DatabaseWriterThread, args=[self])
+            writer_thread.daemon = isReplay  # replay_capture waits until all datasets have been saved
+            writer_thread.start()
+            self.metrics_server = None
+            if not isReplay:  # a replay only needs the parser and the persistence path
+                self.update_notification_file()  # Create or update user_notification.txt
+                self.reset_watchdog_timer()  # reset watchdog timer
+                # Start reviver thread
+                alive_thread = threading.Thread(target=AliveCheckerThread, args=[self])
+                alive_thread.start()
+                # Start Thread that is checking the database for admin commands
+                ACMD_thread = threading.Thread(target=AdminCommandCheckerThread, args=[self])
+                ACMD_thread.start()
+                # Start Thread that keeps the notification file up-to-date
+                NotificationUpdater_thread = threading.Thread(target=UpdateNotificationFileThread, args=[self])
+                NotificationUpdater_thread.start()
+                # Start metrics endpoint (local HTTP endpoint, e.g. scraped by Prometheus)
+                self.start_metrics_server()
         else:
-            self.log_event('[ERROR_1] CoSESServer already running! Only one instance at a time can be run.')
+            self.exit_gracefully('[ERROR_1] CoSESServer already running! Only one instance at a time can be run.')
 
     def start_server(self):
         """
@@ -357,7 +767,7 @@ class RevPiServerClass:
                 self.s.bind((host, port))  # Listen for incoming connections on the defined port
                 message = '[CoSESServer] Bind on port: ' + str(port)
                 self.log_event(message, False)
-                self.s.listen(1)  # Accept only one client for created socket
+                self.s.listen(MaxClients)  # Accept multiple clients (one per weather station)
                 self.log_event('[CoSESServer] Server successfully launched.', False)
                 self.log_event('[CoSESServer] Waiting for incoming connections ...')
                 self.t_Timout_listening_client = time.time()
@@ -384,10 +794,299 @@ class RevPiServerClass:
         else:
             self.log_event('[ERROR_2] CoSESServer already running! Only one instance at a time can be run.')
 
-    def parse_sensor_data(self, rawDataString):
+    def ingest_sensor_frame(self, client, frame, t_unix):
+        """
+        Checks a sensor data package received from a client (without sequence number and sampling time, older clients)
+        and hands it over to the parser
+        :param client: ClientConnection - client that sent the package
+        :param frame: str - sensor data package (one line)
+        :param t_unix: int - capture time of the dataset
+        :return: --
+        """
+        self.count_frame('received')
+        self.metric_samples_received.labels(client.station_id).inc()
+        self.capture_frame(client, frame, t_unix)
+        if frame == client.last_frame:  # identical readings are possible (e.g. at night), so only count them
+            self.count_frame('duplicates')
+        client.last_frame = frame
+        self.parse_sensor_package(frame, client.station_id, t_unix)
+
+    def ingest_sequenced_frames(self, client, frames):
+        """
+        Checks the sequence numbers of sensor data that carries its own sequence number and sampling time (binary
+        frames and text packages of current clients), converts the client time into the capture time and hands the
+        samples over to the parser. Samples buffered by the client during link problems arrive at once (burst) and
+        keep their sampling time, samples sent again after a reconnect are dropped as duplicates. As long as the clock
+        offset of the station is unknown (first samples of the client or after its restart), the samples are held back
+        until the burst is over (see release_held_frames)
+        :param client: ClientConnection - client that sent the frames
+        :param frames: list - (sequence number, client time in ms, frame) in the order of arrival
+        :return: --
+        """
+        clock = self.get_station_clock(client.station_id)
+        t_arrival = time.time()
+        frames = [(client, seq, t_millis, frame, t_arrival) for seq, t_millis, frame in frames]
+        if clock.t_clockOffset is None:
+            # A burst arrives in several chunks: every chunk of it holds older samples than their arrival suggests, so
+            # the difference between arrival and client time of its newest sample drops with every chunk. It is over
+            # as soon as a chunk arrives within one sample period of the previous one (difference drops by less than
+            # half a sample period)
+            isDrained = False
+            if clock.held:
+                t_millis_all = [entry[2] for entry in clock.held + frames]
+                periods = [t_next - t for t, t_next in zip(t_millis_all, t_millis_all[1:]) if t_next > t]
+                t_period = min(periods) / 1000.0 if periods else SensorSampleRate
+                isDrained = (t_arrival - frames[-1][2] / 1000.0) >= \
+                    (clock.held[-1][4] - clock.held[-1][2] / 1000.0) - t_period / 2.0
+            clock.held.extend(frames)
+            if isDrained:
+                self.release_held_frames(clock)
+        else:
+            self.process_sequenced_frames(clock, frames)
+
+    def release_held_frames(self, clock=None):
+        """
+        Processes the samples held back while the clock offset of a station was unknown. The offset is the smallest
+        difference between arrival and client time of all of them (least delayed sample of the whole burst). Called
+        once the burst is over and periodically (RevPiServerThread) for stations that did not send again
+        :param clock: StationClock - station whose burst is over (None = every station without a sample for a sample
+                      period)
+        :return: --
+        """
+        if clock is None:
+            t_now = time.time()
+            for clock in self.station_clocks.values():
+                if clock.held and (t_now - clock.held[-1][4]) >= SensorSampleRate:
+                    self.release_held_frames(clock)
+            return
+        frames, clock.held = clock.held, []
+        t_first = frames[0][2]
+        # samples after a restart of the client (client time starts again) belong to the next clock offset
+        clock.t_clockOffset = min(t_arrival - t_millis / 1000.0 for _, _, t_millis, _, t_arrival in frames
+                                  if t_millis >= t_first)
+        self.process_sequenced_frames(clock, frames, True)
+
+    def process_sequenced_frames(self, clock, frames, isOffsetFixed=False):
+        """
+        Converts the client time of samples into the capture time (clock offset of the station known) and hands the
+        samples over to the parser
+        :param clock: StationClock - station of the samples
+        :param frames: list - (client, sequence number, client time in ms, frame, arrival time) in the order of arrival
+        :param isOffsetFixed: bool - the offset has been determined from all frames (held back samples of a burst)
+        :return: --
+        """
+        isBurst = False
+        for i, (client, seq, t_millis, frame, t_arrival) in enumerate(frames):
+            isDuplicate = clock.is_duplicate(seq, t_millis)  # sample has already been received
+            gap = 1
+            if not isDuplicate and clock.last_seq is not None:
+                gap = (seq - clock.last_seq) & 0xffff  # sequence number wraps around
+                if gap == 0 or gap >= 0x8000 or t_millis < clock.last_millis:  # client restarted (or millis() overflow)
+                    clock.reset()
+                    clock.held = frames[i:]  # held back until the new clock offset is known
+                    break
+            self.count_frame('received')
+            self.metric_samples_received.labels(client.station_id).inc()
+            if isDuplicate:
+                self.count_frame('duplicates')
+                self.capture_frame(client, frame)  # no capture time: not replayed
+                continue
+            if gap > 1:
+                self.count_frame('lost', gap - 1)
+                self.log_event('[- Warning -][' + client.station_id + '] ' + str(gap - 1) +
+                               ' sensor data frame(s) lost!')
+            # Capture time = client time + offset. The offset is the smallest observed difference between arrival and
+            # client time (= least delayed sample) and may rise slowly to follow a client clock that runs slow
+            t_client = t_millis / 1000.0
+            if clock.last_millis is not None and not isOffsetFixed:
+                clock.t_clockOffset = min(clock.t_clockOffset + (t_millis - clock.last_millis) / 1000.0 *
+                                          ClientClockDrift_max, t_arrival - t_client)
+            clock.add(seq, t_millis)
+            t_capture = t_client + clock.t_clockOffset
+            isBurst = isBurst or (t_arrival - t_capture) > SensorSampleRate  # buffered by the client
+            self.capture_frame(client, frame, t_capture)
+            if isinstance(frame, BinarySensorFrame):
+                self.parse_binary_sensor_data(frame, client.station_id, t_capture)
+            else:
+                self.parse_sensor_package(split_sequenced_package(frame)[2], client.station_id, t_capture)
+        if isBurst:
+            self.count_frame('bursts')
+
+    def get_station_clock(self, station_id):
+        """
+        Returns the sequence numbers and clock of a station (kept across reconnects). Only called by the
+        RevPiServerThread
+        :param station_id: str - station
+        :return: StationClock
+        """
+        clock = self.station_clocks.get(station_id)
+        if clock is None:
+            clock = self.station_clocks[station_id] = StationClock()
+        return clock
+
+    def parse_sensor_package(self, package, station_id, t_unix):
+        """
+        Checks a text sensor data package (without header) and hands it over to the parser
+        :param package: str - sensor values separated by '|'
+        :param station_id: str - station (CONTROLLINO) that sent the data
+        :param t_unix: float - capture time of the dataset
+        :return: bool - False if the package has been dropped
+        """
+        if len(package.split('|')) != SensorFrame_fields or SequenceHeader_separator in package:  # corrupt package
+            self.count_frame('dropped')
+            self.log_event('[- Warning -][' + station_id + '] Dropped malformed sensor data package: ' +
+                           repr(package[:100]))
+            return False
+        try:
+            self.parse_sensor_data(package, station_id, t_unix)
+        except (ValueError, IndexError):  # invalid values in an otherwise complete package
+            self.count_frame('dropped')
+            self.log_event('[- Warning -][' + station_id + '] Dropped invalid sensor data package: ' +
+                           repr(package[:100]))
+            return False
+        return True
+
+    def parse_binary_sensor_data(self, frame, station_id, t_unix):
+        """
+        Creates a dataset out of a binary sensor frame (counterpart of parse_sensor_data for the binary protocol)
+        :param frame: BinarySensorFrame - decoded frame
+        :param station_id: str - station (CONTROLLINO) that sent the data
+        :param t_unix: float - capture time of the dataset
+        :return: --
+        """
+        data = {"station": station_id, "t_unix": t_unix}
+        for i, key in enumerate(SensorValue_keys):
+            if frame.status & (1 << i) or frame.values[i] != frame.values[i]:  # invalid reading (or NaN)
+                data[key] = None
+                self.metric_invalid_readings.labels(station_id, key).inc()
+            else:
+                data[key] = '%.7g' % frame.values[i]  # float32 carries ~7 significant digits
+        # In case SPN1 radiation values are negative, set to zero
+        for key in ('spn1_radTot', 'spn1_radDiff'):
+            if data[key] is not None and float(data[key]) < 0:
+                data[key] = '0.0'
+        if frame.status & 0x1c:  # bits 2-4 (SPN1)
+            self.log_event('[- Warning -][' + station_id + '] SPN1 (over serial) returned an invalid reading! '
+                           'Please check if this is a repetitive misbehavior. Sensor properly connected?')
+        if frame.status & 0x02:  # bit 1 (PT100)
+            self.log_event('[- Warning -][' + station_id + '] PT100 RTD Amp-Board (over SPI) returned invalid values! '
+                           'Please check if this is a repetitive misbehavior. Module properly connected?')
+        if frame.status & 0xe0:  # bits 5-7 (CMP3)
+            self.log_event('[- Warning -][' + station_id + '] CMP3 Amp-Board ADC (over I2C) returned invalid values! '
+                           'Please check if this is a repetitive misbehavior. Module properly connected?')
+        self.aggregate_sensor_data(data)
+
+    def count_frame(self, counter, count=1):
+        """
+        Updates the frame statistics
+        :param counter: str - 'received' | 'dropped' | 'duplicates' | 'bursts' | 'lost' | 'late'
+        :param count: int - increment
+        :return: --
+        """
+        with self.clients_lock:
+            self.frame_stats[counter] += count
+
+    def get_frame_stats(self):
+        """
+        Returns the frame statistics of all clients
+        :param NONE: --
+        :return: dict - received, dropped, duplicates, bursts, lost and late (samples of intervals handed over)
+        """
+        with self.clients_lock:
+            return dict(self.frame_stats)
+
+    def capture_frame(self, client, frame, t_capture=None):
+        """
+        Records a received frame (packet capture, see CoSESCapture). Only called by the RevPiServerThread
+        :param client: ClientConnection - client that sent the frame
+        :param frame: str | BinarySensorFrame - frame
+        :param t_capture: float - capture time assigned to a sensor data package (None for other frames)
+        :return: --
+        """
+        if self.packet_capture:
+            self.packet_capture.write(time.time(), t_capture, client.station_id, frame)
+
+    def flush_packet_capture(self):
+        """
+        Writes the captured frames into the capture file (called periodically by the RevPiServerThread)
+        :param NONE: --
+        :return: --
+        """
+        if self.packet_capture:
+            try:
+                self.packet_capture.flush()
+            except Exception:
+                self.packet_capture = None
+                self.log_event('[- Warning -] Packet capture failed and has been stopped! ' +
+                               str(traceback.format_exc()))
+
+    def replay_capture(self, paths, speed=0, t_start=None, t_end=None):
+        """
+        Feeds captured frames (see CoSESCapture) through the parser and the persistence path, e.g. to backfill an
+        outage with data logged on the CONTROLLINO or to benchmark parser changes with real traffic. Sensor data is
+        replayed with the capture time recorded by the server, other frames are skipped. Returns as soon as all
+        datasets have been saved into the primary database, or as soon as the database did not save any of them within
+        t_ReplayDatabaseTimeout (the remaining datasets are kept in the spool)
+        :param paths: list - capture files (in chronological order)
+        :param speed: float - replay rate relative to real time (e.g. 10 = ten times faster, 0 = as fast as possible)
+        :param t_start: float - frames that arrived before this time are skipped (None = from the beginning)
+        :param t_end: float - frames that arrived after this time are skipped (None = until the end)
+        :return: dict - frames, samples and dropped (counts), t_parse and t_total (seconds), complete (False = timeout)
+        """
+        stats = {'frames': 0, 'samples': 0, 'dropped': 0, 't_parse': 0.0, 'complete': True}
+        t_begin = time.time()
+        t_first = None
+        queue_max = int(WriteQueue_size * Replay_queue_max)
+        for t_arrival, t_capture, station_id, frame in read_capture(paths):
+            if (t_start is not None and t_arrival < t_start) or (t_end is not None and t_arrival > t_end):
+                continue
+            stats['frames'] += 1
+            if t_capture is None:  # no sensor data (e.g. HeartBeat reply)
+                continue
+            if speed > 0:  # keep the time between the frames (scaled)
+                if t_first is None:
+                    t_first = t_arrival
+                t_wait = t_begin + (t_arrival - t_first) / speed - time.time()
+                if t_wait > 0:
+                    time.sleep(t_wait)
+            while self.write_queue.qsize() > queue_max:  # wait for the DatabaseWriterThread instead of dropping
+                time.sleep(0.01)
+            t_parse_start = time.time()
+            if isinstance(frame, BinarySensorFrame):
+                self.parse_binary_sensor_data(frame, station_id, t_capture)
+                isParsed = True
+            else:  # text package (header removed)
+                isParsed = self.parse_sensor_package(split_sequenced_package(frame)[2], station_id, t_capture)
+            stats['samples' if isParsed else 'dropped'] += 1
+            stats['t_parse'] += time.time() - t_parse_start
+        self.flush_aggregates()  # hand over the last (incomplete) intervals
+        self.write_queue.join()  # all datasets saved or spooled
+        remaining = None  # datasets and summaries left to be saved (None = not waiting yet)
+        while (self.spool and self.spool.has_pending()) or self.pending_summaries:
+            if remaining is None:
+                self.log_event('[CoSESServer] Replay: waiting for the primary database to save the remaining '
+                               'datasets ...')
+            spooled = self.spool.pending if self.spool else 0
+            pending = spooled + len(self.pending_summaries)
+            if remaining is None or pending < remaining:  # progress: the database is available
+                remaining = pending
+                t_progress = time.time()
+            elif time.time() - t_progress > t_ReplayDatabaseTimeout:
+                self.log_event('[- Warning -] Replay: the primary database did not save any dataset within ' +
+                               str(t_ReplayDatabaseTimeout) + ' seconds! Giving up: ' + str(spooled) +
+                               ' datasets are kept in the spool, ' + str(pending - spooled) + ' summaries are lost.')
+                stats['complete'] = False
+                break
+            time.sleep(1)
+        stats['t_total'] = time.time() - t_begin
+        return stats
+
+    def parse_sensor_data(self, rawDataString, station_id=DEFAULT_STATION_ID, t_unix=None):
         """
         Parse the raw data received from the TCP socket acquired from various sensors
         :param rawDataString: string - containing values from all sensors. Values are separated with an '|'.
+        :param station_id: str - station (CONTROLLINO) that sent the data
+        :param t_unix: int - capture time of the dataset (None = now)
         :return: --
         """
         '''
@@ -401,6 +1100,7 @@ class RevPiServerClass:
         6 = CMP3  Pyranometer 2 | Solar Radiation   | [W/m²]
         7 = CMP3  Pyranometer 3 | Solar Radiation   | [W/m²]
         '''
+        SensorDataDict = dict.fromkeys(range(8))
         index = 0
         rawSensorDataList = rawDataString.split("|")
         for sensor_i in rawSensorDataList:  # Loop through all sensor readings
@@ -408,7 +1108,9 @@ class RevPiServerClass:
                 if ',' in sensor_i or '_ERR_SPN1_' in sensor_i:  # SPN1 reading returns a comma separated string -> needs further parsing
                     if '_ERR_SPN1_' in sensor_i:  # SPN1 did not return a valid reading
                         spn1Readings = [None, None, None]  # invalid reading received
-                        self.log_event('[- Warning -] SPN1 (over serial) returned an invalid reading! '
+                        for key in SensorValue_keys[index:index + 3]:
+                            self.metric_invalid_readings.labels(station_id, key).inc()
+                        self.log_event('[- Warning -][' + station_id + '] SPN1 (over serial) returned an invalid reading! '
                                        'Please check if this is a repetitive misbehavior. Sensor properly connected?')
                     else:  # valid reading returned from SPN1
                         spn1Readings = sensor_i.split(",")
@@ -417,60 +1119,550 @@ class RevPiServerClass:
                             spn1Readings[0] = '0.0'
                         if float(spn1Readings[1]) < 0:
                             spn1Readings[1] = '0.0'
-                    self.SensorDataDict[index] = spn1Readings[0]
+                    SensorDataDict[index] = spn1Readings[0]
                     index += 1
-                    self.SensorDataDict[index] = spn1Readings[1]
+                    SensorDataDict[index] = spn1Readings[1]
                     index += 1
-                    self.SensorDataDict[index] = spn1Readings[2]
+                    SensorDataDict[index] = spn1Readings[2]
                     index += 1
                 else:  # All other sensors
                     if '9999' in sensor_i:  # one of the sensor returned an invalid value or could not be read
                         if '9999.1' in sensor_i:  # PT100 RTD Amp-Board
-                            self.log_event('[- Warning -] PT100 RTD Amp-Board (over SPI) returned invalid values! '
+                            self.log_event('[- Warning -][' + station_id + '] PT100 RTD Amp-Board (over SPI) returned invalid values! '
                                            'Please check if this is a repetitive misbehavior. Module properly connected?')
                         elif '9999.21' in sensor_i:  # CMP3 Amp-Board ADC - Channel 1
-                            self.log_event('[- Warning -] CMP3 Amp-Board ADC (Channel 1 over I2C) returned invalid values! '
+                            self.log_event('[- Warning -][' + station_id + '] CMP3 Amp-Board ADC (Channel 1 over I2C) returned invalid values! '
                                            'Please check if this is a repetitive misbehavior. Module properly connected?')
                         elif '9999.22' in sensor_i:  # CMP3 Amp-Board ADC - Channel 3
-                            self.log_event('[- Warning -] CMP3 Amp-Board ADC (Channel 3 over I2C) returned invalid values! '
+                            self.log_event('[- Warning -][' + station_id + '] CMP3 Amp-Board ADC (Channel 3 over I2C) returned invalid values! '
                                            'Please check if this is a repetitive misbehavior. Module properly connected?')
                         elif '9999.23' in sensor_i:  # CMP3 Amp-Board ADC - Channel 4
-                            self.log_event('[- Warning -] CMP3 Amp-Board ADC (Channel 4 over I2C) returned invalid values! '
+                            self.log_event('[- Warning -][' + station_id + '] CMP3 Amp-Board ADC (Channel 4 over I2C) returned invalid values! '
                                            'Please check if this is a repetitive misbehavior. Module properly connected?')
-                        self.SensorDataDict[index] = None  # flag sensor reading as invalid
+                        SensorDataDict[index] = None  # flag sensor reading as invalid
+                        if index < len(SensorValue_keys):
+                            self.metric_invalid_readings.labels(station_id, SensorValue_keys[index]).inc()
                     else:  # returned sensor values seem valid - save them
-                        self.SensorDataDict[index] = sensor_i  # Save data into dictionary
+                        SensorDataDict[index] = sensor_i  # Save data into dictionary
                     index += 1
-        # Save new dataset into primary database (forwarding data to PHP script)
+        # Hand new dataset over to the DatabaseWriterThread (saved into primary database by forwarding data to PHP script)
+        data = {
+                "temp": SensorDataDict[1],
+                "wind": SensorDataDict[0],
+                "spn1_radTot": SensorDataDict[2],
+                "spn1_radDiff": SensorDataDict[3],
+                "spn1_sun": SensorDataDict[4],
+                "rad_cmp1": SensorDataDict[5],
+                "rad_cmp2": SensorDataDict[6],
+                "rad_cmp3": SensorDataDict[7],
+                "station": station_id,
+                "t_unix": t_unix if t_unix is not None else time.time()  # capture time of the dataset
+               }
+        self.aggregate_sensor_data(data)
+
+    def aggregate_sensor_data(self, dataset):
+        """
+        Adds a sample to the aggregator of its station and hands completed (aggregated) datasets over to the
+        DatabaseWriterThread
+        :param dataset: dict - sample (sensor values, station and capture time)
+        :return: --
+        """
+        self.metric_samples_parsed.labels(dataset['station']).inc()
+        with self.aggregators_lock:
+            aggregator = self.aggregators.get(dataset['station'])
+            if aggregator is None:
+                aggregator = self.aggregators[dataset['station']] = \
+                    SampleAggregator(dataset['station'], Aggregation_interval, RawWindow_size)
+            late = aggregator.late
+            datasets = aggregator.add(dataset)
+            isLate = aggregator.late > late  # interval handed over already: sample dropped
+            rolling = self.rolling.get(dataset['station'])
+            if rolling is None:
+                rolling = self.rolling[dataset['station']] = \
+                    RollingAggregates(dataset['station'], RollingAggregates_gap_max)
+            summaries = rolling.add(dataset)
+            if self.raw_capture:
+                try:
+                    self.raw_capture.write(dataset)
+                except Exception:
+                    self.raw_capture = None
+                    self.log_event('[- Warning -] Raw capture failed and has been stopped! ' +
+                                   str(traceback.format_exc()))
+        if isLate:
+            self.count_frame('late')
+        if summaries:
+            with self.summaries_lock:
+                self.pending_summaries.extend(summaries)  # oldest summaries are dropped if the queue is full
+        for aggregated in datasets:
+            self.enqueue_sensor_data(aggregated)
+
+    def flush_aggregates(self, t_now=None):
+        """
+        Hands over the datasets of intervals that did not receive any later sample (station stopped sending)
+        :param t_now: float - current time (None = hand over all intervals, e.g. on shutdown)
+        :return: --
+        """
+        datasets = []
+        with self.aggregators_lock:
+            for aggregator in self.aggregators.values():
+                datasets.extend(aggregator.flush(t_now))
+            if self.raw_capture:
+                self.raw_capture.flush()
+        for aggregated in datasets:
+            self.enqueue_sensor_data(aggregated)
+
+    def get_raw_samples(self, station_id):
+        """
+        Returns the raw samples of a station that are kept in memory
+        :param station_id: str - station
+        :return: list - samples (datasets), oldest first
+        """
+        with self.aggregators_lock:
+            aggregator = self.aggregators.get(station_id)
+            return list(aggregator.raw_window) if aggregator else []
+
+    def handle_local_request(self, request):
+        """
+        Answers a request received over the local endpoint (Unix socket). Replies use the format of the database API
+        'latest [station]'            -> latest sample (of the station, default: of all stations)
+        'history <station> [count]'   -> the latest samples of the station, oldest first
+        'summary [station]'           -> rolling aggregates (1 min, 5 min, 1 h, day) per sensor of the station(s)
+        'command'                     -> an admin command has been submitted (wakes up the AdminCommandCheckerThread)
+        'wait [count] [timeout]'      -> long-poll: replies as soon as datasets have been saved into the primary
+                                         database (number of saves differs from count) or after the timeout (seconds)
+        'feed <id> [timeout] [count] [station]'
+                                      -> long-poll: the datasets saved after the dataset with this ID (local feed, format
+                                         of p_mode 21), '__GAP;' if the feed does not hold them (read the primary
+                                         database instead)
+        :param request: str - request line
+        :return: str - reply (JSON) | DeferredReply (long-poll)
+        """
+        if request == 'command':
+            self.admin_command_event.set()
+            return json.dumps('__SUCCESS;')
+        args = request.split()
+        if args and args[0] == 'wait':
+            t_timeout = min(float(args[2]) if len(args) > 2 else t_LocalEndpointWaitMax, t_LocalEndpointWaitMax)
+            with self.dataset_waiters_lock:
+                reply = json.dumps(['__SUCCESS;', {'saved': self.datasets_saved_count}])
+                if len(args) < 2 or int(args[1]) != self.datasets_saved_count:  # saved since the consumer asked
+                    return reply
+                waiter = DeferredReply(t_timeout, reply)  # timeout: same count
+                self.dataset_waiters = [w for w in self.dataset_waiters if w[0].is_pending()] + [(waiter, None)]
+            return waiter
+        if args and args[0] == 'feed' and len(args) >= 2:
+            id_after = int(args[1])
+            t_timeout = min(float(args[2]) if len(args) > 2 else t_LocalEndpointWaitMax, t_LocalEndpointWaitMax)
+            count = min(int(args[3]) if len(args) > 3 else LocalFeed_size, LocalFeed_size)
+            feed_request = (id_after, count, args[4] if len(args) > 4 else None)
+            with self.dataset_waiters_lock:
+                reply = self.get_local_feed_reply(*feed_request)
+                if reply is not None:
+                    return reply
+                waiter = DeferredReply(t_timeout, json.dumps('__NO_ROWS_RETURNED;'))
+                self.dataset_waiters = [w for w in self.dataset_waiters if w[0].is_pending()] + \
+                                       [(waiter, feed_request)]
+            return waiter
+        def _to_reply(dataset):
+            reply = dict((key, dataset.get(key)) for key in SensorValue_keys)
+            reply['station'] = dataset['station']
+            reply['t_unix'] = str(int(dataset['t_unix']))
+            return reply
+
+        with self.aggregators_lock:
+            windows = dict((station, list(aggregator.raw_window)) for station, aggregator in self.aggregators.items()
+                           if (len(args) < 2 or station == args[1]))
+            summaries = None
+            if args and args[0] == 'summary':
+                summaries = dict((station, rolling.snapshot(time.time())) for station, rolling in self.rolling.items()
+                                 if (len(args) < 2 or station == args[1]) and rolling.t_last is not None)
+                for station, summary in summaries.items():
+                    summary['t_unix'] = str(int(self.rolling[station].t_last))
+        if args and args[0] == 'summary':
+            if not summaries:
+                return json.dumps('__SUCCESS;__NO_ROWS_RETURNED;')
+            return json.dumps(['__SUCCESS;', summaries])
+        if args and args[0] == 'latest':
+            latest = [window[-1] for window in windows.values() if window]
+            if not latest:
+                return json.dumps('__SUCCESS;__NO_ROWS_RETURNED;')
+            return json.dumps(['__SUCCESS;', _to_reply(max(latest, key=lambda dataset: dataset['t_unix']))])
+        elif args and args[0] == 'history' and len(args) >= 2:
+            count = min(int(args[2]) if len(args) > 2 else LocalEndpoint_history_max, LocalEndpoint_history_max)
+            window = windows.get(args[1], [])[-count:] if count > 0 else []
+            if not window:
+                return json.dumps('__SUCCESS;__NO_ROWS_RETURNED;')
+            return json.dumps(['__SUCCESS;'] + [_to_reply(dataset) for dataset in window])
+        return json.dumps('[ERROR] Unknown request: ' + request[:64])
+
+    def enqueue_sensor_data(self, dataset):
+        """
+        Puts a parsed dataset into the write queue. If the queue is full the WriteQueue_overflow_policy is applied
+        :param dataset: dict - sensor values and capture time of the dataset
+        :return: bool - True if the dataset has been queued
+        """
+        dataset['dataset_key'] = str(next(self.dataset_keys) % 0xffffffff + 1)  # 1 ... 2^32 - 1 (0 = none in the spool)
+        queued = False
+        dropped = False
+        try:
+            if WriteQueue_overflow_policy == 'block':  # wait a limited amount of time for a free slot
+                self.write_queue.put(dataset, True, WriteQueue_block_timeout)
+            else:
+                self.write_queue.put_nowait(dataset)
+            queued = True
+        except Queue.Full:
+            dropped = True
+            if WriteQueue_overflow_policy == 'drop_oldest':  # discard the oldest dataset to make room for the new one
+                try:
+                    self.write_queue.get_nowait()
+                    self.write_queue.task_done()
+                    self.write_queue.put_nowait(dataset)
+                    queued = True
+                except (Queue.Empty, Queue.Full):
+                    pass
+        depth = self.write_queue.qsize()
+        with self.write_queue_lock:
+            if queued:
+                self.write_queue_stats['enqueued'] += 1
+            if dropped:
+                self.write_queue_stats['dropped'] += 1
+            if depth > self.write_queue_stats['max_depth']:
+                self.write_queue_stats['max_depth'] = depth
+        if dropped:
+            if not self.isWriteQueueOverflowing:  # only log once until the queue has recovered
+                self.isWriteQueueOverflowing = True
+                self.log_event('[- Warning -] Write queue full! Datasets are being dropped (policy: ' +
+                               WriteQueue_overflow_policy + '). Primary database reachable?')
+        elif self.isWriteQueueOverflowing and depth < (WriteQueue_size / 2):
+            self.isWriteQueueOverflowing = False
+        return queued
+
+    def persist_sensor_datasets(self, datasets):
+        """
+        Saves a batch of datasets into the primary database or, if the database is not available (or older
+        datasets are still waiting in the spool), appends them to the spool. Called by the DatabaseWriterThread
+        :param datasets: list - datasets (dict) that have to be saved
+        :return: --
+        """
+        if self.spool and self.spool.has_pending():  # keep the order: older datasets are still waiting in the spool
+            self.spool_sensor_datasets(datasets)
+        elif not self.save_sensor_datasets(datasets):
+            self.spool_sensor_datasets(datasets)
+
+    def save_sensor_datasets(self, datasets):
+        """
+        Saves a batch of datasets into the primary database with one request (forwarding data to PHP script)
+        :param datasets: list - datasets (dict) that have to be saved into the primary database
+        :return: bool - True if the datasets have been saved
+        """
         data = {
-                "p_mode": 1,
-                "p_temp": self.SensorDataDict[1],
-                "p_wind": self.SensorDataDict[0],
-                "p_spn1_radTot": self.SensorDataDict[2],
-                "p_spn1_radDiff": self.SensorDataDict[3],
-                "p_spn1_sun": self.SensorDataDict[4],
-                "p_rad_cmp1": self.SensorDataDict[5],
-                "p_rad_cmp2": self.SensorDataDict[6],
-                "p_rad_cmp3": self.SensorDataDict[7]
+                "p_mode": 16,
+                "p_datasets": json.dumps(datasets)
                }
-        resp_php = requests.post(self.php_path, data=data).text  # send POST request
+        try:
+            resp_php = self.post_db_api(data).text  # send POST request
+        except Exception:
+            resp_php = str(traceback.format_exc())
 
         if '__SUCCESS;' not in resp_php:  # If error occurred while trying to save data to primary database
-            message = '[- Warning -] Primary Database Error occurred! PHP Script returned: ' + str(resp_php)
-            self.send_notification(message)
-            self.generate_status_file('Email notification sent by server script')
-            self.log_event(message)
+            self.t_spool_last_failure = time.time()
+            with self.write_queue_lock:
+                self.write_queue_stats['failed'] += len(datasets)
+            if not self.isDatabaseFailing:  # only notify once until the database is available again
+                self.isDatabaseFailing = True
+                message = '[- Warning -] Primary Database Error occurred! Datasets are spooled until the database ' \
+                          'is available again. PHP Script returned: ' + str(resp_php)
+                self.send_notification(message)
+                self.generate_status_file('Email notification sent by server script')
+                self.log_event(message)
+            return False
+        if self.isDatabaseFailing:
+            self.isDatabaseFailing = False
+            self.log_event('[CoSESServer] Primary database available again.')
+        with self.write_queue_lock:
+            self.write_queue_stats['written'] += len(datasets)
+        reply = resp_php.strip().split('__SUCCESS;', 1)[1].split(';')
+        try:  # IDs assigned by the primary database (newest dataset before the batch, saved datasets)
+            id_previous = int(reply[0])
+            ids = [int(id_dataset) for id_dataset in reply[1].split(',')] if reply[1] else []
+            if len(ids) != len(datasets):
+                raise ValueError('IDs do not match the batch')
+        except (ValueError, IndexError):  # database API without IDs: no local feed
+            id_previous = ids = None
+        self.notify_datasets_saved(datasets, ids, id_previous)
+        return True
+
+    def notify_datasets_saved(self, datasets, ids=None, id_previous=None):
+        """
+        Publishes saved datasets on the local feed and answers the consumers waiting for new datasets (long-poll 'wait'
+        and 'feed' requests of the local endpoint)
+        :param datasets: list - datasets (dict) saved into the primary database
+        :param ids: list - IDs assigned by the primary database (in the order of datasets, 0 = saved already,
+                    None = unknown)
+        :param id_previous: int - ID of the newest dataset before the batch (None = unknown)
+        :return: --
+        """
+        with self.dataset_waiters_lock:
+            self.datasets_saved_count += 1
+            if ids is None:  # the feed cannot follow the IDs anymore: consumers read the primary database
+                self.local_feed.clear()
+            else:
+                if self.local_feed and self.local_feed[-1][0] != id_previous:
+                    # datasets saved by another writer (not in the feed): consumers behind them read the primary
+                    # database (the feed starts again with this batch)
+                    self.local_feed.clear()
+                for dataset, id_dataset in zip(datasets, ids):
+                    if not id_dataset:  # saved already (batch sent again), not a new dataset
+                        continue
+                    reply = dict((key, None if dataset.get(key) is None else str(dataset[key]))
+                                 for key in SensorValue_keys)  # strings like the replies of the database API
+                    reply['station'] = dataset['station']
+                    reply['t_unix'] = str(int(dataset['t_unix']))
+                    reply['id'] = str(id_dataset)
+                    self.local_feed.append((id_dataset, id_previous, reply))
+                    id_previous = id_dataset
+            waiters, self.dataset_waiters = self.dataset_waiters, []
+            replies = []
+            for waiter, feed_request in waiters:
+                if feed_request is None:  # 'wait'
+                    reply = json.dumps(['__SUCCESS;', {'saved': self.datasets_saved_count}])
+                elif ids is None:
+                    reply = json.dumps('__GAP;')
+                else:
+                    reply = self.get_local_feed_reply(*feed_request)
+                    if reply is None:  # no new datasets of the requested station
+                        self.dataset_waiters.append((waiter, feed_request))
+                        continue
+                replies.append((waiter, reply))
+        for waiter, reply in replies:
+            waiter.send(reply)
+
+    def get_local_feed_reply(self, id_after, count, station=None):
+        """
+        Returns the datasets of the local feed following a cursor (same format as p_mode 21 of the database API). The
+        caller holds the dataset_waiters_lock
+        :param id_after: int - ID of the last dataset the consumer has processed
+        :param count: int - maximum number of datasets
+        :param station: str - only datasets of this station (None = all stations)
+        :return: str - reply (JSON; '__GAP;' if the feed does not hold all datasets following the cursor) | None if
+                 there are no new datasets yet
+        """
+        if not self.local_feed or id_after >= self.local_feed[-1][0]:
+            return None
+        if id_after < self.local_feed[0][1]:  # datasets saved before the feed started (or dropped from the feed)
+            return json.dumps('__GAP;')
+        datasets = [reply for id_dataset, _, reply in self.local_feed
+                    if id_dataset > id_after and (station is None or reply['station'] == station)][:count]
+        if not datasets:
+            return None
+        return json.dumps(['__SUCCESS;'] + datasets)
+
+    def get_write_batch_max_age(self):
+        """
+        Returns the maximum time datasets are batched: short while a consumer waits for new datasets (long-poll)
+        :param NONE: --
+        :return: float - seconds
+        """
+        with self.dataset_waiters_lock:
+            isWaiting = any(waiter.is_pending() for waiter, _ in self.dataset_waiters)
+        return min(WriteBatch_max_age_waiting, WriteBatch_max_age) if isWaiting else WriteBatch_max_age
+
+    def save_summaries(self):
+        """
+        Saves the summaries of completed periods (rolling aggregates) into the primary database. Summaries are not
+        spooled: they stay in memory (pending_summaries) until the database is available again
+        :param NONE: --
+        :return: bool - True if all pending summaries have been saved
+        """
+        with self.summaries_lock:
+            summaries = list(itertools.islice(self.pending_summaries, 0, SummaryBatch_max_count))
+        if not summaries:
+            return True
+        data = {
+                "p_mode": 18,
+                "p_summaries": json.dumps(summaries)
+               }
+        try:
+            resp_php = self.post_db_api(data).text  # send POST request
+        except Exception:
+            resp_php = str(traceback.format_exc())
+        if '__SUCCESS;' not in resp_php:
+            self.t_spool_last_failure = time.time()  # retry later (same back-off as the spool replay)
+            return False
+        with self.summaries_lock:
+            for _ in range(min(len(summaries), len(self.pending_summaries))):
+                self.pending_summaries.popleft()
+        return len(self.pending_summaries) == 0
+
+    def spool_sensor_datasets(self, datasets):
+        """
+        Appends datasets to the spool (on-disk journal) so they can be replayed later
+        :param datasets: list - datasets (dict) that have to be spooled
+        :return: --
+        """
+        try:
+            self.spool.append(datasets)
+            with self.write_queue_lock:
+                self.write_queue_stats['spooled'] += len(datasets)
+        except Exception:
+            with self.write_queue_lock:
+                self.write_queue_stats['dropped'] += len(datasets)
+            self.log_event('[- Warning -] Datasets could not be spooled and are lost! ' + str(traceback.format_exc()))
+
+    def is_spool_replay_pending(self):
+        """
+        Checks if spooled datasets are waiting and the last failed database request is long enough ago
+        :param NONE: --
+        :return: bool - True if the spool should be replayed now
+        """
+        if self.spool and self.spool.has_pending():
+            return (time.time() - self.t_spool_last_failure) > t_SpoolRetry
+        return False
+
+    def replay_spool(self):
+        """
+        Saves the oldest spooled datasets into the primary database (in order, SpoolReplay_batch datasets per request)
+        :param NONE: --
+        :return: --
+        """
+        try:
+            datasets, position = self.spool.read_pending(SpoolReplay_batch)
+            if not datasets or self.save_sensor_datasets(datasets):
+                self.spool.commit(position)
+                with self.write_queue_lock:
+                    self.write_queue_stats['replayed'] += len(datasets)
+                if not self.spool.has_pending():
+                    self.log_event('[CoSESServer] All spooled datasets have been replayed into the primary database.')
+        except Exception:
+            self.t_spool_last_failure = time.time()
+            self.log_event('[- Warning -] Failed to replay spooled datasets! ' + str(traceback.format_exc()))
+
+    def get_write_queue_stats(self):
+        """
+        Returns the statistics of the write queue (buffer between socket thread and primary database)
+        :param NONE: --
+        :return: dict - current depth and counters of the write queue
+        """
+        with self.write_queue_lock:
+            stats = dict(self.write_queue_stats)
+        stats['depth'] = self.write_queue.qsize()
+        stats['spool_pending'] = self.spool.pending if self.spool else 0
+        return stats
+
+    def init_metrics(self):
+        """
+        Creates the metrics of the server (served by the metrics endpoint, see CoSESMetrics). Values that are already
+        counted elsewhere (write queue, frame statistics) are read when the metrics are requested
+        :param NONE: --
+        :return: --
+        """
+        self.metrics = MetricsRegistry()
+        m = self.metrics
+        # Ingest
+        self.metric_samples_received = m.counter('cosesserver_samples_received_total',
+                                                 'Sensor data packages received from the stations', ('station',))
+        self.metric_samples_parsed = m.counter('cosesserver_samples_parsed_total',
+                                               'Sensor data packages parsed into samples', ('station',))
+        self.metric_invalid_readings = m.counter('cosesserver_invalid_readings_total',
+                                                 'Invalid sensor readings (9999.x, _ERR_SPN1_, status bits)',
+                                                 ('station', 'sensor'))
+        m.counter('cosesserver_frames_total', 'Frames received from the stations by result', ('result',),
+                  lambda: dict(((key,), value) for key, value in self.get_frame_stats().items()))
+        # Write queue and primary database
+        m.counter('cosesserver_datasets_persisted_total', 'Datasets saved into the primary database',
+                  callback=lambda: self.get_write_queue_stats()['written'])
+        m.counter('cosesserver_write_queue_datasets_total', 'Datasets handled by the write queue by event', ('event',),
+                  lambda: dict(((key,), value) for key, value in self.get_write_queue_stats().items()
+                               if key in ('enqueued', 'failed', 'dropped', 'spooled', 'replayed')))
+        m.gauge('cosesserver_write_queue_depth', 'Datasets waiting in the write queue',
+                callback=lambda: self.write_queue.qsize())
+        m.gauge('cosesserver_write_queue_max_depth', 'Maximum depth of the write queue since the start',
+                callback=lambda: self.get_write_queue_stats()['max_depth'])
+        m.gauge('cosesserver_spool_pending_datasets', 'Datasets waiting in the spool to be replayed',
+                callback=lambda: self.spool.pending if self.spool else 0)
+        m.gauge('cosesserver_summaries_pending', 'Summaries (rolling aggregates) waiting to be saved',
+                callback=lambda: len(self.pending_summaries))
+        self.metric_php_duration = m.histogram('cosesserver_php_request_duration_seconds',
+                                               'Latency of the requests to the database API', ('p_mode',))
+        self.metric_php_errors = m.counter('cosesserver_php_request_errors_total',
+                                           'Requests to the database API that failed (no reply)', ('p_mode',))
+        # Connections
+        self.metric_heartbeat_rtt = m.histogram('cosesserver_heartbeat_rtt_seconds',
+                                                'Round trip time of the HeartBeats', ('station',), HeartBeatRTT_buckets)
+        self.metric_heartbeats_missed = m.counter('cosesserver_heartbeats_missed_total',
+                                                  'HeartBeats left unanswered', ('station',))
+        self.metric_connections = m.counter('cosesserver_connections_total', 'Connections accepted from clients')
+        self.metric_connection_drops = m.counter('cosesserver_connection_drops_total',
+                                                 'Connections closed (by the client or the server)', ('station',))
+        m.gauge('cosesserver_clients_connected', 'Clients currently connected', callback=lambda: len(self.clients))
+        self.metric_revives = m.counter('cosesserver_revives_total', 'Restarts of the (software) server')
+        self.metric_reboots = m.counter('cosesserver_reboots_total', 'System reboots initiated by the server')
+
+    def start_metrics_server(self):
+        """
+        Starts the metrics endpoint (port and address in the [metrics] section of the CoSESWeather.ini)
+        :param NONE: --
+        :return: --
+        """
+        config = get_config(path_ini)
+        metrics_port = config.getint('metrics', 'server_port', Metrics_port)
+        if metrics_port <= 0:
+            return
+        try:  # not essential, the server keeps running without the endpoint
+            self.metrics_server = MetricsServer(self.metrics, metrics_port, config.get('metrics', 'bind', '127.0.0.1'))
+        except Exception:
+            self.log_event('[- Warning -] Metrics endpoint could not be started! ' + str(traceback.format_exc()))
+
+    def post_db_api(self, data, timeout=t_DatabaseRequestTimeout):
+        """
+        Sends a request to the database API (db_manager.php) and records its latency
+        :param data: dict - POST parameters (p_mode, ...)
+        :param timeout: float - timeout in seconds
+        :return: requests.Response (exceptions are passed on)
+        """
+        t_start = time.time()
+        try:
+            return requests.post(self.php_path, data=data, timeout=timeout)
+        except Exception:
+            self.metric_php_errors.labels(data['p_mode']).inc()
+            raise
+        finally:
+            self.metric_php_duration.labels(data['p_mode']).observe(time.time() - t_start)
+
+    def acknowledge_admin_command(self, command_id):
+        """
+        Marks an admin command as processed in the admin log (it will not be returned by the database API again)
+        :param command_id: int - ID of the command (admin_log)
+        :return: bool - True if the command has been acknowledged
+        """
+        data_php = {"p_mode": 20, "a_id": command_id}
+        try:
+            resp_php = self.post_db_api(data_php).text
+        except Exception:
+            resp_php = str(traceback.format_exc())
+        if '__SUCCESS;' not in resp_php:
+            self.log_event('[- Warning -] Admin command could not be acknowledged! PHP Script returned: ' + resp_php)
+            return False
+        return True
 
-    def send_command(self, cmd):
+    def send_command(self, cmd, station_id=None):
         """
-        Sends a command to the client
+        Sends a command to the clients
         :param cmd: str - 'a' = reset microprocessor | '#' = HEARTBEAT
+        :param station_id: str - send the command only to this station (None = all connected stations)
         :return: --
         """
         try:
             if self.threadRunning and self.isConnected:
-                self.conn.send(cmd)
-                print('[Info]: Command sent. (cmd: ' + cmd + ')')
+                with self.clients_lock:
+                    clients = [client for client in self.clients.values()
+                               if station_id is None or client.station_id == station_id]
+                for client in clients:
+                    self.send_to_client(client, cmd)
+                if clients:
+                    print('[Info]: Command sent. (cmd: ' + cmd + ')')
+                else:
+                    print('[CMD_WARNING]: Station ' + str(station_id) + ' not connected!')
             elif not self.isConnected and self.threadRunning:
                 print('[CMD_WARNING]: No client currently connected!')
             else:
@@ -478,27 +1670,106 @@ class RevPiServerClass:
         except Exception:
             pass
 
+    def send_to_client(self, client, cmd):
+        """
+        Sends a command to a client. If the connection has failed (e.g. EPIPE, ECONNRESET or EAGAIN), only this client is
+        dropped (it will reconnect after its restart), the other stations stay connected
+        :param client: ClientConnection
+        :param cmd: str - command
+        :return: bool - True if the command has been sent
+        """
+        try:
+            client.conn.send(cmd)
+            return True
+        except socket.error:
+            self.log_event('[Traceback_5] ' + str(traceback.format_exc()), False)
+            if self.drop_client:  # called by the server thread (the connection is closed by its event loop)
+                self.drop_client(client, '[CoSESServer] Failed to send to station ' + client.station_id +
+                                 '. Closing connection ...')
+            return False
+
+    def add_client(self, client):
+        """
+        Registers a newly connected client
+        :param client: ClientConnection
+        :return: --
+        """
+        with self.clients_lock:
+            self.clients[client.conn.fileno()] = client
+            self.isConnected = True
+
+    def remove_client(self, client):
+        """
+        Closes the connection to a client and removes it from the connected clients
+        :param client: ClientConnection
+        :return: --
+        """
+        with self.clients_lock:
+            for fd, connected_client in self.clients.items():
+                if connected_client is client:
+                    del self.clients[fd]
+            self.isConnected = bool(self.clients)
+        try:
+            client.conn.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        client.conn.close()
+
+    def set_client_protocol(self, client, protocol):
+        """
+        Handles the request of a client to switch to another protocol. Requests are confirmed by a command, otherwise
+        the client keeps sending text packages
+        :param client: ClientConnection
+        :param protocol: str - requested protocol
+        :return: --
+        """
+        if protocol == BINARY_PROTOCOL and BinaryProtocol_enabled:
+            if not isinstance(client.framer, BinaryFramer):
+                framer = BinaryFramer()
+                framer.buffer = client.framer.buffer  # keep data that has already been received
+                client.framer = framer
+            if self.send_to_client(client, CMD_BINARY_PROTOCOL_ACK):
+                self.log_event('[CoSESServer] Station ' + client.station_id + ' switched to binary protocol.')
+        else:
+            self.log_event('[- Warning -] Station ' + client.station_id + ' requested unsupported protocol: ' +
+                           repr(protocol) + '. Using text protocol.')
+
+    def set_client_station(self, client, station_id):
+        """
+        Assigns the station ID announced by a client to its connection
+        :param client: ClientConnection
+        :param station_id: str - announced station ID
+        :return: --
+        """
+        if not station_id or len(station_id) > StationID_max_length or \
+                [c for c in station_id if c not in StationID_valid_chars]:
+            self.log_event('[- Warning -] Client ' + str(client.addr) + ' announced an invalid station ID: ' +
+                           repr(station_id) + '. Using ' + client.station_id + '.')
+            return
+        with self.clients_lock:
+            duplicate = [c for c in self.clients.values() if c is not client and c.station_id == station_id]
+        if duplicate:
+            self.log_event('[- Warning -] Station ID ' + station_id + ' is used by more than one client!')
+        client.station_id = station_id
+        self.log_event('[CoSESServer] Client ' + str(client.addr) + ' identified as station ' + station_id + '.')
+
     def close_connection(self):
         """
-        Closes a connection and the socket in a clean and controlled way
+        Closes all connections and the socket in a clean and controlled way
         :param NONE: --
         :return: --
         """
         if not self.isConnectionClosing:  # Avoid multiple execution
             self.isConnectionClosing = True
             self.threadRunning = False
-            try:
-                self.conn.shutdown(socket.SHUT_RDWR)
-            except Exception:
-                pass
-            if self.conn:
-                self.conn.close()
-            self.conn = None
+            with self.clients_lock:
+                clients = self.clients.values()
+            for client in clients:
+                self.remove_client(client)
+            if self.s:
+                self.s.close()  # release the listening socket (port will be bound again on revive)
             self.s = None
             self.isConnected = False
-            # Reset variables and counters
-            self.HeartBeatValid = True
-            self.missedHeartBeats = 0
             self.log_event('[CoSESServer] Server closed the connection.')
 
     def revive_connection(self):
@@ -507,6 +1778,7 @@ class RevPiServerClass:
         :param NONE: --
         :return: --
         """
+        self.metric_revives.inc()
         self.ReviveConnection = True
 
     def restart_system(self):
@@ -516,12 +1788,18 @@ class RevPiServerClass:
         :return: --
         """
         self.isServerRestarting = True
+        self.metric_reboots.inc()
         self.log_event('[CoSESServer] Initiating system reboot ...')
         # Create local file so system knows there just has been a restart in order to fix issues before
         self.generate_status_file('Restart triggered by system')
         # wait and trigger restart
+        self.notifier.flush()  # send the pending notifications first
         time.sleep(5)
-        subprocess.call(['shutdown', '-r', 'now'])  # Restart RevPi (call = blocking)
+        self.flush_log()
+        try:
+            self.system.request_reboot()  # Restart RevPi
+        except Exception:
+            self.log_event('[- ERROR -] System reboot failed! ' + str(traceback.format_exc()))
 
     def generate_status_file(self, reason):
         """
@@ -575,8 +1853,10 @@ class RevPiServerClass:
         """
         try:
             file_path = self.read_ini('config', 'path_status_file')  # Get path from .ini file
-            with open(file_path, 'r') as file_r:  # read status file and check the last line
-                lastLine = list(file_r)[-1]
+            with open(file_path, 'r') as file_r:  # read status file and check the last line (only the end of the file)
+                file_r.seek(0, os.SEEK_END)
+                file_r.seek(max(0, file_r.tell() - 512))
+                lastLine = file_r.read().splitlines()[-1]
             date_log = lastLine[1:20]  # extract the timestamp of the log line
             day_of_month_CURRENT = int(time.strftime("%d", time.localtime()))
             day_of_month_LOG = int(datetime.datetime.strptime(date_log, "%d.%m.%Y|%H:%M:%S").day)
@@ -587,41 +1867,54 @@ class RevPiServerClass:
         except Exception:
             return True
 
-    def log_event(self, msg, push=True):
+    def log_event(self, msg, push=True, level=None):
         """
-        Appends an event into the logfile and prints to the server terminal
+        Appends an event to the log. The entry is handed over to the LogWriterThread that writes it into the logfile
+        and prints it to the server terminal (never blocks the calling thread)
         :param msg: str - The message that has to be logged
-        :param push: bool - If True, appended messages will be written to the logfile
-        :return: --
-        """
-        def _write_to_file(inst):
-            f = open(inst.log_path, 'a+')  # open file in append mode
-            for log_i in inst.log_list:
-                f.write(log_i + '\n')
-                print(log_i)
-            f.close()
-            del inst.log_list[:]
-
-        def _create_new_header(inst, msg_temp):
-            inst.log_list.append('---------------------------------------------------------------------------')
-            inst.log_list.append('--------------------- CoSESServer Log -------------------------------------')
-            inst.log_list.append('---------------------------------------------------------------------------')
-            inst.log_list.append(msg_temp)
-            _write_to_file(inst)
-
-        msg_tmp = '[' + time.strftime("%d.%m.%Y|%H:%M:%S", time.localtime()) + ']' + msg
-        if push:  # If write mode TRUE: log list will be written into file
-            self.log_path = self.read_ini('config', 'path_log')  # check log file path
-            if not os.path.isfile(self.log_path):  # If no log file exists yet, create a header for log file (initial)
-                _create_new_header(self, msg_tmp)
-            else:  # log file already exists, just append new logs to old log file
-                self.log_list.append(msg_tmp)
-                _write_to_file(self)
-        else:  # If write mode FLASE: only append to log list, but do not write to file
-            if not os.path.isfile(self.log_path):  # If not log file exists yet
-                _create_new_header(self, msg_tmp)
-            else:  # If log file already exists
-                self.log_list.append(msg_tmp)
+        :param push: bool - If True, the entry (and all entries appended before) will be written to the logfile now
+        :param level: int - LOG_DEBUG | LOG_INFO | LOG_WARNING | LOG_ERROR (default: derived from the message prefix)
+        :return: --
+        """
+        if level is None:
+            if msg.startswith(('[- ERROR', '[ERROR', '[Traceback', '[FATAL')):
+                level = LOG_ERROR
+            elif msg.startswith('[- Warning'):
+                level = LOG_WARNING
+            else:
+                level = LOG_INFO
+        if level < Log_level:
+            return
+        msg_tmp = '[' + time.strftime(LOG_TIME_FORMAT, time.localtime()) + ']' + msg
+        try:
+            self.log_queue.put_nowait((msg_tmp, push))
+        except Queue.Full:
+            with self.log_dropped_lock:
+                self.log_dropped += 1
+
+    def get_dropped_log_entries(self):
+        """
+        Returns (and resets) the number of log entries dropped because the log queue was full
+        :param NONE: --
+        :return: int - number of dropped entries
+        """
+        with self.log_dropped_lock:
+            dropped, self.log_dropped = self.log_dropped, 0
+        return dropped
+
+    def flush_log(self, timeout=5):
+        """
+        Waits until all log entries appended so far have been written (e.g. before the process exits)
+        :param timeout: float - maximum time to wait in seconds
+        :return: bool - True if the entries have been written
+        """
+        event = threading.Event()
+        try:
+            self.log_queue.put(event, True, timeout)
+        except Queue.Full:
+            return False
+        event.wait(timeout)
+        return event.is_set()
 
     def reset_watchdog_timer(self):
         """
@@ -629,8 +1922,28 @@ class RevPiServerClass:
         :param NONE: --
         :return: --
         """
-        script_path = self.read_ini('bash_paths', 'path_revpi_watchdog')  # Get script path from .ini file
-        subprocess.Popen(["bash", script_path])  # reset watchdog timer (using the bash-script) (Popen = nonblocking)
+        try:
+            self.system.kick_watchdog()  # direct access to the process image (no helper process)
+            if self.isWatchdogFailing:
+                self.isWatchdogFailing = False
+                self.log_event('[CoSESServer] Hardware watchdog reset again.')
+        except Exception:
+            if not self.isWatchdogFailing:  # only log once until the watchdog can be reset again
+                self.isWatchdogFailing = True
+                self.log_event('[- Warning -] Hardware watchdog could not be reset! ' + str(traceback.format_exc()))
+
+    def acquire_pidfile(self):
+        """
+        Creates the pid file (path_pidfile) that tells other processes (e.g. CoSESServerManager.sh) that the
+        CoSESServer is running
+        :param NONE: --
+        :return: bool - False if another CoSESServer process is already running
+        """
+        try:
+            return self.pidfile.acquire()
+        except (OSError, IOError):
+            self.log_event('[- Warning -] Pid file could not be created! ' + str(traceback.format_exc()))
+            return True
 
     def getDB_user_emails(self):
         """
@@ -640,11 +1953,14 @@ class RevPiServerClass:
         """
         data_php = {"p_mode": 3}
         # Requesting emails from user database
-        php_response = requests.post(self.php_path, data=data_php)
+        try:
+            php_response = self.post_db_api(data_php)
+        except Exception:
+            php_response = None
         try:
             php_response = php_response.json()
         except Exception:
-            php_response = php_response.text
+            php_response = getattr(php_response, 'text', php_response)
 
         try:  # ok?
             if '__SUCCESS;' in php_response[0]:  # valid php response returned by MySQL user database
@@ -662,39 +1978,12 @@ class RevPiServerClass:
 
     def send_notification(self, msg):
         """
-        Send an email notification
+        Send an email notification. The message is handed over to the NotificationDispatcher (CoSESNotifier) that
+        coalesces alerts into digests, suppresses repeated alerts and sends the emails in the background
         :param msg: str - The message to be sent via email
         :return: --
         """
-        def _send(inst, message):
-            email_list = inst.getDB_user_emails()
-            mail_content = '[' + time.strftime("%d.%m.%Y|%H:%M:%S", time.localtime()) + ']' + message
-            mail_subject = '[CoSESWeather]Warning: Faulty Behaviour detected!'
-            try:  # database returned updated contact/email list
-                if email_list[0]:  # if there are mail addresses in database
-                    for mail in email_list:
-                        process = subprocess.Popen(['mail', '-s', str(mail_subject), str(mail)], stdin=subprocess.PIPE) # Send email notification
-                        process.communicate(str(mail_content))  # Using PIPE to inject message body into the unix-process
-                    inst.log_event('[CoSESServer] Notification sent to system administrators.')
-            except Exception:  # database did not reply - get emails out of notification file directly
-                try:
-                    f = open(path_contacts, 'r')  # read notification.txt file
-                    email_list = f.readlines()
-                    f.close()
-                    if email_list:  # if there are mail addresses in .txt file
-                        for mail in email_list:
-                            process = subprocess.Popen(['mail', '-s', str(mail_subject), str(mail)], stdin=subprocess.PIPE)  # Send email notification
-                            process.communicate(str(mail_content))  # Using PIPE to inject message body into the unix-process
-                        inst.log_event('[CoSESServer] Notification sent to system administrators.')
-                except Exception:
-                    pass
-
-        if not self.check_status_file():  # If no status file exists, send notification
-            _send(self, msg)
-        else:  # If status file exists, only send one notification per day (to prevent notification spamming)
-            if self.check_status_file_date():
-                _send(self, msg + ' This is a repeating message. The system is still not running properly. '
-                                  'Please look into it as soon as possible.')
+        self.notifier.notify(msg)
 
     def update_notification_file(self):
         """
@@ -715,15 +2004,14 @@ class RevPiServerClass:
 
     def read_ini(self, section, value):
         """
-        Read the CoSESWeather.ini to extract paths to files
+        Read the CoSESWeather.ini to extract paths to files (the file is parsed once and kept in memory, changes are
+        reloaded automatically - see CoSESConfig)
         :param section: str - Desired section that should be extracted from the .ini file
         :param value: str - Desired value that should be extracted from the .ini file
         :return data_out: str - requested value
         """
         try:
-            config = ConfigParser.ConfigParser()
-            config.read(path_ini)
-            data_out = config.get(section, value)
+            data_out = get_config(path_ini).get(section, value)
             return data_out
         except Exception:
             message = 'Failed. CoSESWeather.ini file missing! Please make sure the file exists and is in the ' \
@@ -738,23 +2026,70 @@ class RevPiServerClass:
         """
         msg = '[- ERROR -] ' + message
         self.log_event(msg)
+        self.flush_log()
         sys.exit(0)
 
 
-if __name__ == '__main__':
-    INSTANCE_MAIN = RevPiServerClass()
-    INSTANCE_MAIN.start_server()
-
-
-
-
-
-
-
-
+def get_replay_path(path):
+    """
+    Returns the path of a file used by a replay instead of the file of the running server (e.g. spool_replay)
+    :param path: str - path of the file (or directory) of the server
+    :return: str - path used by the replay
+    """
+    return '_replay'.join(os.path.splitext(path))
 
 
+def reload_config(signum, frame):
+    """
+    SIGHUP handler: the CoSESWeather.ini will be reloaded on the next lookup
+    """
+    get_config(path_ini).request_reload()
 
 
+def parse_arguments(argv=None):
+    """
+    Parses the command line arguments
+    :param argv: list - arguments (None = sys.argv)
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='CoSESServer ' + version + '. Without arguments the server is '
+                                                 'launched. With --replay, captured frames (see CoSESCapture.py) are '
+                                                 'saved into the primary database instead (the server may keep '
+                                                 'running).')
+    parser.add_argument('--replay', nargs='+', metavar='PATH',
+                        help='capture files or directories (e.g. path_packet_capture) to replay, oldest first')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='replay rate relative to real time, e.g. 60 = one hour per minute (default: 0 = as fast '
+                             'as possible)')
+    parser.add_argument('--start', type=float, default=None,
+                        help='only replay frames that arrived at or after this time (Unix timestamp)')
+    parser.add_argument('--end', type=float, default=None,
+                        help='only replay frames that arrived at or before this time (Unix timestamp)')
+    return parser.parse_args(argv)
 
 
+if __name__ == '__main__':
+    ARGS = parse_arguments()
+    if ARGS.replay:
+        INSTANCE_MAIN = RevPiServerClass(isReplay=True)
+        paths = []
+        for path in ARGS.replay:
+            paths.extend(list_capture_files(path) if os.path.isdir(path) else [path])
+        INSTANCE_MAIN.log_event('[CoSESServer] Replaying ' + str(len(paths)) + ' capture file(s) ...')
+        stats = INSTANCE_MAIN.replay_capture(paths, ARGS.speed, ARGS.start, ARGS.end)
+        queue_stats = INSTANCE_MAIN.get_write_queue_stats()
+        INSTANCE_MAIN.log_event('[CoSESServer] Replay finished: frames=' + str(stats['frames']) + ' samples=' +
+                                str(stats['samples']) + ' dropped=' + str(stats['dropped']) + ' written=' +
+                                str(queue_stats['written']) + ' spooled=' + str(queue_stats['spool_pending']) +
+                                ' duration=%.1fs rate=%.0f samples/s parse=%.1fus/sample' %
+                                (stats['t_total'], stats['samples'] / max(stats['t_total'], 1e-6),
+                                 stats['t_parse'] * 1e6 / max(stats['samples'], 1)))
+        INSTANCE_MAIN.flush_log()
+        # background threads (database writer, notifications) are not needed anymore
+        os._exit(0 if stats['complete'] else 1)  # 1 = datasets left unsaved
+    else:
+        INSTANCE_MAIN = RevPiServerClass()
+        INSTANCE_MAIN.start_server()
+        signal.signal(signal.SIGHUP, reload_config)  # e.g. 'kill -HUP <pid>' after editing the CoSESWeather.ini
+        while True:
+            signal.pause()  # keep the main thread alive: signal handlers are only run by the main thread
@@ -27,6 +27,23 @@ function check_status_file_func()
 }
 
 
+# this function checks if the CoSESServer is running: the process ID written into the pid file by the CoSESServer
+# is checked with kill -0 (shell builtins only, no need to search the process list)
+function is_server_running_func()
+{
+	# read path from .ini: 'path_pidfile' from section [config]
+	remove_substring4="path_pidfile="
+	path_pidfile=$(grep -F $remove_substring4 $mse_ini_path)
+	path_pidfile=${path_pidfile/$remove_substring4/""}
+	
+	if [ -f "$path_pidfile" ] && read server_pid < "$path_pidfile" && [ "$server_pid" ] && kill -0 "$server_pid" 2>/dev/null; then
+		return 0 # running
+	else
+		return 1 # not running
+	fi
+}
+
+
 if [[ $# -eq 0 || $# -gt 2 ]] # check if provided arguments are valid
 then
 	echo "[ERROR] Please provide valid arguments! Arguments: [path to CoSESWeather.ini][only for crontab: 0=do not notify | 1=notify]"
@@ -68,7 +85,7 @@ else
 							else # root
 								echo "[Info] User is admin."
 								# check if CoSESServer is running
-								if [[ $(pgrep -a python | grep 'CoSESServer.py') ]]; then
+								if is_server_running_func; then
 									echo "[Info] CoSESServer is already running."
 								else
 									echo "[Info] Starting CoSESServer ..."
@@ -111,7 +128,7 @@ else
 								fi	
 							else # root
 								# check if CoSESServer is running
-								if [[ $(pgrep -a python | grep 'CoSESServer.py') ]]; then # Script is running, do nothing
+								if is_server_running_func; then # Script is running, do nothing
 									:
 								else # Script is not running	
 									if [ $2 -eq 1 ]; then # If arg2=1 (notify via email)
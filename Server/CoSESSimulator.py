@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESSimulator.py simulates CONTROLLINOs (weather stations) so the CoSESServer can be load-tested without the physical
+hardware. Every simulated station speaks the protocol of the CoSESClient.ino: it announces its station ID, sends sensor
+data packages (text or binary frames), buffers samples while the connection is lost, replies to HeartBeats ('#') and
+restarts on the reset command ('a'). Sample rate, number of stations, jitter, bursts, disconnects and sensor error
+codes can be configured.
+A stand-in for the database API (db_manager.php) receives the datasets saved by the server, so throughput and latency
+can be measured on any machine. With --launch-server a CoSESServer is started in the same process (temporary
+CoSESWeather.ini pointing to the stand-in), otherwise the running server has to use the stand-in as link_db_api.
+
+Example: python CoSESSimulator.py --launch-server --stations 8 --sample-rate 0.2 --duration 120
+"""
+
+import os
+import sys
+import math
+import json
+import time
+import random
+import select
+import socket
+import argparse
+import tempfile
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from collections import deque
+from CoSESFraming import BINARY_SYNC, BINARY_VERSION, BINARY_HEADER, BINARY_PAYLOAD, BINARY_CHECKSUM, \
+    BINARY_PROTOCOL, SequenceHeader_separator, fletcher16
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+# Protocol of the CoSESClient.ino
+CMD_HeartBeat_char = '#'
+CMD_RESET_CONTROLLINO = 'a'
+CMD_BINARY_PROTOCOL_ACK = 'B'
+HeartBeat_reply = '*'
+LINE_END = '\n\r\n'  # client_eth.println(x + "\n")
+SENSOR_ERROR_CODES = {'pt100': 9999.1, 'cmp3_1': 9999.21, 'cmp3_2': 9999.22, 'cmp3_3': 9999.23, 'spn1': None}
+SENSOR_ERROR_STATUS = {'pt100': 0x02, 'cmp3_1': 0x20, 'cmp3_2': 0x40, 'cmp3_3': 0x80, 'spn1': 0x1c}
+
+# Defaults
+SENSOR_SAMPLE_RATE = 5.0  # seconds (SENSOR_SAMPLE_RATE_MSEC of the CONTROLLINO)
+SAMPLE_BUFFER_SIZE = 48  # samples buffered while the connection is lost (SAMPLE_BUFFER_SIZE of the CONTROLLINO)
+SAMPLE_RESEND_COUNT = 3  # samples sent again after a reconnect (SAMPLE_RESEND_COUNT of the CONTROLLINO)
+t_RESTART = 8.0  # time a CONTROLLINO needs to restart and reconnect after a reset (seconds)
+API_PORT = 8785
+
+
+def generate_readings(t, rng, error_rate, errors):
+    """
+    Generates plausible sensor readings (daily course of temperature and irradiation plus noise)
+    :param t: float - capture time
+    :param rng: random.Random
+    :param error_rate: float - probability that a sensor returns an error code
+    :param errors: list - sensors that may fail (keys of SENSOR_ERROR_CODES)
+    :return: tuple - values (8 floats in the order of the binary frame), status (bits of invalid values), failed sensors
+    """
+    day = (t % 86400) / 86400.0
+    sun = max(0.0, math.sin((day - 0.25) * 2 * math.pi))
+    rad_tot = 900.0 * sun * rng.uniform(0.9, 1.0)
+    values = [max(0.0, rng.gauss(3.0, 1.5)),  # wind
+              10.0 + 8.0 * sun + rng.gauss(0, 0.2),  # temp
+              rad_tot,  # spn1_radTot
+              rad_tot * rng.uniform(0.1, 0.4),  # spn1_radDiff
+              1.0 if rad_tot > 120 else 0.0]  # spn1_sun
+    values += [rad_tot * rng.uniform(0.95, 1.05) for _ in range(3)]  # rad_cmp1..3
+    status = 0
+    failed = []
+    for sensor in errors:
+        if rng.random() < error_rate:
+            failed.append(sensor)
+            status |= SENSOR_ERROR_STATUS[sensor]
+            if sensor == 'pt100':
+                values[1] = SENSOR_ERROR_CODES[sensor]
+            elif sensor.startswith('cmp3'):
+                values[4 + int(sensor[-1])] = SENSOR_ERROR_CODES[sensor]
+            else:
+                values[2] = values[3] = values[4] = 0.0
+    return values, status, failed
+
+
+def format_text_package(values, failed, seq=None, t_millis=None):
+    """
+    Formats a sensor data package like the CONTROLLINO (String(float) = 2 decimals)
+    :param values: list - values (see generate_readings)
+    :param failed: list - failed sensors
+    :param seq: int - sequence number (None = package of an older client without header)
+    :param t_millis: int - client time in ms (millis())
+    :return: str - package including the line end
+    """
+    spn1 = '_ERR_SPN1_' if 'spn1' in failed else '%.2f,%.2f,%d' % (values[2], values[3], values[4])
+    fields = ['%.2f' % values[0], '%.2f' % values[1], spn1] + ['%.2f' % value for value in values[5:]]
+    header = '' if seq is None else '%d,%d%s' % (seq & 0xffff, t_millis & 0xffffffff, SequenceHeader_separator)
+    return header + '|'.join(fields) + LINE_END
+
+
+def format_binary_frame(seq, t_millis, values, status):
+    """
+    Builds a binary sensor frame like sendSensorDataFrame() of the CONTROLLINO
+    :param seq: int - sequence number
+    :param t_millis: int - client time in ms (millis())
+    :param values: list - values (see generate_readings)
+    :param status: int - bits of invalid values
+    :return: str - frame
+    """
+    payload = BINARY_PAYLOAD.pack(seq & 0xffff, t_millis & 0xffffffff, status, *values)
+    header = BINARY_HEADER.pack(BINARY_SYNC, BINARY_VERSION, len(payload))
+    return header + payload + BINARY_CHECKSUM.pack(fletcher16(header[2:] + payload))  # checksum without sync bytes
+
+
+class SimulationStats:
+    """
+    Counters of all simulated stations
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(('sent', 'errors', 'heartbeats', 'heartbeats_ignored', 'resets', 'disconnects',
+                                       'connects', 'connect_failures', 'bursts', 'overflows'), 0)
+
+    def inc(self, counter, count=1):
+        with self.lock:
+            self.counters[counter] += count
+
+    def get(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+class SimulatedStation(threading.Thread):
+    """
+    One CONTROLLINO: connects to the server, sends sensor data and reacts to commands. Samples are buffered while the
+    connection is lost and sent after reconnecting (the last samples sent before are sent again), like the
+    CoSESClient.ino. With --legacy-text the station behaves like an older client (text packages without sequence
+    number and sampling time, samples taken while disconnected are lost)
+    """
+    def __init__(self, station_id, options, stats, seed):
+        """
+        :param station_id: str - announced station ID
+        :param options: argparse.Namespace - simulation options (see main)
+        :param stats: SimulationStats
+        :param seed: int - seed of the random generator (reproducible runs)
+        """
+        threading.Thread.__init__(self, name='station-' + station_id)
+        self.daemon = True
+        self.station_id = station_id
+        self.options = options
+        self.stats = stats
+        self.rng = random.Random(seed)
+        self.isRunning = True
+        self.isReset = False
+        self.sock = None
+        self.seq = 0
+        self.t_boot = time.time()  # millis() start at the (re)start of the CONTROLLINO
+        self.t_next = None  # time of the next sample
+        self.buffer = deque(maxlen=options.buffer_size)  # samples that have not been sent yet
+        self.sent = deque(maxlen=SAMPLE_RESEND_COUNT)  # last samples sent (sent again after a reconnect)
+
+    def stop(self):
+        self.isRunning = False
+
+    def run(self):
+        time.sleep(self.rng.uniform(0, self.options.sample_rate))  # stations do not start in lockstep
+        self.t_next = time.time() + self.options.sample_rate
+        while self.isRunning:
+            try:
+                self.sock = socket.create_connection((self.options.host, self.options.port), 5)
+            except socket.error:
+                self.stats.inc('connect_failures')
+                self._sample_offline(time.time() + self.options.restart_delay)
+                continue
+            self.stats.inc('connects')
+            try:
+                restart_delay = self._session()
+            except socket.error:  # connection closed by the server
+                self.stats.inc('disconnects')
+                restart_delay = self.options.restart_delay
+            self.sock.close()
+            if self.isReset:  # restart: samples, sequence number and millis() start again
+                self.isReset = False
+                self.buffer.clear()
+                self.sent.clear()
+                self.seq = 0
+                self.t_boot = time.time() + t_RESTART
+                time.sleep(t_RESTART)
+                self.t_next = time.time() + self.options.sample_rate
+            elif self.isRunning:
+                self._sample_offline(time.time() + restart_delay)
+
+    def _take_sample(self):
+        # Takes the sample that is due and appends it to the buffer
+        options = self.options
+        t_now = time.time()
+        self.t_next += options.sample_rate * (1 + self.rng.uniform(-options.jitter, options.jitter))
+        values, status, failed = generate_readings(t_now, self.rng, options.error_rate, options.errors)
+        self.stats.inc('sent')
+        if failed:
+            self.stats.inc('errors')
+        if len(self.buffer) == self.buffer.maxlen:
+            self.stats.inc('overflows')
+        self.buffer.append((self.seq & 0xffff, int((t_now - self.t_boot) * 1000), values, status, failed))
+        self.seq += 1
+
+    def _sample_offline(self, t_until):
+        # Keeps sampling while the connection is lost (samples of older clients are lost)
+        while self.isRunning and time.time() < t_until:
+            time.sleep(max(0.0, min(self.t_next, t_until) - time.time()))
+            if time.time() >= self.t_next:
+                self._take_sample()
+                if self.options.legacy_text:
+                    self.buffer.clear()
+
+    def _format_sample(self, sample, isBinary):
+        seq, t_millis, values, status, failed = sample
+        if isBinary:
+            return format_binary_frame(seq, t_millis, values, status)
+        elif self.options.legacy_text:
+            return format_text_package(values, failed)
+        return format_text_package(values, failed, seq, t_millis)
+
+    def _session(self):
+        # Runs one connection (like setup() and loop() of the CONTROLLINO), returns the restart delay
+        options = self.options
+        isBinary = False
+        self.sock.sendall('@' + self.station_id + LINE_END)
+        if options.binary:
+            self.sock.sendall('%' + BINARY_PROTOCOL + LINE_END)
+        if options.legacy_text:  # older clients lose the samples that have not been sent
+            self.buffer.clear()
+        else:  # the last samples sent might not have reached the server
+            self.buffer = deque(list(self.sent) + list(self.buffer), self.buffer.maxlen)
+            self.sent.clear()
+        burst_length = 0
+        while self.isRunning:
+            readable = select.select([self.sock], [], [], max(0.0, self.t_next - time.time()))[0]
+            if readable:
+                data = self.sock.recv(1024)
+                if not data:
+                    self.stats.inc('disconnects')
+                    return options.restart_delay
+                for char in data:
+                    if char == CMD_HeartBeat_char:
+                        if self.rng.random() < options.heartbeat_ignore_rate:
+                            self.stats.inc('heartbeats_ignored')
+                        else:
+                            if options.heartbeat_delay:
+                                time.sleep(options.heartbeat_delay)
+                            self.sock.sendall(HeartBeat_reply + LINE_END)
+                            self.stats.inc('heartbeats')
+                    elif char == CMD_RESET_CONTROLLINO:  # restart: close the socket, reconnect after the reboot
+                        self.stats.inc('resets')
+                        self.isReset = True
+                        return t_RESTART
+                    elif char == CMD_BINARY_PROTOCOL_ACK:
+                        isBinary = True
+            if time.time() < self.t_next:
+                continue
+            self._take_sample()
+            if not burst_length and self.rng.random() < options.burst_rate:  # link problem: hold back samples
+                burst_length = self.rng.randint(2, options.burst_max)
+                self.stats.inc('bursts')
+            if not burst_length or len(self.buffer) >= burst_length:  # link recovered: everything arrives at once
+                burst_length = 0
+                self.sock.sendall(''.join(self._format_sample(sample, isBinary) for sample in self.buffer))
+                self.sent.extend(self.buffer)
+                self.buffer.clear()
+            if self.rng.random() < options.disconnect_rate:  # connection lost (e.g. cable), no clean shutdown
+                self.stats.inc('disconnects')
+                return options.restart_delay
+        return 0
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _ApiRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = dict((key, values[-1]) for key, values in urlparse.parse_qs(self.rfile.read(length)).items())
+        body = self.server.api.handle(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DatabaseApiStandIn:
+    """
+    Stand-in for the database API (db_manager.php) as used by the CoSESServer. Saved datasets are only counted (the
+    CoSESBenchmark extends this with a database)
+    """
+    def __init__(self, port=API_PORT, delay=0.0, failure_rate=0.0, host='127.0.0.1'):
+        """
+        :param port: int - HTTP port
+        :param delay: float - every request takes at least this long (seconds, simulates a slow database)
+        :param failure_rate: float - probability that saving datasets fails
+        :param host: str - address to bind to
+        """
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.rng = random.Random(0)
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(('requests', 'datasets', 'samples', 'failures'), 0)
+        self.latencies = []  # age of the saved datasets when they reached the database API (seconds)
+        self.httpd = _ThreadingHTTPServer((host, port), _ApiRequestHandler)
+        self.httpd.api = self
+        self.url = 'http://%s:%d/db_manager.php' % (host, self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle(self, data):
+        """
+        Answers a request like the database API
+        :param data: dict - POST parameters
+        :return: str - reply
+        """
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.counters['requests'] += 1
+        p_mode = int(data.get('p_mode', 0))
+        if p_mode == 3:  # emails of the admins
+            return json.dumps(['__SUCCESS;'])
+        elif p_mode == 14:  # admin commands
+            return json.dumps('_NO_COMMANDS;')
+        elif p_mode == 16:  # save datasets
+            if self.failure_rate and self.rng.random() < self.failure_rate:
+                with self.lock:
+                    self.counters['failures'] += 1
+                return '[ERROR_sim] Simulated database failure!'
+            datasets = json.loads(data['p_datasets'])
+            ids = self.store(datasets)
+            t_now = time.time()
+            with self.lock:
+                self.counters['datasets'] += len(datasets)
+                self.counters['samples'] += sum(int(dataset.get('samples', 1)) for dataset in datasets)
+                self.latencies.extend(t_now - float(dataset['t_unix']) for dataset in datasets)
+            return '__SUCCESS;%d;%s' % (ids[0], ','.join(str(i) for i in ids[1])) if ids else '__SUCCESS;'
+        return self.handle_other(p_mode, data)
+
+    def store(self, datasets):
+        """
+        Saves datasets (the stand-in only counts them)
+        :param datasets: list - datasets (dict)
+        :return: tuple - ID of the newest dataset before, IDs of the saved datasets (None = no IDs)
+        """
+        return None
+
+    def handle_other(self, p_mode, data):
+        """
+        Answers all other requests (summaries, acknowledgements, ...)
+        :param p_mode: int - requested function
+        :param data: dict - POST parameters
+        :return: str - reply
+        """
+        return '__SUCCESS;'
+
+    def get(self):
+        """
+        Returns the counters and the latencies received so far
+        :param NONE: --
+        :return: tuple - counters (dict), latencies (list)
+        """
+        with self.lock:
+            return dict(self.counters), list(self.latencies)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def percentile(values, p):
+    """
+    Returns a percentile (nearest rank)
+    :param values: list - values
+    :param p: float - percentile (0 - 100)
+    :return: float - value (None if there are no values)
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(math.ceil(p / 100.0 * len(values))) - 1))]
+
+
+def write_ini(api_url, workdir):
+    """
+    Writes a CoSESWeather.ini for a simulation: database API stand-in, all files in workdir, no watchdog, no reboot,
+    no emails and no metrics endpoints
+    :param api_url: str - URL of the database API stand-in
+    :param workdir: str - directory for the files of the server and the driver
+    :return: str - path of the CoSESWeather.ini
+    """
+    path_ini = os.path.join(workdir, 'CoSESWeather.ini')
+    with open(path_ini, 'w') as f:
+        f.write('[php_paths]\nlink_db_api=' + api_url + '\n\n[config]\n')
+        for option, name in (('path_log', 'CoSESServer_log.txt'), ('path_notification', 'user_notification.txt'),
+                             ('path_status_file', 'RevPiStatus.txt'), ('path_spool', 'spool'),
+                             ('path_raw_capture', 'raw_capture'), ('path_packet_capture', 'packet_capture'),
+                             ('path_local_socket', 'CoSESServer.sock'),
+                             ('path_notification_state', 'notification_state.json'),
+                             ('path_pidfile', 'CoSESServer.pid')):
+            f.write(option + '=' + os.path.join(workdir, name) + '\n')
+        f.write('\n[system]\nwatchdog=none\nreboot=file:' + os.path.join(workdir, 'reboot_requests.txt') +
+                '\nmail_transport=\n\n[metrics]\nserver_port=0\ndriver_port=0\n')
+    return path_ini
+
+
+def launch_server(api_url, port, stations, workdir=None):
+    """
+    Starts a CoSESServer in this process (see write_ini)
+    :param api_url: str - URL of the database API stand-in
+    :param port: int - port of the server
+    :param stations: int - number of simulated stations (MaxClients is raised if necessary)
+    :param workdir: str - directory for the files of the server (default: new temporary directory)
+    :return: RevPiServerClass
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='CoSESSimulator_')
+    import CoSESServer
+    CoSESServer.path_ini = write_ini(api_url, workdir)
+    CoSESServer.path_contacts = os.path.join(workdir, 'user_notification.txt')
+    CoSESServer.host = '127.0.0.1'
+    CoSESServer.port = port
+    CoSESServer.MaxClients = max(CoSESServer.MaxClients, stations)
+    CoSESServer.Log_level = CoSESServer.LOG_ERROR  # the log of the server would hide the results
+    server = CoSESServer.RevPiServerClass()
+    server.start_server()
+    print('[Simulator] CoSESServer launched (files in ' + workdir + ').')
+    return server
+
+
+def format_report(label, t_elapsed, stats, counters, latencies):
+    """
+    Formats one line of results
+    :param label: str - e.g. 'interval' or 'total'
+    :param t_elapsed: float - duration covered by the counters (seconds)
+    :param stats: dict - counters of the simulated stations
+    :param counters: dict - counters of the database API stand-in
+    :param latencies: list - latencies (seconds)
+    :return: str - report line
+    """
+    def _ms(value):
+        return '-' if value is None else '%.0fms' % (value * 1000)
+    t_elapsed = max(t_elapsed, 1e-6)
+    return ('[Simulator][%s] sent=%.1f/s persisted=%.1f samples/s (%.1f datasets/s) latency p50=%s p99=%s '
+            'heartbeats=%d ignored=%d resets=%d disconnects=%d bursts=%d errors=%d db_failures=%d' %
+            (label, stats['sent'] / t_elapsed, counters['samples'] / t_elapsed, counters['datasets'] / t_elapsed,
+             _ms(percentile(latencies, 50)), _ms(percentile(latencies, 99)), stats['heartbeats'],
+             stats['heartbeats_ignored'], stats['resets'], stats['disconnects'], stats['bursts'], stats['errors'],
+             counters['failures']))
+
+
+def create_argument_parser(description='Simulates CONTROLLINOs to load-test the CoSESServer.'):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--host', default='127.0.0.1', help='address of the CoSESServer')
+    parser.add_argument('--port', type=int, default=7785, help='port of the CoSESServer')
+    parser.add_argument('--stations', type=int, default=1, help='number of simulated CONTROLLINOs')
+    parser.add_argument('--sample-rate', type=float, default=SENSOR_SAMPLE_RATE,
+                        help='seconds between two sensor data packages of a station (packages of --legacy-text are '
+                             'stamped with whole seconds by the server: not below 1 second)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random variation of the sample rate (0.1 = 10 %%)')
+    parser.add_argument('--binary', action='store_true', help='request the binary protocol')
+    parser.add_argument('--legacy-text', action='store_true',
+                        help='text packages without sequence number and sampling time (older clients, no buffering)')
+    parser.add_argument('--buffer-size', type=int, default=SAMPLE_BUFFER_SIZE,
+                        help='samples a station buffers while the connection is lost')
+    parser.add_argument('--burst-rate', type=float, default=0.0,
+                        help='probability per package that the following packages are held back and sent at once')
+    parser.add_argument('--burst-max', type=int, default=5, help='maximum number of packages of a burst')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0,
+                        help='probability per package that the connection is lost')
+    parser.add_argument('--restart-delay', type=float, default=5.0, help='seconds until a station reconnects')
+    parser.add_argument('--heartbeat-ignore-rate', type=float, default=0.0,
+                        help='probability that a HeartBeat is not answered')
+    parser.add_argument('--heartbeat-delay', type=float, default=0.0, help='seconds until a HeartBeat is answered')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='probability per package and sensor that the sensor returns an error code')
+    parser.add_argument('--errors', default='pt100,cmp3_1,cmp3_2,cmp3_3,spn1',
+                        help='sensors that may return error codes (' + ','.join(sorted(SENSOR_ERROR_CODES)) + ')')
+    parser.add_argument('--duration', type=float, default=60, help='duration of the simulation in seconds (0 = endless)')
+    parser.add_argument('--report-interval', type=float, default=10, help='seconds between two reports')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the random generators')
+    parser.add_argument('--api-port', type=int, default=API_PORT,
+                        help='port of the database API stand-in (0 = do not start the stand-in)')
+    parser.add_argument('--api-delay', type=float, default=0.0, help='seconds every database API request takes')
+    parser.add_argument('--api-failure-rate', type=float, default=0.0,
+                        help='probability that saving datasets fails')
+    parser.add_argument('--launch-server', action='store_true',
+                        help='start a CoSESServer in this process (uses the database API stand-in)')
+    return parser
+
+
+def parse_arguments(argv=None, parser=None):
+    parser = parser or create_argument_parser()
+    options = parser.parse_args(argv)
+    options.errors = [sensor.strip() for sensor in options.errors.split(',') if sensor.strip()]
+    for sensor in options.errors:
+        if sensor not in SENSOR_ERROR_CODES:
+            parser.error('unknown sensor: ' + sensor)
+    if options.launch_server and not options.api_port:
+        parser.error('--launch-server requires the database API stand-in (--api-port)')
+    return options
+
+
+def main(argv=None):
+    options = parse_arguments(argv)
+    api = None
+    if options.api_port:
+        api = DatabaseApiStandIn(options.api_port, options.api_delay, options.api_failure_rate)
+        print('[Simulator] Database API stand-in: ' + api.url)
+    if options.launch_server:
+        launch_server(api.url, options.port, options.stations)
+    stats = SimulationStats()
+    stations = [SimulatedStation('sim%02d' % i, options, stats, options.seed + i) for i in range(options.stations)]
+    for station in stations:
+        station.start()
+    t_start = t_report = time.time()
+    previous = (stats.get(), api.get() if api else ({}, []))
+    empty = dict.fromkeys(('requests', 'datasets', 'samples', 'failures'), 0)
+    try:
+        while True:
+            t_wake = t_report + options.report_interval
+            if options.duration:
+                t_wake = min(t_wake, t_start + options.duration)
+            time.sleep(max(0.0, t_wake - time.time()))
+            if options.duration and time.time() >= t_start + options.duration:
+                break
+            current = (stats.get(), api.get() if api else (empty, []))
+            interval_stats = dict((key, value - previous[0].get(key, 0)) for key, value in current[0].items())
+            interval_counters = dict((key, value - previous[1][0].get(key, 0)) for key, value in current[1][0].items())
+            print(format_report('interval', time.time() - t_report, interval_stats, interval_counters,
+                                current[1][1][len(previous[1][1]):]))
+            previous = current
+            t_report = time.time()
+    except KeyboardInterrupt:
+        pass
+    for station in stations:
+        station.stop()
+    counters, latencies = api.get() if api else (empty, [])
+    print(format_report('total', time.time() - t_start, stats.get(), counters, latencies))
+    sys.stdout.flush()
+    if options.launch_server:
+        os._exit(0)  # the threads of the CoSESServer run forever
+
+
+if __name__ == '__main__':
+    main()
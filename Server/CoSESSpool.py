@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESSpool.py implements the on-disk spool (journal) of the CoSESServer. Datasets that cannot be saved into the primary
+database (database API unreachable or too slow) are appended to compact binary segment files and replayed in order as
+soon as the database is available again.
+"""
+
+import os
+import os.path
+import struct
+import time
+import zlib
+from CoSESAggregator import DATASET_FIELDS
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+# Values of a dataset (sensor values, statistics and number of samples) in the order they are stored in a spool record
+SPOOL_FIELDS = DATASET_FIELDS
+# Station ID of datasets that do not carry one
+DEFAULT_STATION = 'main'
+
+# Segment file layout: 4 byte magic, followed by fixed-size records
+SEGMENT_MAGIC = 'CSP2'
+SEGMENT_MAGIC_V1 = 'CSP1'  # records without dataset key (written by a previous version, still replayed)
+SEGMENT_PREFIX = 'spool_'
+SEGMENT_SUFFIX = '.seg'
+CHECKPOINT_FILE = 'checkpoint'
+
+# Record layout: t_unix (uint32) | dataset key (uint32, 0 = none) | NULL-bitmask (uint32) | values (float32) |
+# station ID (16 chars) | CRC32 of the preceding bytes
+RECORD_BODY = struct.Struct('<III%df16s' % len(SPOOL_FIELDS))
+RECORD_CRC = struct.Struct('<I')
+RECORD_SIZE = RECORD_BODY.size + RECORD_CRC.size
+RECORD_BODY_V1 = struct.Struct('<II%df16s' % len(SPOOL_FIELDS))  # without dataset key
+RECORD_SIZE_V1 = RECORD_BODY_V1.size + RECORD_CRC.size
+
+
+def encode_record(dataset):
+    """
+    Packs a dataset into a binary spool record
+    :param dataset: dict - sensor values (str, float or None), station ID, capture time (t_unix) and key
+                    (dataset_key) of the dataset
+    :return: str - binary record
+    """
+    null_mask = 0
+    values = []
+    for i, field in enumerate(SPOOL_FIELDS):
+        try:
+            values.append(float(dataset.get(field)))
+        except (TypeError, ValueError):  # no or invalid reading
+            null_mask |= (1 << i)
+            values.append(0.0)
+    t_unix = dataset.get('t_unix')
+    if t_unix is None:  # no capture time available
+        t_unix = time.time()
+    station = str(dataset.get('station') or DEFAULT_STATION)
+    body = RECORD_BODY.pack(int(t_unix), int(dataset.get('dataset_key') or 0), null_mask, *(values + [station]))
+    return body + RECORD_CRC.pack(zlib.crc32(body) & 0xffffffff)
+
+
+def decode_record(record):
+    """
+    Unpacks a binary spool record
+    :param record: str - binary record (current layout or CSP1)
+    :return: dict - dataset, or None if the record is corrupt
+    """
+    if len(record) == RECORD_SIZE_V1:
+        record = upgrade_record_v1(record)
+    body = record[:RECORD_BODY.size]
+    if RECORD_CRC.unpack(record[RECORD_BODY.size:])[0] != (zlib.crc32(body) & 0xffffffff):
+        return None
+    unpacked = RECORD_BODY.unpack(body)
+    dataset = {'t_unix': unpacked[0], 'dataset_key': str(unpacked[1]) if unpacked[1] else None,
+               'station': unpacked[-1].rstrip('\0') or DEFAULT_STATION}
+    for i, field in enumerate(SPOOL_FIELDS):
+        if unpacked[2] & (1 << i):
+            dataset[field] = None
+        else:
+            dataset[field] = '%.7g' % unpacked[3 + i]  # float32 carries ~7 significant digits
+    return dataset
+
+
+def upgrade_record_v1(record):
+    """
+    Converts a record of a segment without dataset keys (CSP1) into the current layout
+    :param record: str - binary record (CSP1)
+    :return: str - binary record (without dataset key), a record that does not pass the CRC check if it was corrupt
+    """
+    body = record[:RECORD_BODY_V1.size]
+    if RECORD_CRC.unpack(record[RECORD_BODY_V1.size:])[0] != (zlib.crc32(body) & 0xffffffff):
+        return '\0' * RECORD_SIZE  # fails the CRC check as well
+    unpacked = RECORD_BODY_V1.unpack(body)
+    body = RECORD_BODY.pack(unpacked[0], 0, *unpacked[1:])
+    return body + RECORD_CRC.pack(zlib.crc32(body) & 0xffffffff)
+
+
+class SampleSpool:
+    """
+    Append-only journal of datasets made of rotating segment files. The read position is kept in a checkpoint file
+    that is replaced atomically, so neither a crash nor a power loss loses or duplicates already replayed datasets.
+    Not thread-safe: meant to be used by the DatabaseWriterThread only.
+    """
+    def __init__(self, path_dir, segment_max_records=17280, fsync_every=12, fsync_interval=60):
+        """
+        :param path_dir: str - directory of the segment files and the checkpoint
+        :param segment_max_records: int - records per segment file before a new one is started (17280 = 1 day)
+        :param fsync_every: int - flush to disk after this many appended records ...
+        :param fsync_interval: float - ... or if the last flush is older than this many seconds
+        """
+        self.path_dir = path_dir
+        self.segment_max_records = segment_max_records
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.f_write = None
+        self.write_segment = 0
+        self.write_records = 0
+        self.unsynced_records = 0
+        self.t_last_sync = time.time()
+        self.read_segment = 0
+        self.read_offset = len(SEGMENT_MAGIC)
+        self.pending = 0
+        if not os.path.isdir(self.path_dir):
+            os.makedirs(self.path_dir)
+        self._recover()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path_dir, SEGMENT_PREFIX + '%08d' % segment + SEGMENT_SUFFIX)
+
+    def _list_segments(self):
+        segments = []
+        for name in os.listdir(self.path_dir):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    pass
+        return sorted(segments)
+
+    def _recover(self):
+        """
+        Restores the read position from the checkpoint, cuts off a partially written record at the end of the
+        newest segment (crash during append) and counts the datasets waiting to be replayed
+        :param NONE: --
+        :return: --
+        """
+        try:
+            with open(os.path.join(self.path_dir, CHECKPOINT_FILE), 'r') as f:
+                checkpoint = f.read().split()
+            self.read_segment = int(checkpoint[0])
+            self.read_offset = int(checkpoint[1])
+        except Exception:  # no or unreadable checkpoint: start with the oldest segment
+            segments = self._list_segments()
+            self.read_segment = segments[0] if segments else 0
+            self.read_offset = len(SEGMENT_MAGIC)
+        segments = self._list_segments()
+        for segment in segments:  # remove segments that have already been replayed completely
+            if segment < self.read_segment:
+                os.remove(self._segment_path(segment))
+        segments = [segment for segment in segments if segment >= self.read_segment]
+        self.pending = 0
+        if segments:
+            self.write_segment = segments[-1]
+            path = self._segment_path(self.write_segment)
+            size = os.path.getsize(path)
+            if size < len(SEGMENT_MAGIC):  # crashed while creating the segment
+                with open(path, 'wb') as f:
+                    f.write(SEGMENT_MAGIC)
+                size = len(SEGMENT_MAGIC)
+            record_size = self._record_size(self.write_segment)
+            valid_size = len(SEGMENT_MAGIC) + ((max(size - len(SEGMENT_MAGIC), 0) // record_size) * record_size)
+            if valid_size != size:  # torn write at the end of the segment
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_size)
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.write_records = (valid_size - len(SEGMENT_MAGIC)) // record_size
+            for segment in segments:
+                record_size = self._record_size(segment)
+                records = (os.path.getsize(self._segment_path(segment)) - len(SEGMENT_MAGIC)) // record_size
+                if segment == self.read_segment:
+                    records -= (self.read_offset - len(SEGMENT_MAGIC)) // record_size
+                self.pending += max(records, 0)
+            if record_size != RECORD_SIZE:  # written by a previous version: new records go into a new segment
+                self.write_segment += 1
+                self.write_records = 0
+        else:
+            self.write_segment = self.read_segment
+            self.write_records = 0
+            self.read_offset = len(SEGMENT_MAGIC)
+
+    def _record_size(self, segment):
+        """
+        :param segment: int - segment number
+        :return: int - size of the records of the segment (segments of a previous version hold CSP1 records)
+        """
+        try:
+            with open(self._segment_path(segment), 'rb') as f:
+                if f.read(len(SEGMENT_MAGIC_V1)) == SEGMENT_MAGIC_V1:
+                    return RECORD_SIZE_V1
+        except IOError:  # not created yet
+            pass
+        return RECORD_SIZE
+
+    def _open_segment(self):
+        path = self._segment_path(self.write_segment)
+        is_new = not os.path.isfile(path)
+        self.f_write = open(path, 'ab')
+        if is_new:
+            self.f_write.write(SEGMENT_MAGIC)
+            self.write_records = 0
+
+    def _sync(self):
+        if self.f_write:
+            self.f_write.flush()
+            os.fsync(self.f_write.fileno())
+        self.unsynced_records = 0
+        self.t_last_sync = time.time()
+
+    def append(self, datasets):
+        """
+        Appends datasets to the journal. Data is flushed to disk in batches (see fsync_every and fsync_interval)
+        :param datasets: list - datasets (dict) to be spooled
+        :return: --
+        """
+        for dataset in datasets:
+            if self.f_write is None:
+                self._open_segment()
+            self.f_write.write(encode_record(dataset))
+            self.write_records += 1
+            self.unsynced_records += 1
+            self.pending += 1
+            if self.write_records >= self.segment_max_records:  # rotate segment
+                self._sync()
+                self.f_write.close()
+                self.f_write = None
+                self.write_segment += 1
+        if self.unsynced_records >= self.fsync_every or (time.time() - self.t_last_sync) > self.fsync_interval:
+            self._sync()
+
+    def has_pending(self):
+        """
+        :param NONE: --
+        :return: bool - True if there are datasets waiting to be replayed
+        """
+        return self.pending > 0
+
+    def read_pending(self, max_count):
+        """
+        Reads the oldest datasets waiting to be replayed. The read position is only advanced by commit()
+        :param max_count: int - maximum number of datasets to be returned
+        :return: tuple - (list of datasets, position to be passed to commit())
+        """
+        if self.unsynced_records:  # make sure the reader sees everything that has been appended
+            self._sync()
+        datasets = []
+        segment = self.read_segment
+        offset = self.read_offset
+        skipped = 0
+        while len(datasets) < max_count and segment <= self.write_segment:
+            path = self._segment_path(segment)
+            if not os.path.isfile(path):
+                if segment >= self.write_segment:  # segment has not been created yet (just rotated)
+                    break
+                segment += 1
+                offset = len(SEGMENT_MAGIC)
+                continue
+            record_size = self._record_size(segment)
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read((max_count - len(datasets)) * record_size)
+            for i in range(0, len(chunk) - record_size + 1, record_size):
+                dataset = decode_record(chunk[i:i + record_size])
+                if dataset is None:  # corrupt record, skip it
+                    skipped += 1
+                else:
+                    datasets.append(dataset)
+                offset += record_size
+            if len(datasets) + skipped < max_count and segment < self.write_segment:  # segment read completely
+                segment += 1
+                offset = len(SEGMENT_MAGIC)
+            elif not chunk:
+                break
+        return datasets, (segment, offset, len(datasets) + skipped)
+
+    def commit(self, position):
+        """
+        Marks the datasets returned by read_pending() as replayed: writes the checkpoint and removes segment files
+        that have been replayed completely
+        :param position: tuple - position returned by read_pending()
+        :return: --
+        """
+        segment, offset, count = position
+        path_checkpoint = os.path.join(self.path_dir, CHECKPOINT_FILE)
+        with open(path_checkpoint + '.tmp', 'w') as f:
+            f.write('%d %d\n' % (segment, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path_checkpoint + '.tmp', path_checkpoint)  # atomic replacement of the checkpoint
+        for old_segment in range(self.read_segment, segment):
+            if os.path.isfile(self._segment_path(old_segment)):
+                os.remove(self._segment_path(old_segment))
+        self.read_segment = segment
+        self.read_offset = offset
+        self.pending = max(self.pending - count, 0)
+
+    def close(self):
+        """
+        Flushes and closes the current segment file
+        :param NONE: --
+        :return: --
+        """
+        if self.f_write:
+            self._sync()
+            self.f_write.close()
+            self.f_write = None
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of the CoSESWeather project.
+CoSESSystem.py integrates the CoSESServer and the CoSESDriver with the system: resetting the hardware watchdog of the
+RevPi, sending emails, rebooting the system and checking if a process is still running. Everything is done in-process
+(device and file I/O) instead of starting helper processes (bash, piTest, mail, shutdown), which is expensive on the
+RevPi. The backends can be chosen in the [system] section of the CoSESWeather.ini, e.g. a file instead of the hardware
+watchdog on a development machine or in tests.
+"""
+
+import os
+import os.path
+import errno
+import fcntl
+import signal
+import socket
+import struct
+import smtplib
+import subprocess
+import time
+from email.mime.text import MIMEText
+
+
+__author__ = "Miroslav Lach"
+__copyright__ = "Copyright 2019, MSE"
+__version__ = "1.0"
+__maintainer__ = "Miroslav Lach"
+__email__ = "miroslav.lach@tum.de"
+
+
+# piControl (process image of the RevPi): ioctl to look up the address of a variable by its name
+PICONTROL_DEVICE = '/dev/piControl0'
+KB_FIND_VARIABLE = (ord('K') << 8) | 17  # _IO('K', 17)
+SPI_VARIABLE = struct.Struct('<32sHBxH')  # name | address (byte offset) | bit | length (bits)
+WATCHDOG_VARIABLE = 'RevPiLED'
+WATCHDOG_BIT = 7  # toggling bit 7 of RevPiLED resets the hardware watchdog (same as WatchDogResetter.sh)
+# init reboots on ctrl-alt-del (SIGINT) only if configured: systemd (unit files in this order) or SysV init (inittab)
+SYSTEMD_RUNTIME_DIR = '/run/systemd/system'
+SYSTEMD_UNIT_DIRS = ('/etc/systemd/system', '/run/systemd/system', '/lib/systemd/system', '/usr/lib/systemd/system')
+INITTAB = '/etc/inittab'
+
+
+class RevPiWatchdog:
+    """
+    Hardware watchdog of the RevPi Core, reset by toggling a bit of the RevPiLED byte in the process image
+    """
+    def __init__(self, device=PICONTROL_DEVICE, variable=WATCHDOG_VARIABLE, bit=WATCHDOG_BIT):
+        """
+        :param device: str - piControl device
+        :param variable: str - name of the variable holding the watchdog bit
+        :param bit: int - watchdog bit
+        """
+        self.device = device
+        self.variable = variable
+        self.mask = 1 << bit
+        self.fd = None
+        self.address = None
+
+    def kick(self):
+        """
+        Resets the watchdog timer
+        :param NONE: --
+        :return: --
+        """
+        if self.fd is None:
+            self.fd = os.open(self.device, os.O_RDWR)
+            request = bytearray(SPI_VARIABLE.pack(self.variable, 0, 0, 0))
+            fcntl.ioctl(self.fd, KB_FIND_VARIABLE, request, True)  # fills in address, bit and length
+            self.address = SPI_VARIABLE.unpack(str(request))[1]
+        try:
+            os.lseek(self.fd, self.address, os.SEEK_SET)
+            value = ord(os.read(self.fd, 1))
+            os.lseek(self.fd, self.address, os.SEEK_SET)
+            os.write(self.fd, chr(value ^ self.mask))
+        except OSError:
+            self.close()  # open the device again with the next kick
+            raise
+
+    def close(self):
+        """
+        Closes the device
+        :param NONE: --
+        :return: --
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FileWatchdog:
+    """
+    Stand-in for the hardware watchdog (e.g. in tests): every kick writes the current time into a file
+    """
+    def __init__(self, path):
+        """
+        :param path: str - file that is updated with every kick
+        """
+        self.path = path
+
+    def kick(self):
+        """
+        Resets the watchdog timer (writes the current time)
+        :param NONE: --
+        :return: --
+        """
+        with open(self.path, 'w') as f:
+            f.write(str(time.time()) + '\n')
+
+    def close(self):
+        pass
+
+
+class NullWatchdog:
+    """
+    No watchdog (kicks are ignored)
+    """
+    def kick(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class InitReboot:
+    """
+    Reboots the system by asking init (systemd: ctrl-alt-del.target = reboot) for a clean reboot. init ignores the
+    request if ctrl-alt-del is not mapped to a reboot, so this is checked first (OSError if not)
+    """
+    def reboot(self):
+        """
+        Requests a reboot of the system
+        :param NONE: --
+        :return: --
+        """
+        if not self.is_reboot_on_ctrl_alt_del():
+            raise OSError('init does not reboot on ctrl-alt-del')
+        os.kill(1, signal.SIGINT)
+
+    @staticmethod
+    def is_reboot_on_ctrl_alt_del():
+        """
+        Checks if init reboots the system on ctrl-alt-del (systemd: ctrl-alt-del.target is reboot.target and not
+        masked, SysV init: ctrlaltdel entry of the inittab runs shutdown -r)
+        :param NONE: --
+        :return: bool - True if SIGINT to init reboots the system
+        """
+        if os.path.isdir(SYSTEMD_RUNTIME_DIR):
+            for directory in SYSTEMD_UNIT_DIRS:
+                path = os.path.join(directory, 'ctrl-alt-del.target')
+                if os.path.lexists(path):  # the first unit file found is used by systemd
+                    return os.path.basename(os.path.realpath(path)) == 'reboot.target'
+            return False
+        try:
+            with open(INITTAB) as f:
+                for line in f:
+                    fields = line.split('#', 1)[0].strip().split(':', 3)
+                    if len(fields) == 4 and fields[2] == 'ctrlaltdel':
+                        return 'shutdown' in fields[3] and '-r' in fields[3].split()
+        except IOError:
+            pass
+        return False
+
+
+class CommandReboot:
+    """
+    Reboots the system with the shutdown command (starts a process)
+    """
+    def reboot(self):
+        """
+        Requests a reboot of the system
+        :param NONE: --
+        :return: --
+        """
+        if subprocess.call(['shutdown', '-r', 'now']) != 0:
+            raise OSError('shutdown command failed')
+
+
+class FileReboot:
+    """
+    Stand-in for rebooting the system (e.g. in tests): every request is appended to a file
+    """
+    def __init__(self, path):
+        """
+        :param path: str - file the reboot requests are appended to
+        """
+        self.path = path
+
+    def reboot(self):
+        """
+        Records a reboot request
+        :param NONE: --
+        :return: --
+        """
+        with open(self.path, 'a') as f:
+            f.write(str(time.time()) + '\n')
+
+
+class SmtpTransport:
+    """
+    Sends emails over one SMTP connection that is kept open and re-used
+    """
+    def __init__(self, host='localhost', port=25, sender=None, t_timeout=30):
+        """
+        :param host: str - SMTP server
+        :param port: int - SMTP port
+        :param sender: str - sender address (default: CoSESWeather@<hostname>)
+        :param t_timeout: float - timeout of the connection in seconds
+        """
+        self.host = host
+        self.port = port
+        self.sender = sender or 'CoSESWeather@' + socket.gethostname()
+        self.t_timeout = t_timeout
+        self.smtp = None
+
+    def send(self, recipients, subject, content):
+        """
+        Sends an email
+        :param recipients: list - email addresses
+        :param subject: str - subject
+        :param content: str - message
+        :return: bool - True if the email has been sent
+        """
+        message = MIMEText(content)
+        message['Subject'] = subject
+        message['From'] = self.sender
+        message['To'] = ', '.join(recipients)
+        for attempt in range(2):  # a connection closed by the server is re-opened once
+            try:
+                if self.smtp is None:
+                    self.smtp = smtplib.SMTP(self.host, self.port, timeout=self.t_timeout)
+                self.smtp.sendmail(self.sender, recipients, message.as_string())
+                return True
+            except (smtplib.SMTPException, socket.error):
+                self.close()
+        return False
+
+    def close(self):
+        """
+        Closes the connection (it is opened again by the next email)
+        :param NONE: --
+        :return: --
+        """
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+
+class MailCommandTransport:
+    """
+    Sends emails with the 'mail' command (starts one process per email)
+    """
+    def send(self, recipients, subject, content):
+        """
+        Sends an email
+        :param recipients: list - email addresses
+        :param subject: str - subject
+        :param content: str - message
+        :return: bool - True if the email has been sent
+        """
+        try:
+            process = subprocess.Popen(['mail', '-s', subject] + list(recipients), stdin=subprocess.PIPE)
+            process.communicate(content)
+            return process.returncode == 0
+        except OSError:
+            return False
+
+    def close(self):
+        pass
+
+
+class FallbackTransport:
+    """
+    Tries several transports in order until one of them succeeds
+    """
+    def __init__(self, transports):
+        """
+        :param transports: list - transports (e.g. SMTP first, then the mail command)
+        """
+        self.transports = transports
+
+    def send(self, recipients, subject, content):
+        """
+        Sends an email
+        :param recipients: list - email addresses
+        :param subject: str - subject
+        :param content: str - message
+        :return: bool - True if the email has been sent
+        """
+        for transport in self.transports:
+            if transport.send(recipients, subject, content):
+                return True
+        return False
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+
+
+class PidFile:
+    """
+    File holding the process ID of a running process. The file is locked as long as the process runs, so a left over
+    file of a crashed process is recognized
+    """
+    def __init__(self, path):
+        """
+        :param path: str - path of the pid file
+        """
+        self.path = path
+        self.fd = None
+
+    def acquire(self):
+        """
+        Creates and locks the pid file
+        :param NONE: --
+        :return: bool - False if another running process holds the pid file
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()) + '\n')
+        self.fd = fd
+        return True
+
+    def release(self):
+        """
+        Removes the pid file
+        :param NONE: --
+        :return: --
+        """
+        if self.fd is not None:
+            os.remove(self.path)
+            os.close(self.fd)
+            self.fd = None
+
+
+def is_process_alive(path):
+    """
+    Checks if the process of a pid file is running
+    :param path: str - path of the pid file
+    :return: bool - True if the process is running
+    """
+    try:
+        with open(path, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)  # signal 0: only checks if the process exists
+        return True
+    except OSError, e:
+        return e.errno == errno.EPERM  # process exists, but belongs to another user
+    except (IOError, ValueError):
+        return False
+
+
+class SystemServices:
+    """
+    Watchdog, reboot and email transport of a process
+    """
+    def __init__(self, watchdog, reboot, transport):
+        """
+        :param watchdog: watchdog backend (RevPiWatchdog | FileWatchdog | NullWatchdog)
+        :param reboot: reboot backend (InitReboot | CommandReboot | FileReboot)
+        :param transport: email transport (SmtpTransport | MailCommandTransport | FallbackTransport)
+        """
+        self.watchdog = watchdog
+        self.reboot = reboot
+        self.transport = transport
+
+    def kick_watchdog(self):
+        """
+        Resets the watchdog timer
+        :param NONE: --
+        :return: --
+        """
+        self.watchdog.kick()
+
+    def request_reboot(self):
+        """
+        Reboots the system (falls back to the shutdown command if the backend fails, e.g. init does not reboot on
+        ctrl-alt-del)
+        :param NONE: --
+        :return: --
+        """
+        try:
+            self.reboot.reboot()
+        except (OSError, IOError):
+            if isinstance(self.reboot, CommandReboot):
+                raise
+            CommandReboot().reboot()
+
+
+def create_system_services(config):
+    """
+    Creates the system services as configured in the [system] and [notification] sections of the CoSESWeather.ini:
+    watchdog = revpi | file:<path> | none, reboot = init | command | file:<path> | none,
+    mail_transport = smtp | mail | smtp,mail (tried in order), smtp_host, smtp_port, sender
+    :param config: Config (CoSESConfig)
+    :return: SystemServices
+    """
+    watchdog = config.get('system', 'watchdog', 'revpi')
+    if watchdog.startswith('file:'):
+        watchdog = FileWatchdog(watchdog[5:])
+    elif watchdog == 'none':
+        watchdog = NullWatchdog()
+    else:
+        watchdog = RevPiWatchdog()
+    reboot = config.get('system', 'reboot', 'init')
+    if reboot.startswith('file:'):
+        reboot = FileReboot(reboot[5:])
+    elif reboot == 'command':
+        reboot = CommandReboot()
+    elif reboot == 'none':
+        reboot = FileReboot(os.devnull)
+    else:
+        reboot = InitReboot()
+    transports = []
+    for name in config.get('system', 'mail_transport', 'smtp,mail').split(','):
+        if name.strip() == 'smtp':
+            transports.append(SmtpTransport(config.get('notification', 'smtp_host', 'localhost'),
+                                            config.getint('notification', 'smtp_port', 25),
+                                            config.get('notification', 'sender', None)))
+        elif name.strip() == 'mail':
+            transports.append(MailCommandTransport())
+    return SystemServices(watchdog, reboot, FallbackTransport(transports))
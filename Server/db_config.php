@@ -4,4 +4,5 @@
 	define('MYSQL_PASS','enter_password');
 	define('MYSQL_DB1','CoSESWeather_DB');
 	define('MYSQL_DB2','WeeWx_DB');	
+	define('LOCAL_ENDPOINT','unix:///opt/CoSESWeather/CoSESServer.sock'); // path_local_socket in CoSESWeather.ini
 ?>
\ No newline at end of file
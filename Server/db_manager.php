@@ -22,6 +22,13 @@
 	* p_mode = 13 -> Get registered users
 	* p_mode = 14 -> Check for submitted admin commands
 	* p_mode = 15 -> Data Export
+	* p_mode = 16 -> Saving a batch of sensor datasets provided by CoSESServer.py into the primary MySQL Database
+	* p_mode = 17 -> Get the latest samples of a station kept in memory by CoSESServer.py (short history)
+	* p_mode = 18 -> Saving a batch of summaries (rolling aggregates of completed periods) provided by CoSESServer.py
+	* p_mode = 19 -> Get summaries (rolling aggregates): current values from CoSESServer.py or saved periods
+	* p_mode = 20 -> Acknowledge an admin command (executed by CoSESServer.py)
+	* p_mode = 21 -> Used by the WeeWx Framework in the driver: fetch the datasets following a cursor (ID of the last fetched dataset)
+	* p_mode = 22 -> Used by the WeeWx Framework in the driver: aggregate the datasets following a cursor per archive interval (backlog)
 	*
 	* *** Expected arguments **************************************************** 
 	*
@@ -35,15 +42,22 @@
 	* [p_rad_cmp1]  -> Sun Irradiation reported by the first CMP3 pyranometer.
 	* [p_rad_cmp2]  -> Sun Irradiation reported by the second CMP3 pyranometer.
 	* [p_rad_cmp3]  -> Sun Irradiation reported by the third CMP3 pyranometer.			
+	* [p_station]	-> (optional) ID of the weather station that acquired the dataset (default: 'main').
 	* ***************************************************************************		
 	* * for ['p_mode' = 2] (fetch datasets):
 	* [p_mode]		-> 2	
+	* [p_station]	-> (optional) only fetch datasets of this weather station
+	* (superseded by p_mode 21: scans the whole table, the CoSESDriver does not use p_mode 2 anymore. Datasets saved by
+	*  p_mode 1 and 16 are inserted as archived, so only datasets saved before the upgrade are returned)
 	* ***************************************************************************		
 	* * for ['p_mode' = 3] (Get emails of users with admin status):
 	* [p_mode]		-> 3	
 	* ***************************************************************************	
 	* * for ['p_mode' = 4] (current conditions):
 	* [p_mode]		-> 4			
+	* [p_station]	-> (optional) latest dataset of this weather station (default: latest dataset of any station)
+	*				   The latest sample is read from the CoSESServer (local endpoint) if it is running, otherwise from
+	*				   the primary database.
 	* ***************************************************************************		
 	* * for ['p_mode' = 5] (login user account):
 	* [p_mode]		-> 5
@@ -85,6 +99,7 @@
 	* [p_user] 		-> Admin username (for authetication)
 	* [p_pass] 		-> Admin password (for authetication)
 	* [a_reason]	-> Reason for action	
+	* [a_station]	-> (optional) ID of the weather station to be reset (default: all stations)
 	* ***************************************************************************	
 	* * for ['p_mode' = 11] (restart system):
 	* [p_mode]		-> 11
@@ -105,6 +120,7 @@
 	* ***************************************************************************			
 	* * for ['p_mode' = 14] (Check for submitted admin commands):
 	* [p_mode]		-> 14	
+	*				   Returns the oldest command that has not been acknowledged yet (id and cmd).
 	* ***************************************************************************		
 	* * for ['p_mode' = 15] (Data exports):
 		* * for ['d_export_mode' = 0] (export from primary database):
@@ -116,6 +132,7 @@
 	* [d_start] 	  -> Date/Time start
 	* [d_stop] 		  -> Date/Time stop	
 	* [d_step] 		  -> step/interval of measurements in seconds
+	* [d_station] 	  -> (optional) only export datasets of this weather station
 		* * for ['d_export_mode' = 1] (export from secondary database):	
 	* [p_mode]		  -> 15	
 	* [p_user] 		  -> Username (for authetication)
@@ -127,6 +144,62 @@
 	* [d_step] 		  -> step/interval of measurements in seconds			
 	* [d_hilo] 		  -> include hi/lo statistics in export if selected	
 	* ***************************************************************************				
+	* * for ['p_mode' = 16] (saving a batch of sensor datasets):
+	* [p_mode]		-> 16
+	* [p_datasets]	-> JSON array of datasets. Each dataset is an object with the keys temp, wind, spn1_radTot,
+	*				   spn1_radDiff, spn1_sun, rad_cmp1, rad_cmp2, rad_cmp3 (value or null), t_unix (capture time) and
+	*				   station (optional, ID of the weather station - default: 'main').
+	*				   Downsampled datasets additionally contain <sensor>_min, <sensor>_max, <sensor>_std (for temp, wind,
+	*				   spn1_radTot, spn1_radDiff, rad_cmp1, rad_cmp2, rad_cmp3) and samples (optional).
+	*				   dataset_key (optional): key assigned by the CoSESServer (decimal string, unsigned 32 bit, unique per
+	*				   station and capture time). A dataset with a key is saved once, so a batch can be sent again.
+	*				   Reply: __SUCCESS;<ID of the newest dataset before the batch>;<IDs of the saved datasets>
+	*				   (comma separated, in the order of p_datasets; 0 = saved already)
+	* ***************************************************************************
+	* * for ['p_mode' = 17] (short history):
+	* [p_mode]		-> 17
+	* [p_station]	-> ID of the weather station
+	* [p_count]		-> (optional) number of samples (default and maximum: all samples kept by the CoSESServer)
+	* ***************************************************************************
+	* * for ['p_mode' = 18] (saving a batch of summaries):
+	* [p_mode]		-> 18
+	* [p_summaries]	-> JSON array of summaries. Each summary is an object with the keys station, period (length in
+	*				   seconds: 60, 300, 3600 or 86400 = day), t_unix (end of the period), sensor, samples, mean, min,
+	*				   t_min, max, t_max and energy (irradiation in Wh/m² of the period, null for other sensors).
+	* ***************************************************************************
+	* * for ['p_mode' = 19] (summaries):
+	* [p_mode]		-> 19
+	* [p_station]	-> (optional) only summaries of this weather station
+	* [p_period]	-> (optional) length of the periods in seconds (60, 300, 3600 or 86400). If not provided, the
+	*				   current rolling aggregates are read from the CoSESServer (local endpoint).
+	* [p_start]		-> (only with p_period) start of the time range (unix time, end of the periods)
+	* [p_stop]		-> (only with p_period) end of the time range (unix time, end of the periods)
+	* ***************************************************************************
+	* * for ['p_mode' = 20] (acknowledge admin command):
+	* [p_mode]		-> 20
+	* [a_id]		-> ID of the command returned by p_mode 14
+	* ***************************************************************************
+	* * for ['p_mode' = 21] (fetch datasets following a cursor):
+	* [p_mode]		-> 21
+	* [p_after]		-> (optional) ID of the last dataset fetched so far. If not provided, the cursor to start with is
+	*				   returned: before the oldest dataset not fetched by p_mode 2 yet (archived = 0, only datasets saved
+	*				   before the upgrade from p_mode 2, index archived_id), otherwise the ID of the newest dataset (only
+	*				   datasets saved from now on are fetched).
+	* [p_limit]		-> (optional) maximum number of datasets (default and maximum: 1000)
+	* [p_station]	-> (optional) only fetch datasets of this weather station
+	* ***************************************************************************
+	* * for ['p_mode' = 22] (aggregate the datasets following a cursor per archive interval):
+	* [p_mode]		-> 22
+	* [p_after]		-> ID of the last dataset fetched so far
+	* [p_interval]	-> archive interval in seconds (intervals include their end like in WeeWx)
+	* [p_before]	-> start of the current archive interval: the datasets from the first one captured after this
+	*				   time on are left to be fetched by p_mode 21
+	* [p_since]		-> (optional) end of the newest archived interval: older datasets are skipped (default: 0)
+	* [p_station]	-> (optional) only aggregate datasets of this weather station (default: 'main')
+	* Reply: ['__SUCCESS;', {'cursor': ID of the last dataset aggregated}, intervals ...] (oldest first: end of the
+	*		 interval 't_end', number of datasets 'datasets', mean of every sensor value weighted by the samples of the
+	*		 datasets, maximum wind speed 'wind_max')
+	* ***************************************************************************
 	*/
 	if(isset($_POST['p_mode']))
 	{
@@ -134,6 +207,8 @@
 		
 		// get login data	
 		include("db_config.php");
+		// station ID of datasets provided without one (single station setups)
+		define("DEFAULT_STATION", "main");
 		
 		// connect to database
 		$connection1=mysqli_connect(MYSQL_HOST, MYSQL_USER, MYSQL_PASS, MYSQL_DB1) 
@@ -152,10 +227,12 @@
 				$rad_cmp1 = isset($_POST['p_rad_cmp1']) ? mysqli_real_escape_string($connection1, $_POST['p_rad_cmp1']) : 'NULL';
 				$rad_cmp2 = isset($_POST['p_rad_cmp2']) ? mysqli_real_escape_string($connection1, $_POST['p_rad_cmp2']) : 'NULL';
 				$rad_cmp3 = isset($_POST['p_rad_cmp3']) ? mysqli_real_escape_string($connection1, $_POST['p_rad_cmp3']) : 'NULL';
-				// build query
+				$station = isset($_POST['p_station']) ? get_station_id($_POST['p_station']) : DEFAULT_STATION;
+				if($station === false) die("[ERROR_28] Invalid station ID provided!");
+				// build query (archived = 1: fetched by the WeeWx Driver with a cursor, the flag is only used by p_mode 2)
 				mysqli_query($connection1, "INSERT INTO sensor_datasets 
-				(temp, wind, spn1_radTot, spn1_radDiff, spn1_sun, rad_cmp1, rad_cmp2, rad_cmp3, t_unix, archived) 
-				VALUES (".$temp.", ".$wind.", ".$spn1_radTot.", ".$spn1_radDiff.", ".$spn1_sun.", ".$rad_cmp1.", ".$rad_cmp2.", ".$rad_cmp3.", UNIX_TIMESTAMP(), '0')") 
+				(station, temp, wind, spn1_radTot, spn1_radDiff, spn1_sun, rad_cmp1, rad_cmp2, rad_cmp3, t_unix, archived) 
+				VALUES ('".$station."', ".$temp.", ".$wind.", ".$spn1_radTot.", ".$spn1_radDiff.", ".$spn1_sun.", ".$rad_cmp1.", ".$rad_cmp2.", ".$rad_cmp3.", UNIX_TIMESTAMP(), '1')") 
 				or die("[ERROR_02] Could not insert new dataset into the database!");
 				echo "__SUCCESS;";
 				break;
@@ -163,18 +240,26 @@
 			case 2: // Fetching sensor data that has not yet been recorded and achived by WeeWx (used by WeeWx Driver)
 			{		
 				$sensor_data_array = array();
+				$station_filter = ""; // fetch datasets of all stations if no station is specified
+				if(isset($_POST['p_station']))
+				{
+					$station = get_station_id($_POST['p_station']);
+					if($station === false) die("[ERROR_28] Invalid station ID provided!");
+					$station_filter = " AND station='$station'";
+				}
 				// Select all datasets in primary database that have not been fetched by WeeWx yet
-				$result_query = mysqli_query($connection1, "SELECT temp, wind, spn1_radTot, spn1_radDiff, spn1_sun, rad_cmp1, rad_cmp2, rad_cmp3, t_unix
-				 FROM sensor_datasets WHERE archived='0'") or die("[ERROR_03] Could not fetch datasets from the database!");	 
+				$result_query = mysqli_query($connection1, "SELECT station, temp, wind, spn1_radTot, spn1_radDiff, spn1_sun, rad_cmp1, rad_cmp2, rad_cmp3, t_unix
+				 FROM sensor_datasets WHERE archived='0'".$station_filter) or die("[ERROR_03] Could not fetch datasets from the database!");	 
 				// If there are datasets that have not been fetched by WeeWx yet, mark them as fetched (set archived=1)	 
 				$new_dataset_count = mysqli_num_rows($result_query); 
 				if($new_dataset_count != 0)
 				{ 
-					mysqli_query($connection1, "UPDATE sensor_datasets SET archived='1' WHERE archived='0'") 
+					mysqli_query($connection1, "UPDATE sensor_datasets SET archived='1' WHERE archived='0'".$station_filter) 
 					or die("[ERROR_04] Could not modify archive status of datasets in the database!");								
 					while($row = mysqli_fetch_assoc($result_query))
 					{
 						$sensor_data_array[] = array(
+													 'station' => $row['station'],
 													 'temp' => $row['temp'],
 													 'wind' => $row['wind'],
 													 'spn1_radTot' => $row['spn1_radTot'],
@@ -210,13 +295,28 @@
 			case 4: // Get latest sensor reading dataset from primary database to display in GUI 'current conditions'
 			{		
 				$sensor_dataset = array();
-				$result_query = mysqli_query($connection1, "SELECT * FROM sensor_datasets ORDER BY id DESC LIMIT 1") 
+				$station_filter = ""; // latest dataset of any station if no station is specified
+				if(isset($_POST['p_station']))
+				{
+					$station = get_station_id($_POST['p_station']);
+					if($station === false) die("[ERROR_28] Invalid station ID provided!");
+					$station_filter = " WHERE station='$station'";
+				}
+				// Samples kept in memory by the CoSESServer are newer than the datasets in the database (no query needed)
+				$reply = query_local_endpoint(isset($station) ? "latest ".$station : "latest");
+				if(is_array($reply) && $reply[0] == '__SUCCESS;')
+				{
+					echo json_encode($reply);
+					break;
+				}
+				$result_query = mysqli_query($connection1, "SELECT * FROM sensor_datasets".$station_filter." ORDER BY id DESC LIMIT 1") 
 				or die("[ERROR_07] Failed to fetch latest sensor dataset!");	
 				$result_count = mysqli_num_rows($result_query); 
 				if($result_count != 0)
 				{ 				
 					$row = mysqli_fetch_array($result_query, MYSQLI_ASSOC);
 					$sensor_dataset[] = array(
+											'station' => $row['station'],
 											'temp' => $row['temp'],
 											'wind' => $row['wind'],
 											'spn1_radTot' => $row['spn1_radTot'],
@@ -434,10 +534,18 @@
 				if(is_user_request_valid($connection1, $user, $pass, true)) // authenticated, trusted user
 				{						
 					$reason=mysqli_real_escape_string($connection1, $_POST['a_reason']);
+					$action = 'Microcontroller reset'; // reset all stations if no station is specified
+					if(isset($_POST['a_station']) && $_POST['a_station'] != '')
+					{
+						$station = get_station_id($_POST['a_station']);
+						if($station === false) die("[ERROR_28] Invalid station ID provided!");
+						$action .= ': '.$station;
+					}
 				
 					// log system activity with priority '2' -> (System Event: Will be set from '99' to '2' when command processed)
 					mysqli_query($connection1, "INSERT INTO admin_log (user, action, reason, priority) 
-					VALUES ('$user', 'Microcontroller reset', '$reason', '99')") or die("[ERROR_18] Failed to save system event!");	
+					VALUES ('$user', '$action', '$reason', '99')") or die("[ERROR_18] Failed to save system event!");	
+					query_local_endpoint("command"); // wake up the CoSESServer (otherwise the command is found by its next check)
 					echo "__SUCCESS;";													
 				}	
 				else echo "[ADMIN_ERROR_AUTH] User not authenticated!";	
@@ -455,6 +563,7 @@
 					// log system activity with priority '2' -> (System Event: Will be set from '99' to '2' when command processed)
 					mysqli_query($connection1, "INSERT INTO admin_log (user, action, reason, priority) 
 					VALUES ('$user', 'System restart', '$reason', '99')") or die("[ERROR_19] Failed to save system event!");	
+					query_local_endpoint("command"); // wake up the CoSESServer (otherwise the command is found by its next check)
 					echo "__SUCCESS;";																
 				}	
 				else echo "[ADMIN_ERROR_AUTH] User not authenticated!";		
@@ -522,17 +631,17 @@
 			}		
 			case 14: // Check for submitted admin commands
 			{											
-				$result_query = mysqli_query($connection1, "SELECT action FROM admin_log WHERE priority='99' LIMIT 1") 
+				// commands waiting for execution have priority '99' (index priority_id: no table scan)
+				$result_query = mysqli_query($connection1, "SELECT id, action FROM admin_log WHERE priority='99' ORDER BY id ASC LIMIT 1") 
 				or die("[ERROR_22] Failed to query users table in database!");
 				if(!mysqli_num_rows($result_query)) // no admin commands waiting for execution
 				{
 					echo json_encode('_NO_COMMANDS;');	
 				}
-				else // admin commands waiting for execution
+				else // admin commands waiting for execution (acknowledged by the CoSESServer with p_mode 20)
 				{			
 					$row = mysqli_fetch_array($result_query, MYSQLI_ASSOC);
-					mysqli_query($connection1, "UPDATE admin_log SET priority='2' WHERE priority='99'");
-					$return_array[] = array('cmd' => $row['action']);			
+					$return_array[] = array('id' => $row['id'], 'cmd' => $row['action']);			
 					array_unshift($return_array, '__SUCCESS;');
 					echo json_encode($return_array);	
 				}
@@ -556,10 +665,17 @@
 						$date_stop=mysqli_real_escape_string($connection1, $_POST['d_stop']);
 						$step=mysqli_real_escape_string($connection1, $_POST['d_step']);
 						$sensor_array = explode(", ",$sensors);	// split sensor_string into array						
+						$station_filter = ""; // export datasets of all stations if no station is specified
+						if(isset($_POST['d_station']) && $_POST['d_station'] != '')
+						{
+							$station = get_station_id($_POST['d_station']);
+							if($station === false) die("[ERROR_28] Invalid station ID provided!");
+							$station_filter = " AND station='$station'";
+						}
 
 						// get all datasets within the specified time range
 						$query_export = "SELECT $sensors, t_unix FROM sensor_datasets WHERE t_unix >= UNIX_TIMESTAMP('$date_start') 
-						AND t_unix < UNIX_TIMESTAMP('$date_stop') ORDER BY t_unix";						
+						AND t_unix < UNIX_TIMESTAMP('$date_stop')".$station_filter." ORDER BY t_unix";						
 						$result_query = mysqli_query($connection1, $query_export) or die("[ERROR_23] Failed to query sensor table in database!");
 						
 						if(!mysqli_num_rows($result_query)) // no data matching request - database did not return any rows for executed query
@@ -732,12 +848,284 @@
 				else echo json_encode('[USER_ERROR_AUTH] User not authenticated!');													
 				mysqli_free_result($result_query);	
 				break;								
-			}							
+			}
+			case 16: // Saving a batch of sensor datasets received from Controllino over TCP socket into primary database
+			{
+				$datasets = isset($_POST['p_datasets']) ? json_decode($_POST['p_datasets'], true) : NULL;
+				if(!is_array($datasets) || count($datasets) == 0 || count($datasets) > 1000) die("[ERROR_26] Invalid batch of datasets provided!");
+				$sensor_columns = array('temp', 'wind', 'spn1_radTot', 'spn1_radDiff', 'spn1_sun', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3');
+				// statistics of downsampled datasets (mean = sensor value, min/max/std of the interval, number of samples)
+				foreach(array('temp', 'wind', 'spn1_radTot', 'spn1_radDiff', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3') as $column)
+				{
+					array_push($sensor_columns, $column.'_min', $column.'_max', $column.'_std');
+				}
+				$sensor_columns[] = 'samples';
+				$values_array = array();
+				$batch_keys = array(); // station and key of every dataset (in the order of the batch)
+				foreach($datasets as $dataset)
+				{
+					$station = isset($dataset['station']) ? get_station_id($dataset['station']) : DEFAULT_STATION;
+					if($station === false) die("[ERROR_28] Invalid station ID provided!");
+					$row = array("'".$station."'");
+					// only numeric values are accepted - everything else is saved as NULL (invalid reading)
+					foreach($sensor_columns as $column)$row[] = (isset($dataset[$column]) && is_numeric($dataset[$column])) ? $dataset[$column] : 'NULL';
+					// capture time of the dataset (falls back to time of insertion)
+					$row[] = (isset($dataset['t_unix']) && is_numeric($dataset['t_unix'])) ? intval($dataset['t_unix']) : 'UNIX_TIMESTAMP()';
+					// key of the dataset (decimal string, datasets without a key are always inserted)
+					$key = (isset($dataset['dataset_key']) && ctype_digit((string)$dataset['dataset_key'])) ? (string)$dataset['dataset_key'] : NULL;
+					$row[] = $key === NULL ? 'NULL' : "'".$key."'";
+					$batch_keys[] = array($station, $key);
+					$row[] = "'1'"; // archived: fetched by the WeeWx Driver with a cursor (the flag is only used by p_mode 2)
+					$values_array[] = "(".implode(", ", $row).")";
+				}
+				// the table is locked while saving: no other writer (e.g. p_mode 1, CoSESServer.py --replay) can insert rows
+				// between the newest dataset before the batch and the saved datasets (CoSESServer local feed)
+				mysqli_query($connection1, "LOCK TABLES sensor_datasets WRITE") 
+				or die("[ERROR_37] Could not read the IDs of the saved datasets!");
+				$result_query = mysqli_query($connection1, "SELECT COALESCE(MAX(id), 0) AS id FROM sensor_datasets") 
+				or die("[ERROR_37] Could not read the IDs of the saved datasets!");
+				$row = mysqli_fetch_assoc($result_query);
+				mysqli_free_result($result_query);
+				$id_previous = $row['id'];
+				// build one multi-row query for the whole batch. Datasets that have been saved already (same station, capture
+				// time and key, e.g. spooled by the CoSESServer after a request timed out but was committed) are skipped
+				mysqli_query($connection1, "INSERT INTO sensor_datasets 
+				(station, ".implode(", ", $sensor_columns).", t_unix, dataset_key, archived) 
+				VALUES ".implode(", ", $values_array)." ON DUPLICATE KEY UPDATE id = id") 
+				or die("[ERROR_27] Could not insert new datasets into the database!");
+				// IDs of the saved datasets (0 = saved already): the new rows follow the order of the batch (table locked)
+				$result_query = mysqli_query($connection1, "SELECT id, station, dataset_key FROM sensor_datasets WHERE id > ".intval($id_previous)." ORDER BY id") 
+				or die("[ERROR_37] Could not read the IDs of the saved datasets!");
+				$rows_saved = array();
+				while($row = mysqli_fetch_assoc($result_query))$rows_saved[] = $row;
+				mysqli_free_result($result_query);
+				mysqli_query($connection1, "UNLOCK TABLES");
+				$ids = array();
+				$i = 0;
+				foreach($batch_keys as $batch_key)
+				{
+					$row = isset($rows_saved[$i]) ? $rows_saved[$i] : NULL;
+					// a dataset without a row of its own (same station and key) has been skipped: saved already
+					if($row !== NULL && $row['station'] === $batch_key[0] && $row['dataset_key'] === $batch_key[1])
+					{
+						$ids[] = $row['id'];
+						$i++;
+					}
+					else $ids[] = 0;
+				}
+				echo "__SUCCESS;".$id_previous.";".implode(",", $ids);
+				break;
+			}
+			case 17: // Get the latest samples of a station kept in memory by the CoSESServer (short history)
+			{
+				$station = isset($_POST['p_station']) ? get_station_id($_POST['p_station']) : false;
+				if($station === false) die("[ERROR_28] Invalid station ID provided!");
+				$request = "history ".$station;
+				if(isset($_POST['p_count'])) $request .= " ".intval($_POST['p_count']);
+				$reply = query_local_endpoint($request);
+				if($reply === false) die("[ERROR_29] CoSESServer local endpoint not available!");
+				echo json_encode($reply);
+				break;
+			}
+			case 18: // Saving a batch of summaries (rolling aggregates of completed periods) into primary database
+			{
+				$summaries = isset($_POST['p_summaries']) ? json_decode($_POST['p_summaries'], true) : NULL;
+				if(!is_array($summaries) || count($summaries) == 0 || count($summaries) > 1000) die("[ERROR_30] Invalid batch of summaries provided!");
+				$values_array = array();
+				foreach($summaries as $summary)
+				{
+					$station = isset($summary['station']) ? get_station_id($summary['station']) : DEFAULT_STATION;
+					if($station === false) die("[ERROR_28] Invalid station ID provided!");
+					if(!isset($summary['sensor']) || !in_array($summary['sensor'], array('temp', 'wind', 'spn1_radTot', 'spn1_radDiff', 'spn1_sun', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3'), true)
+					|| !isset($summary['period']) || !is_numeric($summary['period']) || !isset($summary['t_unix']) || !is_numeric($summary['t_unix'])) die("[ERROR_30] Invalid batch of summaries provided!");
+					$row = array("'".$station."'", intval($summary['period']), intval($summary['t_unix']), "'".$summary['sensor']."'");
+					foreach(array('mean', 'min', 't_min', 'max', 't_max', 'energy', 'samples') as $column)
+					{
+						$row[] = (isset($summary[$column]) && is_numeric($summary[$column])) ? $summary[$column] : 'NULL';
+					}
+					$values_array[] = "(".implode(", ", $row).")";
+				}
+				// build one multi-row query for the whole batch (summaries that have already been saved are replaced)
+				mysqli_query($connection1, "REPLACE INTO sensor_aggregates 
+				(station, period, t_unix, sensor, mean, min, t_min, max, t_max, energy, samples) 
+				VALUES ".implode(", ", $values_array)) 
+				or die("[ERROR_31] Could not insert new summaries into the database!");
+				echo "__SUCCESS;";
+				break;
+			}
+			case 19: // Get summaries (rolling aggregates)
+			{
+				$station_filter = "";
+				if(isset($_POST['p_station']))
+				{
+					$station = get_station_id($_POST['p_station']);
+					if($station === false) die("[ERROR_28] Invalid station ID provided!");
+					$station_filter = " AND station='$station'";
+				}
+				if(!isset($_POST['p_period'])) // current rolling aggregates kept in memory by the CoSESServer
+				{
+					$reply = query_local_endpoint(isset($station) ? "summary ".$station : "summary");
+					if($reply === false) die("[ERROR_29] CoSESServer local endpoint not available!");
+					echo json_encode($reply);
+					break;
+				}
+				$period = intval($_POST['p_period']);
+				$start = isset($_POST['p_start']) ? intval($_POST['p_start']) : 0;
+				$stop = isset($_POST['p_stop']) ? intval($_POST['p_stop']) : time();
+				$result_query = mysqli_query($connection1, "SELECT station, period, t_unix, sensor, mean, min, t_min, max, t_max, energy, samples 
+				FROM sensor_aggregates WHERE period='$period' AND t_unix BETWEEN '$start' AND '$stop'".$station_filter." ORDER BY t_unix ASC, sensor ASC LIMIT 10000") 
+				or die("[ERROR_32] Failed to fetch summaries!");
+				$summaries = array();
+				while($row = mysqli_fetch_array($result_query, MYSQLI_ASSOC))$summaries[] = $row;
+				mysqli_free_result($result_query);
+				if(count($summaries) == 0)
+				{
+					echo json_encode('__SUCCESS;__NO_ROWS_RETURNED;');
+					break;
+				}
+				array_unshift($summaries, '__SUCCESS;'); // operation successful
+				echo json_encode($summaries); // return data in json format
+				break;
+			}
+			case 20: // Acknowledge an admin command (set from priority '99' to '2' -> System Event)
+			{
+				if(!isset($_POST['a_id']) || !ctype_digit((string)$_POST['a_id'])) die("[ERROR_33] Invalid command ID provided!");
+				$id = intval($_POST['a_id']);
+				mysqli_query($connection1, "UPDATE admin_log SET priority='2' WHERE id='$id' AND priority='99'") 
+				or die("[ERROR_34] Failed to acknowledge admin command!");
+				echo "__SUCCESS;";
+				break;
+			}
+			case 21: // Fetching the datasets following a cursor (used by WeeWx Driver, range scan on the primary key)
+			{
+				// datasets of different stations are never aggregated into one record
+				$station = DEFAULT_STATION;
+				if(isset($_POST['p_station']))
+				{
+					$station = get_station_id($_POST['p_station']);
+					if($station === false) die("[ERROR_28] Invalid station ID provided!");
+				}
+				$station_filter = " AND station='$station'";
+				if(!isset($_POST['p_after'])) // cursor to start with: oldest dataset not fetched by p_mode 2, or newest dataset
+				{
+					// new datasets are inserted as archived: only datasets saved before the upgrade from p_mode 2 are found
+					$result_query = mysqli_query($connection1, "SELECT MIN(id) - 1 AS id FROM sensor_datasets WHERE archived='0'".$station_filter) 
+					or die("[ERROR_36] Could not fetch datasets from the database!");
+					$row = mysqli_fetch_assoc($result_query);
+					mysqli_free_result($result_query);
+					if($row['id'] === NULL) // all datasets have been fetched
+					{
+						$result_query = mysqli_query($connection1, "SELECT MAX(id) AS id FROM sensor_datasets WHERE 1".$station_filter) 
+						or die("[ERROR_36] Could not fetch datasets from the database!");
+						$row = mysqli_fetch_assoc($result_query);
+						mysqli_free_result($result_query);
+					}
+					echo json_encode(array('__SUCCESS;', array('cursor' => intval($row['id']))));
+					break;
+				}
+				$limit = isset($_POST['p_limit']) ? $_POST['p_limit'] : "1000";
+				if(!ctype_digit((string)$_POST['p_after']) || !ctype_digit((string)$limit) || intval($limit) < 1) die("[ERROR_35] Invalid cursor provided!");
+				$after = intval($_POST['p_after']);
+				$limit = min(intval($limit), 1000);
+				// only the rows following the cursor are read (primary key or index station_id), independent of the table size
+				$result_query = mysqli_query($connection1, "SELECT id, station, temp, wind, spn1_radTot, spn1_radDiff, spn1_sun, rad_cmp1, rad_cmp2, rad_cmp3, t_unix
+				 FROM sensor_datasets WHERE id > '$after'".$station_filter." ORDER BY id ASC LIMIT $limit") or die("[ERROR_36] Could not fetch datasets from the database!");
+				$sensor_data_array = array();
+				while($row = mysqli_fetch_assoc($result_query))$sensor_data_array[] = $row;
+				mysqli_free_result($result_query);
+				if(count($sensor_data_array) == 0)
+				{
+					echo json_encode('__NO_ROWS_RETURNED;');
+					break;
+				}
+				array_unshift($sensor_data_array, '__SUCCESS;'); // operation successful
+				echo json_encode($sensor_data_array); // return data in json format
+				break;
+			}
+			case 22: // Aggregating the datasets following a cursor per archive interval (used by WeeWx Driver, backlog)
+			{
+				// datasets of different stations are never aggregated into one record
+				$station = DEFAULT_STATION;
+				if(isset($_POST['p_station']))
+				{
+					$station = get_station_id($_POST['p_station']);
+					if($station === false) die("[ERROR_28] Invalid station ID provided!");
+				}
+				$station_filter = " AND station='$station'";
+				if(!isset($_POST['p_after']) || !ctype_digit((string)$_POST['p_after'])) die("[ERROR_35] Invalid cursor provided!");
+				$since = isset($_POST['p_since']) ? $_POST['p_since'] : "0";
+				if(!isset($_POST['p_interval']) || !ctype_digit((string)$_POST['p_interval']) || intval($_POST['p_interval']) < 1 ||
+				   !isset($_POST['p_before']) || !ctype_digit((string)$_POST['p_before']) || !ctype_digit((string)$since))
+				   die("[ERROR_38] Invalid archive interval provided!");
+				$after = intval($_POST['p_after']);
+				$interval = intval($_POST['p_interval']);
+				$before = intval($_POST['p_before']);
+				$since = intval($since);
+				// the backlog ends before the first dataset of the current interval (left to the loop packets of the driver)
+				$result_query = mysqli_query($connection1, "SELECT MIN(id) AS id FROM sensor_datasets WHERE id > '$after' AND t_unix > '$before'".$station_filter) 
+				or die("[ERROR_39] Could not aggregate datasets in the database!");
+				$row = mysqli_fetch_assoc($result_query);
+				mysqli_free_result($result_query);
+				$id_filter = $row['id'] === NULL ? "" : " AND id < '".intval($row['id'])."'";
+				$result_query = mysqli_query($connection1, "SELECT MAX(id) AS id FROM sensor_datasets WHERE id > '$after'".$id_filter.$station_filter) 
+				or die("[ERROR_39] Could not aggregate datasets in the database!");
+				$row = mysqli_fetch_assoc($result_query);
+				mysqli_free_result($result_query);
+				if($row['id'] === NULL)
+				{
+					echo json_encode('__NO_ROWS_RETURNED;');
+					break;
+				}
+				$last = intval($row['id']);
+				// one row per interval (end of the interval: ceil with integer arithmetic), datasets of archived intervals are skipped
+				// a downsampled dataset is the mean of 'samples' samples and is weighted by them (datasets without: 1)
+				$means = "";
+				foreach(array('temp', 'wind', 'spn1_radTot', 'spn1_radDiff', 'spn1_sun', 'rad_cmp1', 'rad_cmp2', 'rad_cmp3') as $column)
+					$means .= " SUM($column * COALESCE(samples, 1)) / SUM(CASE WHEN $column IS NULL THEN NULL ELSE COALESCE(samples, 1) END) AS $column,";
+				$result_query = mysqli_query($connection1, "SELECT t_unix - (t_unix - 1) % $interval - 1 + $interval AS t_end, COUNT(*) AS datasets,".$means."
+				 MAX(wind) AS wind_max FROM sensor_datasets WHERE id > '$after' AND id <= '$last' AND t_unix > '$since'".$station_filter." GROUP BY t_end ORDER BY t_end ASC") 
+				or die("[ERROR_39] Could not aggregate datasets in the database!");
+				$intervals = array('__SUCCESS;', array('cursor' => $last)); // operation successful
+				while($row = mysqli_fetch_assoc($result_query))$intervals[] = $row;
+				mysqli_free_result($result_query);
+				echo json_encode($intervals); // return data in json format
+				break;
+			}
 		}
 		mysqli_close($connection1);				
 	}	
 	// *** FUNCTIONS *** //	
 	/*
+	* This function sends a request to the local endpoint (Unix socket) of the CoSESServer and returns the decoded reply.
+	* Returns false if the CoSESServer is not running or did not reply in time.
+	*/
+	function query_local_endpoint($request)
+	{
+		/*  *** Function Parameters ***
+		 *  $request 	-> (string) request line (e.g. 'latest' or 'history <station> <count>')
+		*/
+		if(!defined('LOCAL_ENDPOINT'))return false;
+		$sock = @stream_socket_client(LOCAL_ENDPOINT, $errno, $errstr, 0.5);
+		if(!$sock)return false;
+		stream_set_timeout($sock, 1);
+		fwrite($sock, $request."\n");
+		$reply = json_decode(stream_get_contents($sock), true);
+		fclose($sock);
+		if($reply === NULL)return false;
+		return $reply;
+	}
+	/*
+	* This function validates the ID of a weather station (letters, digits, '_' and '-', at most 16 chars).
+	*/
+	function get_station_id($station)
+	{
+		/*  *** Function Parameters ***
+		 *  $station 	-> (string) station ID provided by the request
+		*/
+		if(is_string($station) && preg_match('/^[A-Za-z0-9_-]{1,16}$/', $station))return $station;
+		else return false;
+	}
+	/*
 	* This function checks if the user sending a query request to the database is authenticated.
 	*/
 	function is_user_request_valid($connDB, $request_user, $request_pass, $admin_required)
@@ -39,12 +39,34 @@ CREATE TABLE `admin_log` (
 
 -- --------------------------------------------------------
 
+--
+-- Tabellenstruktur für Tabelle `sensor_aggregates`
+--
+
+CREATE TABLE `sensor_aggregates` (
+  `id` int(10) UNSIGNED NOT NULL,
+  `station` varchar(16) NOT NULL DEFAULT 'main',
+  `period` int(10) UNSIGNED NOT NULL,
+  `t_unix` int(10) UNSIGNED NOT NULL,
+  `sensor` varchar(16) NOT NULL,
+  `mean` float DEFAULT NULL,
+  `min` float DEFAULT NULL,
+  `t_min` int(10) UNSIGNED DEFAULT NULL,
+  `max` float DEFAULT NULL,
+  `t_max` int(10) UNSIGNED DEFAULT NULL,
+  `energy` float DEFAULT NULL,
+  `samples` int(10) UNSIGNED DEFAULT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- --------------------------------------------------------
+
 --
 -- Tabellenstruktur für Tabelle `sensor_datasets`
 --
 
 CREATE TABLE `sensor_datasets` (
   `id` int(10) UNSIGNED NOT NULL,
+  `station` varchar(16) NOT NULL DEFAULT 'main',
   `temp` float DEFAULT NULL,
   `wind` float DEFAULT NULL,
   `spn1_radTot` float DEFAULT NULL,
@@ -53,8 +75,31 @@ CREATE TABLE `sensor_datasets` (
   `rad_cmp1` float DEFAULT NULL,
   `rad_cmp2` float DEFAULT NULL,
   `rad_cmp3` float DEFAULT NULL,
+  `temp_min` float DEFAULT NULL,
+  `temp_max` float DEFAULT NULL,
+  `temp_std` float DEFAULT NULL,
+  `wind_min` float DEFAULT NULL,
+  `wind_max` float DEFAULT NULL,
+  `wind_std` float DEFAULT NULL,
+  `spn1_radTot_min` float DEFAULT NULL,
+  `spn1_radTot_max` float DEFAULT NULL,
+  `spn1_radTot_std` float DEFAULT NULL,
+  `spn1_radDiff_min` float DEFAULT NULL,
+  `spn1_radDiff_max` float DEFAULT NULL,
+  `spn1_radDiff_std` float DEFAULT NULL,
+  `rad_cmp1_min` float DEFAULT NULL,
+  `rad_cmp1_max` float DEFAULT NULL,
+  `rad_cmp1_std` float DEFAULT NULL,
+  `rad_cmp2_min` float DEFAULT NULL,
+  `rad_cmp2_max` float DEFAULT NULL,
+  `rad_cmp2_std` float DEFAULT NULL,
+  `rad_cmp3_min` float DEFAULT NULL,
+  `rad_cmp3_max` float DEFAULT NULL,
+  `rad_cmp3_std` float DEFAULT NULL,
+  `samples` smallint(5) UNSIGNED DEFAULT NULL,
   `t_unix` int(10) UNSIGNED NOT NULL,
-  `archived` tinyint(1) NOT NULL DEFAULT '0'
+  `dataset_key` int(10) UNSIGNED DEFAULT NULL,
+  `archived` tinyint(1) NOT NULL DEFAULT '1'
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- --------------------------------------------------------
@@ -81,13 +126,24 @@ CREATE TABLE `users` (
 -- Indizes für die Tabelle `admin_log`
 --
 ALTER TABLE `admin_log`
-  ADD PRIMARY KEY (`id`);
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `priority_id` (`priority`,`id`);
+
+--
+-- Indizes für die Tabelle `sensor_aggregates`
+--
+ALTER TABLE `sensor_aggregates`
+  ADD PRIMARY KEY (`id`),
+  ADD UNIQUE KEY `station_period` (`station`,`period`,`t_unix`,`sensor`);
 
 --
 -- Indizes für die Tabelle `sensor_datasets`
 --
 ALTER TABLE `sensor_datasets`
-  ADD PRIMARY KEY (`id`);
+  ADD PRIMARY KEY (`id`),
+  ADD KEY `station_id` (`station`,`id`),
+  ADD KEY `archived_id` (`archived`,`id`),
+  ADD UNIQUE KEY `station_time_key` (`station`,`t_unix`,`dataset_key`);
 
 --
 -- Indizes für die Tabelle `users`
@@ -106,6 +162,11 @@ ALTER TABLE `users`
 ALTER TABLE `admin_log`
   MODIFY `id` int(10) UNSIGNED NOT NULL AUTO_INCREMENT;
 --
+-- AUTO_INCREMENT für Tabelle `sensor_aggregates`
+--
+ALTER TABLE `sensor_aggregates`
+  MODIFY `id` int(10) UNSIGNED NOT NULL AUTO_INCREMENT;
+--
 -- AUTO_INCREMENT für Tabelle `sensor_datasets`
 --
 ALTER TABLE `sensor_datasets`
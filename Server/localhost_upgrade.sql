@@ -0,0 +1,85 @@
+-- Upgrade of an existing CoSESWeather_DB (created with an older localhost.sql).
+-- New installations import localhost.sql, which already contains all changes below.
+-- Statements are grouped by the change that introduced them and must be executed in order.
+
+USE `CoSESWeather_DB`;
+
+--
+-- Multiple weather stations: datasets are tagged with the ID of the station that acquired them
+--
+ALTER TABLE `sensor_datasets`
+  ADD `station` varchar(16) NOT NULL DEFAULT 'main' AFTER `id`,
+  ADD KEY `station_id` (`station`,`id`);
+
+--
+-- Downsampling: datasets hold the mean (sensor columns), minimum, maximum and standard deviation of an interval
+--
+ALTER TABLE `sensor_datasets`
+  ADD `temp_min` float DEFAULT NULL,
+  ADD `temp_max` float DEFAULT NULL,
+  ADD `temp_std` float DEFAULT NULL,
+  ADD `wind_min` float DEFAULT NULL,
+  ADD `wind_max` float DEFAULT NULL,
+  ADD `wind_std` float DEFAULT NULL,
+  ADD `spn1_radTot_min` float DEFAULT NULL,
+  ADD `spn1_radTot_max` float DEFAULT NULL,
+  ADD `spn1_radTot_std` float DEFAULT NULL,
+  ADD `spn1_radDiff_min` float DEFAULT NULL,
+  ADD `spn1_radDiff_max` float DEFAULT NULL,
+  ADD `spn1_radDiff_std` float DEFAULT NULL,
+  ADD `rad_cmp1_min` float DEFAULT NULL,
+  ADD `rad_cmp1_max` float DEFAULT NULL,
+  ADD `rad_cmp1_std` float DEFAULT NULL,
+  ADD `rad_cmp2_min` float DEFAULT NULL,
+  ADD `rad_cmp2_max` float DEFAULT NULL,
+  ADD `rad_cmp2_std` float DEFAULT NULL,
+  ADD `rad_cmp3_min` float DEFAULT NULL,
+  ADD `rad_cmp3_max` float DEFAULT NULL,
+  ADD `rad_cmp3_std` float DEFAULT NULL,
+  ADD `samples` smallint(5) UNSIGNED DEFAULT NULL;
+
+--
+-- Rolling aggregates: summaries (mean, min, max, energy) of 1 min, 5 min, 1 h and daily periods
+--
+CREATE TABLE `sensor_aggregates` (
+  `id` int(10) UNSIGNED NOT NULL,
+  `station` varchar(16) NOT NULL DEFAULT 'main',
+  `period` int(10) UNSIGNED NOT NULL,
+  `t_unix` int(10) UNSIGNED NOT NULL,
+  `sensor` varchar(16) NOT NULL,
+  `mean` float DEFAULT NULL,
+  `min` float DEFAULT NULL,
+  `t_min` int(10) UNSIGNED DEFAULT NULL,
+  `max` float DEFAULT NULL,
+  `t_max` int(10) UNSIGNED DEFAULT NULL,
+  `energy` float DEFAULT NULL,
+  `samples` int(10) UNSIGNED DEFAULT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+ALTER TABLE `sensor_aggregates`
+  ADD PRIMARY KEY (`id`),
+  ADD UNIQUE KEY `station_period` (`station`,`period`,`t_unix`,`sensor`),
+  MODIFY `id` int(10) UNSIGNED NOT NULL AUTO_INCREMENT;
+
+--
+-- Admin commands: waiting commands (priority 99) are looked up by index
+--
+ALTER TABLE `admin_log`
+  ADD KEY `priority_id` (`priority`,`id`);
+
+--
+-- Idempotent saving: the CoSESServer assigns a key to every dataset, a dataset is unique per station, capture time and
+-- key (a batch spooled by the CoSESServer after a request timed out can be saved again). Datasets without a key
+-- (saved before the upgrade or by p_mode 1) are never treated as duplicates
+--
+ALTER TABLE `sensor_datasets`
+  ADD `dataset_key` int(10) UNSIGNED DEFAULT NULL AFTER `t_unix`,
+  ADD UNIQUE KEY `station_time_key` (`station`,`t_unix`,`dataset_key`);
+
+--
+-- WeeWx Driver cursor: new datasets are inserted as archived (the flag is only used by p_mode 2), the datasets saved
+-- before the upgrade that have not been fetched by p_mode 2 yet are looked up by index
+--
+ALTER TABLE `sensor_datasets`
+  ALTER `archived` SET DEFAULT '1',
+  ADD KEY `archived_id` (`archived`,`id`);